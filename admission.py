@@ -0,0 +1,140 @@
+import os, math, time, asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import bridge_log
+import metrics
+
+ADMIT_ENABLED          = os.getenv("ADMIT_ENABLED", "1") == "1"
+ADMIT_MAX_INFLIGHT     = int(os.getenv("ADMIT_MAX_INFLIGHT", "256"))
+ADMIT_QUEUE_MAX        = int(os.getenv("ADMIT_QUEUE_MAX", "512"))
+ADMIT_QUEUE_TIMEOUT_MS = float(os.getenv("ADMIT_QUEUE_TIMEOUT_MS", "250"))
+ADMIT_PER_UUID_MAX     = int(os.getenv("ADMIT_PER_UUID_MAX", "4"))      # 0 = no per-device cap
+ADMIT_RETRY_MAX_S      = int(os.getenv("ADMIT_RETRY_MAX_S", "30"))
+
+log = bridge_log.get_logger("admission")
+
+ADMIT_INFLIGHT = metrics.Gauge("bridge_admission_inflight", "Ingest requests holding an admission slot")
+ADMIT_QUEUED   = metrics.Gauge("bridge_admission_queued", "Ingest requests waiting for an admission slot")
+ADMIT_REJECTED = metrics.Counter("bridge_admission_rejected_total", "Ingest requests turned away by admission control", ("reason",))
+ADMIT_WAIT     = metrics.Histogram("bridge_admission_wait_seconds", "Time spent waiting for an admission slot")
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds concurrent ingest work.
+
+    Up to max_inflight requests run at once; the next queue_max wait in FIFO
+    order for at most queue_timeout_ms and are then rejected with 503. A full
+    queue rejects right away. Retry-After is the time the current backlog
+    takes at the observed completion rate (EWMA), clamped to 1..retry_max_s.
+
+    With per_uuid_max > 0 a single device can hold (running + waiting) at most
+    that many slots; beyond it the request gets 429, so one chatty device
+    cannot occupy the queue.
+    """
+
+    def __init__(self, max_inflight: int = ADMIT_MAX_INFLIGHT, queue_max: int = ADMIT_QUEUE_MAX,
+                 queue_timeout_ms: float = ADMIT_QUEUE_TIMEOUT_MS, per_uuid_max: int = ADMIT_PER_UUID_MAX,
+                 retry_max_s: int = ADMIT_RETRY_MAX_S):
+        self.max_inflight = max(1, max_inflight)
+        self.queue_max = max(0, queue_max)
+        self.queue_timeout_s = max(0.0, queue_timeout_ms) / 1000.0
+        self.per_uuid_max = per_uuid_max
+        self.retry_max_s = retry_max_s
+        self.inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._per_uuid: Dict[str, int] = {}
+        self._rate = 0.0                 # completions per second (EWMA)
+        self._last_done = time.monotonic()
+        ADMIT_INFLIGHT.set_function(lambda: self.inflight)
+        ADMIT_QUEUED.set_function(lambda: len(self._waiters))
+
+    def retry_after_s(self) -> int:
+        backlog = self.inflight + len(self._waiters) + 1
+        if self._rate <= 0:
+            return self.retry_max_s
+        return max(1, min(self.retry_max_s, math.ceil(backlog / self._rate)))
+
+    def _reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        ADMIT_REJECTED.inc(reason)
+        log.info("ingest rejected", extra={"reason": reason, "inflight": self.inflight, "queued": len(self._waiters)})
+        return AdmissionRejected(status_code, reason, self.retry_after_s())
+
+    def _done(self) -> None:
+        now = time.monotonic()
+        dt = max(now - self._last_done, 1e-3)
+        self._last_done = now
+        self._rate = 0.9 * self._rate + 0.1 * (1.0 / dt)
+
+    async def _acquire(self) -> None:
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.queue_max:
+            raise self._reject(503, "queue_full")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return                          # slot handed over right at the deadline
+            fut.cancel()
+            raise self._reject(503, "timeout")
+        except asyncio.CancelledError:
+            # client went away while queued; hand on a slot that was already passed to us
+            if fut.done() and not fut.cancelled():
+                self._release()
+            fut.cancel()
+            raise
+        finally:
+            ADMIT_WAIT.observe(time.perf_counter() - t0)
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+
+    def _release(self) -> None:
+        self._done()
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)            # slot passes straight to the waiter
+                return
+        self.inflight -= 1
+
+    async def acquire(self, uuid: Optional[str] = None) -> None:
+        """Wait for a slot; raises AdmissionRejected. Every successful acquire() needs a release()."""
+        if uuid is not None and self.per_uuid_max > 0:
+            if self._per_uuid.get(uuid, 0) >= self.per_uuid_max:
+                raise self._reject(429, "per_uuid")
+            self._per_uuid[uuid] = self._per_uuid.get(uuid, 0) + 1
+        try:
+            await self._acquire()
+        except BaseException:
+            self._forget(uuid)
+            raise
+
+    def release(self, uuid: Optional[str] = None) -> None:
+        self._release()
+        self._forget(uuid)
+
+    def _forget(self, uuid: Optional[str]) -> None:
+        if uuid is None or self.per_uuid_max <= 0:
+            return
+        n = self._per_uuid.get(uuid, 1) - 1
+        if n:
+            self._per_uuid[uuid] = n
+        else:
+            self._per_uuid.pop(uuid, None)
@@ -1,14 +1,33 @@
-import json
 #!/usr/bin/env python3
-import os, time, re
-from typing import Dict, Any, Optional
+import os, time, re, asyncio
+from startup_trace import TRACE
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, HTTPException, status, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
+from fastapi import Depends, FastAPI, HTTPException, status, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import mongo_client as mongo
+from compat_mw import DecodedIngest, decode_ingest
+import ingest_codec as codec
+from ingest_codec import FrameValidationError, IngestFrame, validate_frame
+import write_behind as wb
+from mongo_health import MongoHealthMonitor, MONGO_FAST_FAIL
+from device_registry import DeviceRegistry, DEVICE_CACHE
+from raw_store import RawLogger, ensure_retention
+from spool import Spool, SpoolFull, SpoolReplayer, SPOOL_ENABLED, claim_dir
+from dedup import Deduplicator, frame_key, DEDUP_ENABLED, DEDUP_COLL
+from admission import AdmissionController, AdmissionRejected, ADMIT_ENABLED
+from keys_audit import KeysAuditAggregator, KEYS_AUDIT_MODE, ROLLUP_COLL
+import metrics
+import bridge_log
+
+TRACE.mark("import")
 
 APP_VERSION = "bridge-1.0.8"
 
@@ -20,88 +39,150 @@ MONGO_COL       = os.getenv("MONGO_COL", "measurements")
 TS_TIME_FIELD   = os.getenv("TS_TIME_FIELD", "ts")
 TS_META_FIELD   = os.getenv("TS_META_FIELD", "meta")
 REJECT_SYN      = os.getenv("REJECT_SYNTHETIC", "0") == "1"
+ALLOW_META_ONLY = os.getenv("ALLOW_META_ONLY", "true").lower() == "true"
+INGEST_BATCH_MAX = int(os.getenv("INGEST_BATCH_MAX", "1000"))
+INGEST_NORMALIZE = os.getenv("INGEST_NORMALIZE", "0") == "1"
+BRIDGE_WORKERS  = int(os.getenv("BRIDGE_WORKERS", "1"))   # set by serve.py
+# blocking: startup waits for Mongo (fails without it) | background: accept at once, spool until Mongo answers
+MONGO_CONNECT_MODE = os.getenv("MONGO_CONNECT_MODE", "blocking").lower()
+
+log = bridge_log.get_logger("ingest")
+
+# --- Mongo (async Motor client from mongo_client.py, set up on startup) ---
+db          = None
+collection  = None
+devices_col = None
+raw_db      = None
+audit_col   = None
+raw_log: Optional[RawLogger] = None   # RAW_LOG_MODE / sampling for ingest_raw
+keys_rollup: Optional[KeysAuditAggregator] = None   # None when KEYS_AUDIT_MODE=full
+# write-behind (group commit) buffers; None when WB_ENABLED=0
+ts_wb       = None
+raw_wb      = None
+audit_wb    = None
+# background ping; handlers read its cached state instead of pinging per request
+mongo_health: Optional[MongoHealthMonitor] = None
+# last-written devices state; only changed fields are upserted (None when DEVICE_CACHE=0)
+device_registry: Optional[DeviceRegistry] = None
+# local write-ahead spool for frames Mongo could not take (None when SPOOL_ENABLED=0)
+spool_log: Optional[Spool] = None
+spool_replayer: Optional[SpoolReplayer] = None
+# duplicate-frame suppression on (uuid, ts, measurements) (None when DEDUP_ENABLED=0)
+dedup: Optional[Deduplicator] = None
+# bounded in-flight ingest work + short wait queue (None when ADMIT_ENABLED=0)
+admission: Optional[AdmissionController] = AdmissionController() if ADMIT_ENABLED else None
+_bg_tasks: List[asyncio.Task] = []
 
-# --- Mongo ---
-try:
-    mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=3000)
-    mongo_client.admin.command("ping")
-    db          = mongo_client[MONGO_DB]
+# --- App ---
+# orjson encodes responses when available (same JSON, less CPU)
+if codec.HAS_ORJSON:
+    JSONResponse = ORJSONResponse
+app = FastAPI(title="Xerxes Bridge", version=APP_VERSION, default_response_class=JSONResponse)
+if metrics.PROMETHEUS_METRICS:
+    app.add_middleware(metrics.IngestMetricsMiddleware)
+app.add_middleware(bridge_log.RequestContextMiddleware)
+
+@app.on_event("startup")
+async def _init_mongo():
+    global db, collection, devices_col, raw_db, audit_col, raw_log, keys_rollup, ts_wb, raw_wb, audit_wb, mongo_health, device_registry
+    global spool_log, spool_replayer, dedup
+    background = MONGO_CONNECT_MODE == "background" and SPOOL_ENABLED
+    listeners = [metrics.MongoPoolListener()] if metrics.PROMETHEUS_METRICS else []
+    # Motor clients connect lazily; in background mode nothing here waits on Mongo
+    with TRACE.phase("mongo_connect"):
+        if not await mongo.init_mongo(MONGO_URI, MONGO_DB, event_listeners=listeners, connect=not background):
+            raise RuntimeError("[MONGO] init failed")
+    db          = mongo.get_db()
     collection  = db[MONGO_COL]
     devices_col = db.get_collection("devices")
-    print(f"[MONGO] connected; using {MONGO_DB}.{MONGO_COL}")
-except Exception as e:
-    print("[MONGO] init failed:", e)
-    raise
-
-# --- App ---
-app = FastAPI(title="Xerxes Bridge", version=APP_VERSION)
-
-@app.middleware("http")
-async def _capture_raw_body(request, call_next):
-    if request.url.path == "/bridge/ingest":
-        try:
-            raw = await request.body()
-            try:
-                request.state.raw_json = json.loads(raw.decode("utf-8"))
-            except Exception:
-                request.state.raw_json = {"_raw": raw.decode("utf-8","ignore")}
-        except Exception:
-            request.state.raw_json = None
-    return await call_next(request)
-
-
-async def _capture_raw_body(request, call_next):
-    if request.url.path == "/bridge/ingest":
-        try:
-            raw = await request.body()
-            try:
-                request.state.raw_json = json.loads(raw.decode("utf-8"))
-            except Exception:
-                request.state.raw_json = {"_raw": raw.decode("utf-8","ignore")}
-        except Exception:
-            request.state.raw_json = None
-    return await call_next(request)
-
-
-async def _capture_raw_body(request, call_next):
-    if request.url.path == "/bridge/ingest":
-        try:
-            raw = await request.body()
-            try:
-                request.state.raw_json = json.loads(raw.decode("utf-8"))
-            except Exception:
-                request.state.raw_json = {"_raw": raw.decode("utf-8","ignore")}
-        except Exception:
-            request.state.raw_json = None
-    return await call_next(request)
-
-
-async def _capture_raw_body(request, call_next):
-    if request.url.path == "/bridge/ingest":
+    raw_db      = db["ingest_raw"]
+    audit_col   = db.get_collection("keys_audit")
+    raw_log     = RawLogger(db)
+    if KEYS_AUDIT_MODE == "rollup":
+        keys_rollup = KeysAuditAggregator(db.get_collection(ROLLUP_COLL))
+        keys_rollup.start()
+    if wb.WB_ENABLED:
+        ts_wb    = wb.WriteBehindBuffer(collection)
+        raw_wb   = wb.WriteBehindBuffer(raw_db)
+        audit_wb = wb.WriteBehindBuffer(audit_col)
+    # until the first successful ping in background mode, frames go to the spool
+    mongo_health = MongoHealthMonitor(db, initially_up=not background)
+    mongo_health.start()
+    metrics.MONGO_UP.set_function(lambda: int(mongo_health.up))
+    metrics.MONGO_PING_MS.set_function(lambda: mongo_health.latency_ms or 0)
+    if DEVICE_CACHE:
+        device_registry = DeviceRegistry(TS_META_FIELD)
+        _bg_tasks.append(asyncio.get_running_loop().create_task(_device_ts_flusher()))
+    if DEDUP_ENABLED:
+        dedup = Deduplicator(db.get_collection(DEDUP_COLL))
+    if SPOOL_ENABLED:
+        with TRACE.phase("spool_recover"):
+            spool_log = Spool(claim_dir())
+            spool_log.open()
+        spool_replayer = SpoolReplayer(spool_log, db, mongo_health, on_applied=_spool_applied,
+                                       time_fields={MONGO_COL: TS_TIME_FIELD})
+        spool_replayer.start()
+    if BRIDGE_WORKERS > 1 and metrics.PROMETHEUS_METRICS:
+        _bg_tasks.append(asyncio.get_running_loop().create_task(metrics.snapshot_loop()))
+    if background:
+        _bg_tasks.append(asyncio.get_running_loop().create_task(_mongo_ready()))
+    else:
+        await _mongo_ready()
+    log.info("startup", extra={"db": MONGO_DB, "coll": MONGO_COL, "write_behind": wb.WB_ENABLED,
+                               "device_cache": DEVICE_CACHE, "raw_log": raw_log.mode, "connect": MONGO_CONNECT_MODE,
+                               "pid": os.getpid(), "workers": BRIDGE_WORKERS, "trace": TRACE.as_dict()})
+
+async def _mongo_ready():
+    """Index setup once Mongo answers (awaited at startup, or in the background with MONGO_CONNECT_MODE=background)."""
+    while mongo_health.down:
+        await asyncio.sleep(0.2)
+    with TRACE.phase("mongo_indexes"):
+        await ensure_retention(db)
+        if dedup is not None:
+            await dedup.ensure_indexes()
+    if MONGO_CONNECT_MODE == "background":
+        with TRACE.phase("mongo_warm"):
+            await mongo.warm_pool()
+        log.info("mongo ready", extra={"trace": TRACE.as_dict()})
+    for name, s in TRACE.phases:
+        metrics.STARTUP_SECONDS.set(round(s, 4), name)
+
+@app.on_event("shutdown")
+async def _flush_write_behind():
+    if mongo_health is not None:
+        await mongo_health.stop()
+    for t in _bg_tasks:
+        t.cancel()
+    if spool_replayer is not None:
+        await spool_replayer.stop()
+    if spool_log is not None:
+        await spool_log.close()
+    if keys_rollup is not None:
+        await keys_rollup.stop()
+    if dedup is not None:
+        await dedup.flush()
+    for buf in (ts_wb, raw_wb, audit_wb):
+        if buf is not None:
+            await buf.flush()
+    await _flush_device_ts(force=True)
+    if BRIDGE_WORKERS > 1:
+        metrics.remove_snapshot()
+    bridge_log.shutdown()
+
+async def _flush_device_ts(force: bool = False) -> None:
+    if device_registry is None:
+        return
+    ops = device_registry.flush_ops(force)
+    if ops:
         try:
-            raw = await request.body()
-            try:
-                request.state.raw_json = json.loads(raw.decode("utf-8"))
-            except Exception:
-                request.state.raw_json = {"_raw": raw.decode("utf-8","ignore")}
-        except Exception:
-            request.state.raw_json = None
-    return await call_next(request)
-
-
-async def _capture_raw_body(request, call_next):
-    if request.url.path == "/bridge/ingest":
-        try:
-            raw = await request.body()
-            try:
-                request.state.raw_json = json.loads(raw.decode("utf-8"))
-            except Exception:
-                request.state.raw_json = {"_raw": raw.decode("utf-8","ignore")}
-        except Exception:
-            request.state.raw_json = None
-    return await call_next(request)
-
+            await devices_col.bulk_write(ops, ordered=False)
+        except Exception as e:
+            log.warning("devices last_real_ts flush failed: %s", e)
 
+async def _device_ts_flusher():
+    while True:
+        await asyncio.sleep(device_registry.coalesce_s)
+        await _flush_device_ts()
 
 # --- helpers ---
 def _to_ms(ts: Optional[int]) -> int:
@@ -142,45 +223,68 @@ def _meta_flat(meta: dict) -> dict:
     f["csq"]  = m.get("signalQuality")
     return {k: v for k, v in f.items() if v is not None}
 
-class IngestBody(BaseModel):
-    uuid: Optional[str] = None
-    meta: Optional[Dict[str, Any]] = None
-    measurements: Optional[Dict[str, Any]] = None
-    values: Optional[Dict[str, Any]] = None
-    ts: Optional[int] = None
-    meta: Optional[Dict[str, Any]] = None
+async def _ingest_payload(request: Request) -> DecodedIngest:
+    """
+    Single decode stage for /bridge/ingest: the body is read and parsed once
+    (or taken over from CompatIngestMiddleware when it is mounted) and the
+    same DecodedIngest feeds validation and the raw log.
+    """
+    decoded = getattr(request.state, "ingest", None)
+    if decoded is None:
+        fmt, raw = await _read_body(request, codec.INGEST_MAX_BODY_BYTES)
+        t0 = time.perf_counter()
+        decoded = decode_ingest(raw, normalize=INGEST_NORMALIZE, fmt=fmt)
+        _observe("decode", time.perf_counter() - t0)
+        request.state.ingest = decoded
+    return decoded
+
+
+async def _read_body(request: Request, limit: int) -> Tuple[str, bytes]:
+    """(body format, body) – gzip/deflate are decompressed while streaming, capped at `limit` bytes."""
+    try:
+        fmt = codec.body_format(request.headers.get("content-type"))
+        return fmt, await codec.read_body(request.stream(), request.headers.get("content-encoding"), limit)
+    except codec.BodyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+def _validate_body(decoded: DecodedIngest) -> IngestFrame:
+    """IngestFrame from the already parsed payload; errors look like FastAPI's own body 422."""
+    if decoded.error is not None:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body", 0), "msg": "JSON decode error",
+                                       "input": {}, "ctx": {"error": decoded.error}}])
+    if decoded.payload is None:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        return validate_frame(decoded.payload)
+    except FrameValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
 
-@app.get("/health")
-def health():
-    mongo_client.admin.command("ping")
-    return {"status":"ok","app":APP_VERSION,"db":MONGO_DB,"collection":MONGO_COL}
 
-@app.post("/bridge/ingest", status_code=status.HTTP_201_CREATED)
-async def ingest(body: IngestBody, request: Request):
-    # -- uuid fallback (top-level or meta.uuid) --
-    if (getattr(body, "uuid", None) in (None, "")) and isinstance(body.meta, dict):
-        u = body.meta.get("uuid")
-        if isinstance(u, (str,int)) and str(u).strip():
-            body.uuid = str(u)
-    if not getattr(body, "uuid", None):
-        raise HTTPException(status_code=422, detail="uuid required (top-level or meta.uuid)")
+class _FrameExit(Exception):
+    """Frame ends before any Mongo write (422 / 202) – status + JSON body."""
+    def __init__(self, status_code: int, content: Dict[str, Any]):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.content = content
 
+
+def _check_api_key(request: Request) -> None:
+    api_key = request.headers.get("API-Key") or request.headers.get("Api-Key")
+    if PROJECT_API_KEY and api_key != PROJECT_API_KEY:
+        raise HTTPException(status_code=401, detail="invalid API-Key")
+
+
+def _frame_guardrails(body: IngestFrame) -> None:
     # -- uuid fallback (top-level or meta.uuid) --
-    try:
-        mongo_client.admin.command("ping")  # ensure Mongo client is ready
-    except Exception:
-        pass
-    if (getattr(body, "uuid", None) in (None, "") ) and isinstance(body.meta, dict):
+    if (getattr(body, "uuid", None) in (None, "")) and isinstance(body.meta, dict):
         u = body.meta.get("uuid")
         if isinstance(u, (str,int)) and str(u).strip():
             body.uuid = str(u)
     if not getattr(body, "uuid", None):
-        raise HTTPException(status_code=422, detail="uuid required (top-level or meta.uuid)")
+        raise _FrameExit(422, {"detail": "uuid required (top-level or meta.uuid)"})
 
     # --- GUARDRAILS (B: allow meta-only=202) ---
-    import os
-    from fastapi.responses import JSONResponse
-    ALLOW_META_ONLY = os.getenv("ALLOW_META_ONLY", "true").lower() == "true"
     has_meta = isinstance(body.meta, dict) and len(body.meta) >= 1
     has_vals = (isinstance(body.values, dict) and len(body.values) >= 1) or (isinstance(body.measurements, dict) and len(body.measurements) >= 1)
     # normalize: values -> measurements
@@ -188,40 +292,37 @@ async def ingest(body: IngestBody, request: Request):
         body.measurements = body.values
     # default ts if missing
     if body.ts is None:
-        import datetime as _dt
-        body.ts = int(_dt.datetime.utcnow().timestamp() * 1000)
+        body.ts = int(datetime.utcnow().timestamp() * 1000)
     # meta-only => 202 (no measurements write)
     if not has_vals and has_meta and ALLOW_META_ONLY:
-        return JSONResponse(status_code=202, content={"status": "ok", "note": "meta-only accepted"})
+        raise _FrameExit(202, {"status": "ok", "note": "meta-only accepted"})
     # nothing usable
     if not has_vals and not has_meta:
-        return JSONResponse(status_code=422, content={"detail": "no measurements/values provided"})
+        raise _FrameExit(422, {"detail": "no measurements/values provided"})
 
-    # API key
-    api_key = request.headers.get("API-Key") or request.headers.get("Api-Key")
-    if PROJECT_API_KEY and api_key != PROJECT_API_KEY:
-        raise HTTPException(status_code=401, detail="invalid API-Key")
 
-    # --- RAW LOG ---
-    try:
-        raw_db = mongo_client[MONGO_DB]["ingest_raw"]
-        raw_doc = {
-            "uuid": body.uuid,
-            "ts": datetime.utcnow(),
-            "ip": request.client.host if request.client else None,
-            "headers": dict(request.headers),
-            "body": (getattr(request.state, "raw_json", None) if True else {}),
-        }
-        raw_db.insert_one(raw_doc)
-    except Exception as e:
-        print("[WARN][RAW] failed to log ingest_raw:", e)
+def _raw_doc(body: IngestFrame, request: Request, raw_json: Any) -> Dict[str, Any]:
+    return {
+        "uuid": body.uuid,
+        "ts": datetime.utcnow(),
+        "ip": request.client.host if request.client else None,
+        "headers": dict(request.headers),
+        "body": raw_json,
+    }
 
+
+def _build_frame(body: IngestFrame, request: Request) -> Dict[str, Any]:
+    """
+    Builds everything one accepted frame writes: the TS document, the
+    keys_audit record (without doc_id) and the devices upsert. No I/O here,
+    so /bridge/ingest and /bridge/ingest/batch share exactly the same logic.
+    """
     # merge meraní
     merged: Dict[str, Any] = {}
     if isinstance(body.measurements, dict): merged.update(body.measurements)
     if isinstance(body.values, dict):       merged.update(body.values)
     if not merged:
-        raise HTTPException(status_code=422, detail="no measurements/values provided")
+        raise _FrameExit(422, {"detail": "no measurements/values provided"})
 
     # ts → ISODate
     ts_ms = _to_ms(body.ts)
@@ -235,8 +336,6 @@ async def ingest(body: IngestBody, request: Request):
     ip = _client_ip(request)
     has_meta   = isinstance(body.meta, dict) and len(body.meta) > 0
     has_values = (isinstance(body.values, dict) and len(body.values) >= 1) or (isinstance(body.measurements, dict) and len(body.measurements) >= 1)
-    enough_keys= len(merged) >= 3
-    is_local   = _is_private_ip(ip)
     is_real = has_meta or has_values
     # ensure meta.ingest.synthetic reflects REAL vs SYNTH
     try:
@@ -264,63 +363,565 @@ async def ingest(body: IngestBody, request: Request):
     meta["payload"] = {"meta": body.meta, "values": body.values}
     doc[TS_META_FIELD] = meta
 
-    # Synthetic → len devices.last_seen, bez insertu
-    if synthetic and REJECT_SYN:
-        devices_col.update_one(
-            {"uuid": canon_uuid},
-            {
-                "$setOnInsert": {"uuid": canon_uuid},
-                "$set": {"last_seen_ts": ts_dt, "last_seen_ip": ip},
-                "$addToSet": {"aliases": {"$each": [str(orig_uuid)]}}
-            },
-            upsert=True
-        )
-        # --- recompute (ensure values/measurements are visible here) ---
-        has_values = (isinstance(body.values, dict) and len(body.values) >= 1) or (isinstance(body.measurements, dict) and len(body.measurements) >= 1)
-        is_real = has_meta or has_values
-        # synthetic only if NO meta AND NO values/measurements
-        if (not has_meta) and (not has_values):
-            return JSONResponse(status_code=202, content={"status":"accepted_synthetic","uuid": body.uuid})
-    # Real → TS insert + devices update (safe $set bez None)
+    # --- keys_audit (doc_id is filled in after the insert) ---
+    raw_vals = ((meta or {}).get("payload", {}) or {}).get("values")
+    raw_keys = list((raw_vals or {}).keys()) if isinstance(raw_vals, dict) else []
+    meas_keys = list(doc.get("measurements",{}).keys())
+    audit = {
+        "ts": ts_dt,
+        "uuid": canon_uuid,
+        "raw_keys": raw_keys,
+        "meas_keys": meas_keys,
+        "missing_in_meas": [k for k in raw_keys if k not in meas_keys]
+    }
+
+    # devices upsert (safe $set bez None)
+    flat = _meta_flat(meta)
+    safe_set: Dict[str, Any] = {TS_META_FIELD: meta, "last_real_ts": ts_dt}
+    if "battery_v" in flat:  safe_set["battery_v"]  = flat["battery_v"]
+    if "fw_version" in flat: safe_set["fw_version"] = flat["fw_version"]
+    if "csq" in flat:        safe_set["csq"]        = flat["csq"]
+
+    return {
+        "uuid": canon_uuid,
+        "orig_uuid": str(orig_uuid),
+        "ip": ip,
+        "ts_dt": ts_dt,
+        "synthetic": synthetic,
+        "merged": merged,
+        "doc": doc,
+        "audit": audit,
+        "device_set": safe_set,
+    }
+
+
+def _device_update(frame: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """devices upsert for an accepted frame; with the registry only changed fields (None = nothing to write)."""
+    if device_registry is not None:
+        return device_registry.plan(frame["uuid"], frame["orig_uuid"], frame["device_set"])
+    return {
+        "$setOnInsert": {"uuid": frame["uuid"]},
+        "$set": frame["device_set"],
+        "$addToSet": {"aliases": {"$each": [frame["orig_uuid"]]}}
+    }
+
+
+def _merge_update(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Two devices updates for the same uuid → one ($set: later wins, aliases are merged)."""
+    out = {"$setOnInsert": b["$setOnInsert"], "$set": {**a["$set"], **b["$set"]}}
+    aliases = list((a.get("$addToSet") or {}).get("aliases", {}).get("$each", []))
+    for al in (b.get("$addToSet") or {}).get("aliases", {}).get("$each", []):
+        if al not in aliases:
+            aliases.append(al)
+    if aliases:
+        out["$addToSet"] = {"aliases": {"$each": aliases}}
+    return out
+
+
+def _audit_doc(frame: Dict[str, Any], doc_id: ObjectId) -> Optional[Dict[str, Any]]:
+    """keys_audit document to write for this frame (None when the rollup already covers it)."""
+    if keys_rollup is None:
+        return {**frame["audit"], "doc_id": doc_id}
+    detail = keys_rollup.detail(frame["audit"])
+    return {**detail, "doc_id": doc_id} if detail is not None else None
+
+
+def _audit_stored(frame: Dict[str, Any]) -> None:
+    """Rollup count of a frame whose measurement insert is confirmed."""
+    if keys_rollup is not None:
+        keys_rollup.record(frame["audit"])
+
+
+def _spool_applied(kind: str, data: Dict[str, Any]) -> None:
+    # a spooled frame's measurement reached Mongo – count it in the rollup now
+    if kind == "keys_audit" and keys_rollup is not None:
+        keys_rollup.record(data)
+
+
+async def _write_audit(doc: Optional[Dict[str, Any]]) -> None:
+    if doc is not None:
+        await wb.submit(audit_wb, audit_col, doc)
+
+
+def _observe(stage: str, seconds: float) -> None:
+    metrics.INGEST_STAGE.observe(seconds, stage)
+    bridge_log.record_stage(stage, seconds)
+
+
+async def _timed(stage: str, aw) -> Any:
+    t0 = time.perf_counter()
+    try:
+        return await aw
+    finally:
+        _observe(stage, time.perf_counter() - t0)
+
+
+_FW_DESCRIBE_RE = re.compile(r"-\d+-g[0-9a-f]+$")
+
+
+def _device_profile(meta: Dict[str, Any]) -> str:
+    """Label for per-profile frame rates: explicit profile/type from meta, else firmware version (bounded, see metrics.profile_label)."""
+    p = meta.get("profile") or meta.get("deviceProfile") or meta.get("type")
+    if not p:
+        # v1.5.0-0-g59a2eda → v1.5.0: one series per release, not per build
+        p = _FW_DESCRIBE_RE.sub("", str(meta.get("version") or "")) or "unknown"
+    return metrics.profile_label(str(p)[:64])
+
+
+def _spool_ops(frame: Dict[str, Any], raw_stored: Optional[Dict[str, Any]] = None,
+               audit: Optional[Dict[str, Any]] = None, dev_update: Optional[Dict[str, Any]] = None,
+               with_doc: bool = True, seen: bool = False) -> List[Dict[str, Any]]:
+    """The writes of one frame as a spool record, in the order the live path issues them."""
+    ops: List[Dict[str, Any]] = []
+    if seen and frame["synthetic"] and REJECT_SYN:
+        ops.append(_spool_device(frame["uuid"], _seen_update(frame)))
+    if raw_stored is not None:
+        ops.append({"i": raw_db.name, "d": raw_stored})
+    if with_doc:
+        ops.append({"i": collection.name, "d": frame["doc"]})
+        if keys_rollup is not None:
+            ops.append({"a": "keys_audit", "d": frame["audit"]})
+    if audit is not None:
+        ops.append({"i": audit_col.name, "d": audit})
+    if dev_update is not None:
+        ops.append(_spool_device(frame["uuid"], dev_update))
+    return ops
+
+
+def _spool_device(uuid: str, update: Dict[str, Any]) -> Dict[str, Any]:
+    """devices upsert as a spool op, guarded by its timestamp so a late replay cannot roll newer state back."""
+    op = {"u": devices_col.name, "q": {"uuid": uuid}, "d": update}
+    for field in ("last_real_ts", "last_seen_ts"):
+        if field in (update.get("$set") or {}):
+            op["g"] = field
+            break
+    return op
+
+
+async def _spool(records: List[List[Dict[str, Any]]]) -> None:
+    try:
+        await asyncio.gather(*(spool_log.append(r) for r in records if r))
+    except (SpoolFull, OSError) as e:
+        log.error("spool write failed: %s", e)
+        retry = mongo_health.retry_after_s() if mongo_health is not None else 5
+        raise HTTPException(status_code=503, detail="mongo unavailable",
+                            headers={"Retry-After": str(retry)})
+
+
+def _if_failed(result: Any, value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return value if isinstance(result, PyMongoError) else None
+
+
+def _spooling() -> bool:
+    """True while the monitor reports Mongo down and frames go straight to the spool."""
+    return spool_log is not None and mongo_health is not None and mongo_health.down
+
+
+async def _upsert_device(uuid: str, update: Optional[Dict[str, Any]]) -> None:
+    if update is None:
+        return
     try:
-        res = collection.insert_one(doc)
+        await devices_col.update_one({"uuid": uuid}, update, upsert=True)
+    except Exception:
+        if device_registry is not None:
+            device_registry.invalidate(uuid)
+        raise
+
+
+def _seen_update(frame: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "$setOnInsert": {"uuid": frame["uuid"]},
+        "$set": {"last_seen_ts": frame["ts_dt"], "last_seen_ip": frame["ip"]},
+        "$addToSet": {"aliases": {"$each": [frame["orig_uuid"]]}}
+    }
 
 
-        # --- keys_audit ---
+def _fast_fail() -> None:
+    """503 right away while the monitor knows Mongo is down (no waiting on serverSelectionTimeoutMS)."""
+    if MONGO_FAST_FAIL and spool_log is None and mongo_health is not None and mongo_health.down:
+        raise HTTPException(status_code=503, detail="mongo unavailable",
+                            headers={"Retry-After": str(mongo_health.retry_after_s())})
+
+
+@app.get("/health")
+async def health():
+    state = mongo_health.snapshot() if mongo_health is not None else {"up": False}
+    if state["up"]:
+        st = "ok"
+    elif state.get("last_ok_at") is None and MONGO_CONNECT_MODE == "background" and spool_log is not None:
+        st = "starting"     # accepting into the spool while Mongo connects
+    else:
+        st = "degraded"
+    content = {"status":st,"app":APP_VERSION,"db":MONGO_DB,"collection":MONGO_COL,"mongo":state}
+    return JSONResponse(status_code=503 if st == "degraded" else 200, content=content)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    if not metrics.PROMETHEUS_METRICS:
+        raise HTTPException(status_code=404, detail="metrics disabled")
+    body = metrics.render_merged() if BRIDGE_WORKERS > 1 else metrics.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.post("/bridge/ingest", status_code=status.HTTP_201_CREATED)
+async def ingest(request: Request, decoded: DecodedIngest = Depends(_ingest_payload)):
+    body = _validate_body(decoded)
+    _fast_fail()
+    try:
+        _frame_guardrails(body)
+        # API key
+        _check_api_key(request)
+        raw_doc = _raw_doc(body, request, decoded.raw_json)
+        frame = _build_frame(body, request)
+    except _FrameExit as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
+
+    canon_uuid = frame["uuid"]
+    bridge_log.bind_uuid(canon_uuid)
+    # retried / replayed frame → 200, nothing written
+    async with _admitted(canon_uuid):
+        key = await _claim(frame)
+        if key is None:
+            return JSONResponse(status_code=200, content={"status": "duplicate", "uuid": canon_uuid})
         try:
-            raw_vals = ((meta or {}).get("payload", {}) or {}).get("values")
-            raw_keys = list((raw_vals or {}).keys()) if isinstance(raw_vals, dict) else []
-            meas_keys = list(doc.get("measurements",{}).keys())
-            missing = [k for k in raw_keys if k not in meas_keys]
-            db.get_collection("keys_audit").insert_one({
-                "ts": ts_dt,
-                "uuid": canon_uuid,
-                "doc_id": res.inserted_id,
-                "raw_keys": raw_keys,
-                "meas_keys": meas_keys,
-                "missing_in_meas": missing
-            })
-        except Exception as e:
-            print("[AUDIT][WARN] keys_audit failed:", e)
-
-        flat = _meta_flat(meta)
-        safe_set: Dict[str, Any] = {TS_META_FIELD: meta, "last_real_ts": ts_dt}
-        if "battery_v" in flat:  safe_set["battery_v"]  = flat["battery_v"]
-        if "fw_version" in flat: safe_set["fw_version"] = flat["fw_version"]
-        if "csq" in flat:        safe_set["csq"]        = flat["csq"]
-
-        devices_col.update_one(
-            {"uuid": canon_uuid},
-            {
-                "$setOnInsert": {"uuid": canon_uuid},
-                "$set": safe_set,
-                "$addToSet": {"aliases": {"$each": [str(orig_uuid)]}}
-            },
-            upsert=True
-        )
-
-        print(f"[INGEST] inserted uuid={canon_uuid} real=True keys={list(merged.keys())[:16]} ip={ip} ts={ts_dt.isoformat()} id={res.inserted_id}")
-        return {"status":"ok","uuid":canon_uuid,"id":str(res.inserted_id)}
-    except PyMongoError as e:
-        print("[INGEST][ERROR] mongo insert failed:", e)
-        raise HTTPException(status_code=500, detail="mongo insert failed")
+            resp = await _ingest_frame(frame, raw_doc, decoded.raw)
+        except Exception:
+            await _release([key])
+            raise
+        _stored([key])
+        return resp
+
+
+@asynccontextmanager
+async def _admitted(uuid: Optional[str]):
+    """Admission slot for one ingest request; rejections become 503/429 with Retry-After."""
+    if admission is None:
+        yield
+        return
+    try:
+        await admission.acquire(uuid)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=f"ingest overloaded ({e.reason})",
+                            headers={"Retry-After": str(e.retry_after)})
+    try:
+        yield
+    finally:
+        admission.release(uuid)
+
+
+def _dedup_key(frame: Dict[str, Any]) -> bytes:
+    return frame_key(frame["uuid"], int(frame["ts_dt"].timestamp() * 1000), frame["merged"])
+
+
+async def _claim(frame: Dict[str, Any]) -> Optional[bytes]:
+    """Dedup key of a new frame (b"" when dedup is off), None for a duplicate."""
+    if dedup is None:
+        return b""
+    key = _dedup_key(frame)
+    new = await _timed("dedup", dedup.claim(key, frame["uuid"], confirm=not _spooling()))
+    return key if new else None
+
+
+async def _claim_many(frames: List[Dict[str, Any]]) -> List[Optional[bytes]]:
+    """_claim for several frames (distinct keys) concurrently, timed as one dedup stage."""
+    if dedup is None or not frames:
+        return [b"" for _ in frames]
+    confirm = not _spooling()
+
+    async def one(frame: Dict[str, Any]) -> Optional[bytes]:
+        key = _dedup_key(frame)
+        return key if await dedup.claim(key, frame["uuid"], confirm=confirm) else None
+
+    res = await _timed("dedup", asyncio.gather(*(one(f) for f in frames), return_exceptions=True))
+    errors = [r for r in res if isinstance(r, BaseException)]
+    if errors:
+        await _release([r for r in res if isinstance(r, bytes)])
+        raise errors[0]
+    return res
+
+
+async def _release(keys: List[bytes]) -> None:
+    """Frames that were not stored must not block the device's retry as duplicates."""
+    if dedup is not None:
+        await asyncio.gather(*(dedup.release(k) for k in keys if k))
+
+
+def _stored(keys: List[bytes]) -> None:
+    """Frames written (or spooled): retries waiting on them are answered as duplicates."""
+    if dedup is not None:
+        for k in keys:
+            if k:
+                dedup.stored(k)
+
+
+async def _ingest_frame(frame: Dict[str, Any], raw_doc: Dict[str, Any], raw: bytes):
+    canon_uuid = frame["uuid"]
+    doc = frame["doc"]
+    doc["_id"] = ObjectId()
+    raw_stored = await raw_log.prepare(raw_doc, raw, intern=not _spooling())
+    audit = _audit_doc(frame, doc["_id"])
+    dev_update = _device_update(frame)
+
+    # Mongo known to be down → the whole frame goes to the local spool
+    if _spooling():
+        await _timed("spool", _spool([_spool_ops(frame, raw_stored, audit, dev_update, seen=True)]))
+        return JSONResponse(status_code=202, content={"status": "spooled", "uuid": canon_uuid, "id": str(doc["_id"])})
+
+    # Synthetic → len devices.last_seen, bez insertu
+    if frame["synthetic"] and REJECT_SYN:
+        await devices_col.update_one({"uuid": canon_uuid}, _seen_update(frame), upsert=True)
+
+    # Real → raw log, TS insert, keys_audit and devices upsert are independent
+    # writes; _id is assigned up front so keys_audit can reference it.
+    raw_r, ins_r, audit_r, dev_r = await asyncio.gather(
+        _timed("raw_log", wb.submit(raw_wb, raw_db, raw_stored)),
+        _timed("measurement", wb.submit(ts_wb, collection, doc)),
+        _timed("keys_audit", _write_audit(audit)),
+        _timed("devices", _upsert_device(canon_uuid, dev_update)),
+        return_exceptions=True,
+    )
+    if isinstance(raw_r, Exception):
+        log.warning("[RAW] failed to log ingest_raw: %s", raw_r)
+    if isinstance(audit_r, Exception):
+        log.warning("[AUDIT] keys_audit failed: %s", audit_r)
+    for r in (ins_r, dev_r):
+        if isinstance(r, BaseException) and not isinstance(r, PyMongoError):
+            raise r
+
+    mongo_failed = [r for r in (ins_r, dev_r, raw_r, audit_r) if isinstance(r, PyMongoError)]
+    if mongo_failed and spool_log is None:
+        if isinstance(ins_r, PyMongoError) or isinstance(dev_r, PyMongoError):
+            log.error("mongo insert failed: %s", mongo_failed[0])
+            raise HTTPException(status_code=500, detail="mongo insert failed")
+    elif mongo_failed:
+        # failed writes are kept in the spool and replayed once Mongo is back
+        log.warning("mongo write failed, spooling: %s", mongo_failed[0])
+        await _timed("spool", _spool([_spool_ops(frame, _if_failed(raw_r, raw_stored), _if_failed(audit_r, audit),
+                                                 _if_failed(dev_r, dev_update), with_doc=isinstance(ins_r, PyMongoError))]))
+        if isinstance(ins_r, PyMongoError):
+            return JSONResponse(status_code=202, content={"status": "spooled", "uuid": canon_uuid, "id": str(doc["_id"])})
+
+    _audit_stored(frame)
+    metrics.INGEST_FRAMES.inc(_device_profile(doc[TS_META_FIELD]))
+    log.info("inserted", extra={"keys": list(frame["merged"].keys())[:16], "ip": frame["ip"],
+                                "doc_ts": frame["ts_dt"].isoformat(), "id": str(doc["_id"]),
+                                "stages": bridge_log.stage_timings()})
+    return {"status":"ok","uuid":canon_uuid,"id":str(doc["_id"])}
+
+
+def _split_batch(raw: bytes, content_type: str, fmt: str = "json") -> List[Any]:
+    """JSON/MessagePack/CBOR array (or {"frames": [...]}) or NDJSON → list of items; unparsable NDJSON lines stay as None."""
+    if fmt != "json":
+        try:
+            data = codec.loads_as(raw, fmt)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if isinstance(data, dict) and isinstance(data.get("frames"), list):
+            return data["frames"]
+        return data if isinstance(data, list) else [data]
+    text = raw.decode("utf-8", "ignore")
+    if "ndjson" not in content_type and "jsonlines" not in content_type:
+        try:
+            data = codec.loads(text)
+            if isinstance(data, dict) and isinstance(data.get("frames"), list):
+                return data["frames"]
+            if isinstance(data, list):
+                return data
+            return [data]
+        except ValueError:
+            pass
+    items: List[Any] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(codec.loads(line))
+        except ValueError:
+            items.append(None)
+    return items
+
+
+@app.post("/bridge/ingest/batch")
+async def ingest_batch(request: Request):
+    """
+    Bulk variant of /bridge/ingest for gateways and backfill replays.
+    Per frame the same guardrails/classification run, but writes go out as one
+    insert_many per collection plus one devices bulk_write. Response carries a
+    per-item status so the client only resends what failed.
+    """
+    _check_api_key(request)
+    _fast_fail()
+    fmt, raw = await _read_body(request, codec.INGEST_BATCH_MAX_BYTES)
+    items = _split_batch(raw, request.headers.get("content-type") or "", fmt)
+    if not items:
+        raise HTTPException(status_code=422, detail="empty batch")
+    if len(items) > INGEST_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"batch too large (max {INGEST_BATCH_MAX} frames)")
+
+    # one admission slot per batch (no per-device cap – a gateway carries many devices)
+    async with _admitted(None):
+        results: List[Dict[str, Any]] = [{} for _ in items]
+        raw_docs: List[Dict[str, Any]] = []
+        frames: List[Tuple[int, Dict[str, Any]]] = []
+        candidates: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
+        keys: Dict[int, bytes] = {}
+        first_of: Dict[bytes, int] = {}
+        copies: Dict[int, int] = {}
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[i] = {"index": i, "status": 422, "detail": "invalid JSON object"}
+                continue
+            try:
+                body = validate_frame(item)
+                _frame_guardrails(body)
+                raw_doc = _raw_doc(body, request, item)
+                frame = _build_frame(body, request)
+            except FrameValidationError as e:
+                results[i] = {"index": i, "status": 422, "detail": e.errors()}
+                continue
+            except _FrameExit as e:
+                results[i] = {"index": i, "status": e.status_code, **e.content}
+                continue
+            # the same frame twice in one batch: the copy shares the first one's outcome (below)
+            if dedup is not None:
+                k = _dedup_key(frame)
+                if k in first_of:
+                    copies[i] = first_of[k]
+                    continue
+                first_of[k] = i
+            candidates.append((i, frame, raw_doc))
+
+        # all keys of the batch are checked at once (one ingest_dedup write-behind flush, not one per frame)
+        claimed = await _claim_many([f for _, f, _ in candidates])
+        for (i, frame, raw_doc), key in zip(candidates, claimed):
+            if key is None:
+                results[i] = {"index": i, "status": 200, "uuid": frame["uuid"], "detail": "duplicate"}
+                continue
+            keys[i] = key
+            raw_docs.append(await raw_log.prepare(raw_doc, codec.dumps(items[i]), intern=not _spooling()))
+            frames.append((i, frame))
+
+        try:
+            resp = await _write_batch(request, items, results, raw_docs, frames, copies)
+        except Exception:
+            await _release(list(keys.values()))
+            raise
+        await _release([k for i, k in keys.items() if results[i]["status"] == 500])
+        _stored([k for i, k in keys.items() if results[i]["status"] != 500])
+        return resp
+
+
+async def _write_batch(request: Request, items: List[Any], results: List[Dict[str, Any]],
+                       raw_docs: List[Dict[str, Any]], frames: List[Tuple[int, Dict[str, Any]]],
+                       copies: Optional[Dict[int, int]] = None) -> JSONResponse:
+    seen = [(f["uuid"], _seen_update(f)) for _, f in frames if f["synthetic"] and REJECT_SYN]
+
+    # Mongo known to be down → raw docs and every frame go to the local spool
+    if _spooling():
+        records = [[{"i": raw_db.name, "d": d} for d in raw_docs]]
+        for i, f in frames:
+            doc_id = f["doc"]["_id"] = ObjectId()
+            records.append(_spool_ops(f, None, _audit_doc(f, doc_id), _device_update(f), seen=True))
+            results[i] = {"index": i, "status": 202, "uuid": f["uuid"], "id": str(doc_id), "detail": "spooled"}
+        await _timed("spool", _spool(records))
+        return _batch_response(request, items, results, 0, copies)
+
+    # --- RAW LOG + TS insert (unordered: one bad frame must not block the rest) ---
+    async def _insert_raw():
+        if raw_docs:
+            await raw_db.insert_many(raw_docs, ordered=False)
+
+    async def _insert_ts():
+        if frames:
+            await collection.insert_many([f["doc"] for _, f in frames], ordered=False)
+
+    raw_r, ins_r = await asyncio.gather(_insert_raw(), _insert_ts(), return_exceptions=True)
+    spool_records: List[List[Dict[str, Any]]] = []
+    if isinstance(raw_r, Exception):
+        log.warning("[RAW] failed to log ingest_raw batch: %s", raw_r)
+        if spool_log is not None and isinstance(raw_r, PyMongoError) and not isinstance(raw_r, BulkWriteError):
+            spool_records.append([{"i": raw_db.name, "d": d} for d in raw_docs])
+    failed: set = set()
+    spool_frames = False
+    if isinstance(ins_r, BulkWriteError):
+        failed = {we["index"] for we in ins_r.details.get("writeErrors", [])}
+    elif isinstance(ins_r, PyMongoError):
+        failed = set(range(len(frames)))
+        spool_frames = spool_log is not None
+        if spool_frames:
+            log.warning("mongo batch insert failed, spooling: %s", ins_r)
+        else:
+            log.error("mongo batch insert failed: %s", ins_r)
+    elif isinstance(ins_r, BaseException):
+        raise ins_r
+
+    audits: List[Dict[str, Any]] = []
+    inserted = 0
+    dev_updates: Dict[str, Dict[str, Any]] = {}
+    for n, (i, f) in enumerate(frames):
+        if n in failed and spool_frames:
+            doc_id = f["doc"].setdefault("_id", ObjectId())
+            spool_records.append(_spool_ops(f, None, _audit_doc(f, doc_id), _device_update(f)))
+            results[i] = {"index": i, "status": 202, "uuid": f["uuid"], "id": str(doc_id), "detail": "spooled"}
+            continue
+        if n in failed:
+            results[i] = {"index": i, "status": 500, "detail": "mongo insert failed"}
+            continue
+        doc_id = f["doc"]["_id"]
+        inserted += 1
+        metrics.INGEST_FRAMES.inc(_device_profile(f["doc"][TS_META_FIELD]))
+        # detail doc first: _audit_stored marks the key set as known (same order as _ingest_frame)
+        audit = _audit_doc(f, doc_id)
+        if audit is not None:
+            audits.append(audit)
+        _audit_stored(f)
+        # one upsert per device – later frames in the batch win, aliases are merged
+        upd = _device_update(f)
+        if upd is not None:
+            prev = dev_updates.get(f["uuid"])
+            dev_updates[f["uuid"]] = _merge_update(prev, upd) if prev else upd
+        results[i] = {"index": i, "status": 201, "uuid": f["uuid"], "id": str(doc_id)}
+
+    dev_all = seen + list(dev_updates.items())
+    dev_ops = [UpdateOne({"uuid": u}, upd, upsert=True) for u, upd in dev_all]
+
+    # --- keys_audit + devices upsert ---
+    async def _insert_audits():
+        if audits:
+            await audit_col.insert_many(audits, ordered=False)
+
+    async def _upsert_devices():
+        if dev_ops:
+            await devices_col.bulk_write(dev_ops, ordered=False)
+
+    audit_r, dev_r = await asyncio.gather(_insert_audits(), _upsert_devices(), return_exceptions=True)
+    if isinstance(audit_r, Exception):
+        log.warning("[AUDIT] keys_audit batch failed: %s", audit_r)
+        if spool_log is not None and isinstance(audit_r, PyMongoError) and not isinstance(audit_r, BulkWriteError):
+            spool_records.append([{"i": audit_col.name, "d": a} for a in audits])
+    if isinstance(dev_r, Exception):
+        log.warning("devices bulk upsert failed: %s", dev_r)
+        if spool_log is not None and isinstance(dev_r, PyMongoError) and not isinstance(dev_r, BulkWriteError):
+            spool_records.append([_spool_device(u, upd) for u, upd in dev_all])
+        elif device_registry is not None:
+            for u in dev_updates:
+                device_registry.invalidate(u)
+
+    if spool_records:
+        await _timed("spool", _spool(spool_records))
+    return _batch_response(request, items, results, inserted, copies)
+
+
+def _batch_response(request: Request, items: List[Any], results: List[Dict[str, Any]], inserted: int,
+                    copies: Optional[Dict[int, int]] = None) -> JSONResponse:
+    for i, first in (copies or {}).items():
+        r = results[first]
+        results[i] = ({"index": i, "status": 500, "detail": r.get("detail")} if r["status"] == 500
+                      else {"index": i, "status": 200, "uuid": r.get("uuid"), "detail": "duplicate"})
+    accepted = sum(1 for r in results if r["status"] in (200, 201, 202))
+    log.info("batch", extra={"frames": len(items), "inserted": inserted, "accepted": accepted,
+                             "ip": _client_ip(request), "stages": bridge_log.stage_timings()})
+    return JSONResponse(
+        status_code=201 if accepted == len(items) else 207,
+        content={"status": "ok" if accepted == len(items) else "partial",
+                 "accepted": accepted, "rejected": len(items) - accepted, "items": results},
+    )
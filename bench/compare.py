@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Compare benchmark results side by side.
+
+    python3 bench/compare.py bench/results/20260101-120000-bridge.json bench/results/20260102-*.json
+
+The first file is the baseline; the other columns show the change against it.
+"""
+import json, sys
+from typing import Any, Dict, List, Optional
+
+
+def _row(name: str, vals: List[Optional[float]], higher_is_better: bool) -> str:
+    base = vals[0]
+    cells = [f"{base if base is not None else '-':>12}"]
+    for v in vals[1:]:
+        if v is None or not base:
+            cells.append(f"{v if v is not None else '-':>12}{'':>9}")
+            continue
+        d = (v - base) / base * 100
+        good = d >= 0 if higher_is_better else d <= 0
+        cells.append(f"{v:>12}{d:+8.1f}%{'' if abs(d) < 5 else (' ' if good else '!')}")
+    return f"{name:<22}" + "".join(cells)
+
+
+def main(paths: List[str]) -> None:
+    runs: List[Dict[str, Any]] = []
+    for p in paths:
+        with open(p) as f:
+            runs.append(json.load(f))
+    heads = [f"{r.get('git') or '?'} {r['config'].get('label', '')}".strip() for r in runs]
+    print(f"{'':<22}{heads[0]:>12}" + "".join(f"{h:>21}" for h in heads[1:]))
+    print(_row("throughput_rps", [r.get("throughput_rps") for r in runs], True))
+    print(_row("ok_rps", [r.get("ok_rps") for r in runs], True))
+    for q in ("p50", "p90", "p99", "max"):
+        print(_row(f"latency {q} ms", [r["latency_ms"].get(q) for r in runs], False))
+    stages = sorted({s for r in runs for s in r.get("stages", {})})
+    for s in stages:
+        print(_row(f"stage {s} ms", [r.get("stages", {}).get(s, {}).get("mean_ms") for r in runs], False))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: compare.py BASELINE.json [RUN.json ...]")
+    main(sys.argv[1:])
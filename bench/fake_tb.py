@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Stub ThingsBoard device API for benchmarks (no TB needed).
+
+    python3 bench/fake_tb.py --port 18080 --latency-ms 40 --jitter-ms 20 --error-rate 0.02
+
+Accepts POST /api/v1/{token}/telemetry and /api/v1/{token}/attributes, waits
+latency ± jitter and answers 200, or --error-status (default 503) with
+probability --error-rate; --reject-rate answers 401 like an unknown token.
+GET /stats returns the counters, POST /stats/reset clears them.
+
+Point the forwarders at it with TB_HOST=http://127.0.0.1:18080.
+"""
+import argparse, asyncio, random, time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeTB:
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float,
+                 error_status: int, reject_rate: float):
+        self.latency_s = latency_ms / 1000.0
+        self.jitter_s = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.reject_rate = reject_rate
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.by_status: Counter = Counter()
+        self.tokens: Counter = Counter()
+        self.points = 0
+        self.inflight = 0
+        self.max_inflight = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            body = await request.read()
+            delay = self.latency_s + random.uniform(-self.jitter_s, self.jitter_s)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            r = random.random()
+            if r < self.reject_rate:
+                status = 401
+            elif r < self.reject_rate + self.error_rate:
+                status = self.error_status
+            else:
+                status = 200
+                self.tokens[request.match_info["token"]] += 1
+                # batched telemetry is a JSON array; count points, not requests
+                self.points += max(1, body.count(b'"ts"')) if body[:1] == b"[" else 1
+            self.by_status[status] += 1
+            return web.Response(status=status, text="" if status == 200 else "fake error")
+        finally:
+            self.inflight -= 1
+
+    async def stats(self, request: web.Request) -> web.Response:
+        elapsed = max(time.time() - self.started, 1e-6)
+        ok = self.by_status.get(200, 0)
+        return web.json_response({
+            "elapsed_s": round(elapsed, 3),
+            "requests": sum(self.by_status.values()),
+            "by_status": {str(k): v for k, v in self.by_status.items()},
+            "points": self.points,
+            "tokens": len(self.tokens),
+            "ok_per_s": round(ok / elapsed, 2),
+            "max_inflight": self.max_inflight,
+        })
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"status": "reset"})
+
+
+def build_app(tb: FakeTB) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post("/api/v1/{token}/telemetry", tb.handle)
+    app.router.add_post("/api/v1/{token}/attributes", tb.handle)
+    app.router.add_get("/stats", tb.stats)
+    app.router.add_post("/stats/reset", tb.reset_stats)
+    return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake ThingsBoard device API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--latency-ms", type=float, default=30.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with --error-status")
+    ap.add_argument("--error-status", type=int, default=503)
+    ap.add_argument("--reject-rate", type=float, default=0.0, help="share of requests answered 401")
+    args = ap.parse_args()
+
+    tb = FakeTB(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.reject_rate)
+    print(f"[FAKE-TB] http://{args.host}:{args.port} latency={args.latency_ms}±{args.jitter_ms}ms "
+          f"errors={args.error_rate}({args.error_status}) rejects={args.reject_rate}")
+    web.run_app(build_app(tb), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Synthetic Xerxes frames shaped like the bodies in ingest_raw.
+
+    legacy: {"meta": {"uuid": ..., "version": ..., "modem": {...}, "power": {...}}, "values": {...}}
+    new:    {"uuid": ..., "ts": <ms>, "measurements": {...}, "meta": {...}}
+
+meta has the fleet's shape (version, modem.signalQuality, power.battery.voltage
+– what device_registry tracks); firmware and modem ids are fixed per device,
+signal quality and battery voltage move a little between frames, so the
+devices diff sees the mix of unchanged and changed state real traffic has.
+Values drift around realistic indoor levels so the frames are not all
+identical (dedup would otherwise swallow them).
+"""
+import random, time
+from typing import Any, Dict, List
+
+# key sets seen on the fleet: full sensor board, the reduced board and the health-only heartbeat
+KEY_SETS: List[Dict[str, tuple]] = [
+    {"temp": (18, 28), "rh": (30, 65), "pm2_5": (2, 40), "pm10": (4, 60), "light": (0, 800),
+     "sound_db": (35, 75), "voc": (20, 300), "nox": (1, 10), "co2": (400, 1800)},
+    {"temp": (18, 28), "rh": (30, 65), "pm2_5": (2, 40), "pm10": (4, 60), "co2": (400, 1800)},
+    {"temp": (18, 28), "rh": (30, 65), "pm10": (4, 60), "co2": (400, 1800)},
+]
+KEY_SET_WEIGHTS = (70, 25, 5)
+
+FW_VERSIONS = ("v1.4.2-3-g1c0ffee", "v1.5.0-0-g59a2eda", "v1.5.1-0-gabc1234")
+
+
+def device_uuids(n: int, seed: int = 1) -> List[str]:
+    """n stable 15-digit device ids (same seed → same fleet across runs)."""
+    rnd = random.Random(seed)
+    return [str(rnd.randrange(10 ** 14, 10 ** 15)) for _ in range(n)]
+
+
+def _values(rnd: random.Random) -> Dict[str, Any]:
+    keys = rnd.choices(KEY_SETS, KEY_SET_WEIGHTS)[0]
+    out: Dict[str, Any] = {}
+    for k, (lo, hi) in keys.items():
+        v = rnd.uniform(lo, hi)
+        out[k] = int(v) if k in ("voc", "nox", "co2") else round(v, 2)
+    return out
+
+
+def _meta(uuid: str, rnd: random.Random) -> Dict[str, Any]:
+    dev = random.Random(uuid)            # per-device constants
+    return {
+        "version": dev.choice(FW_VERSIONS),
+        "modem": {
+            "imei": f"86047006{dev.randrange(10 ** 7):07d}",
+            "signalQuality": dev.randint(12, 31) + rnd.choice((0, 0, 0, 1, -1)),
+            "simCCID": f"8988{dev.randrange(10 ** 15):015d}",
+        },
+        "power": {"battery": {"voltage": round(dev.uniform(3.4, 4.1) + rnd.choice((0, 0, 0.001, -0.001)), 3)}},
+    }
+
+
+def make_frame(uuid: str, rnd: random.Random, legacy_ratio: float = 0.3) -> Dict[str, Any]:
+    meta = _meta(uuid, rnd)
+    vals = _values(rnd)
+    if rnd.random() < legacy_ratio:
+        return {"meta": {"uuid": uuid, **meta}, "values": vals}
+    return {"uuid": uuid, "ts": int(time.time() * 1000), "measurements": vals, "meta": meta}
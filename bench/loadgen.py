@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Ingest load generator.
+
+    python3 bench/loadgen.py --target bridge --url http://127.0.0.1:8080 -c 64 -d 60
+    python3 bench/loadgen.py --target insert_one --url http://127.0.0.1:8000 --project demo -c 32 -n 20000
+
+Each of -c workers posts synthetic frames (bench/frames.py) back to back,
+-d seconds or -n requests in total, optionally capped at --rate req/s.
+Devices are spread over the workers so one device's frames go out in order.
+
+Reported: throughput, latency p50/p90/p99/max, responses per status and –
+for --target bridge – mean time per ingest stage, taken from the delta of
+bridge_ingest_stage_seconds on /metrics over the run. The report is printed
+and saved as JSON (bench/results/<time>-<target>.json or --out), so runs of
+different versions can be compared.
+"""
+import argparse, asyncio, json, os, random, re, socket, subprocess, sys, time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from frames import device_uuids, make_frame
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+_STAGE_RE = re.compile(r'^bridge_ingest_stage_seconds_(sum|count)\{stage="([^"]+)"\}\s+(\S+)', re.M)
+
+
+def percentile(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+async def scrape_stages(session: aiohttp.ClientSession, url: str) -> Dict[str, Tuple[float, float]]:
+    """{stage: (sum_s, count)} from the bridge's /metrics; {} when unavailable."""
+    try:
+        async with session.get(f"{url}/metrics") as r:
+            if r.status != 200:
+                return {}
+            text = await r.text()
+    except aiohttp.ClientError:
+        return {}
+    out: Dict[str, List[float]] = {}
+    for kind, stage, val in _STAGE_RE.findall(text):
+        out.setdefault(stage, [0.0, 0.0])[0 if kind == "sum" else 1] += float(val)
+    return {k: (v[0], v[1]) for k, v in out.items()}
+
+
+def stage_delta(before: Dict[str, Tuple[float, float]], after: Dict[str, Tuple[float, float]]) -> Dict[str, Any]:
+    out = {}
+    for stage, (s1, c1) in sorted(after.items()):
+        s0, c0 = before.get(stage, (0.0, 0.0))
+        n = c1 - c0
+        if n > 0:
+            out[stage] = {"count": int(n), "mean_ms": round((s1 - s0) / n * 1000, 3)}
+    return out
+
+
+def git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Run:
+    def __init__(self, args):
+        self.args = args
+        self.latencies: List[float] = []
+        self.by_status: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.sent = 0
+        self.deadline = 0.0
+        self._next_slot = 0.0
+
+    def _endpoint(self) -> Tuple[str, Dict[str, str]]:
+        a = self.args
+        if a.target == "bridge":
+            hdrs = {"Content-Type": "application/json"}
+            if a.api_key:
+                hdrs["API-Key"] = a.api_key
+            return f"{a.url}/bridge/ingest", hdrs
+        hdrs = {"Content-Type": "application/json"}
+        if a.api_key:
+            hdrs["X-API-Key"] = a.api_key
+        return f"{a.url}/api/measurements/{a.project}/insert_one", hdrs
+
+    def _take(self) -> bool:
+        if self.args.requests and self.sent >= self.args.requests:
+            return False
+        if self.args.duration and time.monotonic() >= self.deadline:
+            return False
+        self.sent += 1
+        return True
+
+    async def _pace(self) -> None:
+        if not self.args.rate:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1.0 / self.args.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def worker(self, session: aiohttp.ClientSession, devices: List[str], seed: int) -> None:
+        rnd = random.Random(seed)
+        url, hdrs = self._endpoint()
+        while self._take():
+            await self._pace()
+            body = json.dumps(make_frame(rnd.choice(devices), rnd, self.args.legacy_ratio)).encode()
+            t0 = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers=hdrs) as r:
+                    await r.read()
+                    self.by_status[r.status] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.errors[type(e).__name__] += 1
+                continue
+            self.latencies.append(time.perf_counter() - t0)
+
+    async def run(self) -> Dict[str, Any]:
+        a = self.args
+        fleet = device_uuids(a.devices, a.seed)
+        shards = [fleet[i::a.concurrency] or fleet for i in range(a.concurrency)]
+        conn = aiohttp.TCPConnector(limit=a.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=a.timeout)
+        async with aiohttp.ClientSession(connector=conn, timeout=timeout) as session:
+            before = await scrape_stages(session, a.url) if a.target == "bridge" else {}
+            self.deadline = time.monotonic() + a.duration if a.duration else 0.0
+            t0 = time.perf_counter()
+            await asyncio.gather(*(self.worker(session, shards[i], a.seed + i) for i in range(a.concurrency)))
+            elapsed = time.perf_counter() - t0
+            # the write-behind flush of the last frames lands after the responses; let it settle
+            await asyncio.sleep(1.0 if a.target == "bridge" else 0)
+            after = await scrape_stages(session, a.url) if a.target == "bridge" else {}
+        return self.report(elapsed, stage_delta(before, after))
+
+    def report(self, elapsed: float, stages: Dict[str, Any]) -> Dict[str, Any]:
+        a = self.args
+        lat = sorted(self.latencies)
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+        ok = sum(n for s, n in self.by_status.items() if 200 <= s < 300)
+        return {
+            "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git": git_rev(),
+            "host": socket.gethostname(),
+            "config": {k: v for k, v in vars(a).items() if k not in ("api_key", "out")},
+            "elapsed_s": round(elapsed, 3),
+            "requests": len(lat) + sum(self.errors.values()),
+            "ok": ok,
+            "throughput_rps": round(len(lat) / elapsed, 2) if elapsed else None,
+            "ok_rps": round(ok / elapsed, 2) if elapsed else None,
+            "latency_ms": {"p50": ms(percentile(lat, 0.50)), "p90": ms(percentile(lat, 0.90)),
+                           "p99": ms(percentile(lat, 0.99)), "max": ms(lat[-1] if lat else None),
+                           "mean": ms(sum(lat) / len(lat) if lat else None)},
+            "by_status": {str(k): v for k, v in sorted(self.by_status.items())},
+            "client_errors": dict(self.errors),
+            "stages": stages,
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingest load generator")
+    ap.add_argument("--target", choices=("bridge", "insert_one"), default="bridge",
+                    help="bridge: POST /bridge/ingest (app.py); insert_one: POST /api/measurements/{project}/insert_one (xerxes_to_tb.py)")
+    ap.add_argument("--url", default="http://127.0.0.1:8080")
+    ap.add_argument("--project", default="bench", help="project_id for --target insert_one")
+    ap.add_argument("--api-key", default=os.getenv("BENCH_API_KEY", ""))
+    ap.add_argument("-c", "--concurrency", type=int, default=32)
+    ap.add_argument("-d", "--duration", type=float, default=30.0, help="seconds (0 = until -n is reached)")
+    ap.add_argument("-n", "--requests", type=int, default=0, help="total requests (0 = until -d elapses)")
+    ap.add_argument("--rate", type=float, default=0.0, help="cap in requests/s over all workers (0 = open loop)")
+    ap.add_argument("--devices", type=int, default=500)
+    ap.add_argument("--legacy-ratio", type=float, default=0.3, help="share of legacy meta/values frames")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--label", default="", help="free text stored with the result (e.g. version under test)")
+    ap.add_argument("--out", help="result file (default bench/results/<time>-<target>.json)")
+    args = ap.parse_args()
+    if not args.duration and not args.requests:
+        ap.error("set -d and/or -n")
+
+    result = asyncio.run(Run(args).run())
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.target}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    lat = result["latency_ms"]
+    print(f"[BENCH] {args.target} c={args.concurrency} {result['requests']} req in {result['elapsed_s']}s "
+          f"→ {result['throughput_rps']} req/s ({result['ok_rps']} ok/s)")
+    print(f"[BENCH] latency ms p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} max={lat['max']}")
+    print(f"[BENCH] status {result['by_status']} errors {result['client_errors']}")
+    for stage, s in result["stages"].items():
+        print(f"[BENCH]   stage {stage:<14} {s['mean_ms']:>9} ms  (n={s['count']})")
+    print(f"[BENCH] saved {out}")
+    if not result["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env bash
+# Local benchmark: throwaway mongod (docker) + fake TB + the service under test, then loadgen.
+#   bench/run_local.sh [loadgen args...]      e.g. bench/run_local.sh -c 64 -d 60 --label v1.3
+#   BENCH_TARGET=bridge (default): serve.py (app.py) on /bridge/ingest; BENCH_FORWARDER=1 also runs
+#       tb_forwarder.py (poll mode) so the stored frames are pushed to the fake TB
+#   BENCH_TARGET=insert_one: xerxes_to_tb.py, which pushes every frame to the fake TB itself
+# Env: BENCH_MONGO_PORT (27117), BENCH_BRIDGE_PORT (18088), BENCH_X2TB_PORT (18089), BENCH_TB_PORT (18080),
+#      BENCH_WORKERS (1), TB_LATENCY_MS (30), TB_ERROR_RATE (0)
+# Don't pass --target / --url to loadgen, BENCH_TARGET sets them.
+set -euo pipefail
+cd "$(dirname "$0")/.."
+
+TARGET="${BENCH_TARGET:-bridge}"
+MONGO_PORT="${BENCH_MONGO_PORT:-27117}"
+BRIDGE_PORT="${BENCH_BRIDGE_PORT:-18088}"
+X2TB_PORT="${BENCH_X2TB_PORT:-18089}"
+TB_PORT="${BENCH_TB_PORT:-18080}"
+MONGO_NAME="xerxes-bench-mongo"
+WORK="$(mktemp -d /tmp/xerxes-bench.XXXXXX)"
+PIDS=()
+
+cleanup() {
+  for p in "${PIDS[@]}"; do kill "$p" 2>/dev/null || true; done
+  wait 2>/dev/null || true
+  docker rm -f "$MONGO_NAME" >/dev/null 2>&1 || true
+  rm -rf "$WORK"
+}
+trap cleanup EXIT
+
+echo "[1/4] mongod on 127.0.0.1:${MONGO_PORT}"
+docker rm -f "$MONGO_NAME" >/dev/null 2>&1 || true
+docker run -d --rm --name "$MONGO_NAME" -p "127.0.0.1:${MONGO_PORT}:27017" mongo:7 >/dev/null
+for i in {1..30}; do
+  docker exec "$MONGO_NAME" mongosh --quiet --eval 'db.runCommand({ping:1}).ok' >/dev/null 2>&1 && break; sleep 1
+done
+
+echo "[2/4] fake TB on 127.0.0.1:${TB_PORT}"
+python3 bench/fake_tb.py --port "$TB_PORT" --latency-ms "${TB_LATENCY_MS:-30}" --error-rate "${TB_ERROR_RATE:-0}" &
+PIDS+=($!)
+
+wait_http() {
+  for i in {1..30}; do curl -fsS "$1" >/dev/null 2>&1 && return 0; sleep 1; done
+  echo "not up: $1" >&2; return 1
+}
+
+if [ "$TARGET" = "insert_one" ]; then
+  echo "[3/4] xerxes_to_tb on 127.0.0.1:${X2TB_PORT} -> fake TB"
+  MONGODB_URI="mongodb://127.0.0.1:${MONGO_PORT}" DB_NAME="xerxes_bench_x2tb" TB_TOKEN="bench-token" \
+  TB_HOST="http://127.0.0.1:${TB_PORT}" PROJECT_API_KEY="" BRIDGE_KEY="" LOG_LEVEL=WARNING \
+    python3 -m uvicorn xerxes_to_tb:app --host 127.0.0.1 --port "$X2TB_PORT" --log-level warning &
+  PIDS+=($!)
+  URL="http://127.0.0.1:${X2TB_PORT}"
+else
+  echo "[3/4] bridge on 127.0.0.1:${BRIDGE_PORT}"
+  MONGO_URI="mongodb://127.0.0.1:${MONGO_PORT}" MONGO_DB="xerxes_bench" PROJECT_API_KEY="" \
+  TB_HOST="http://127.0.0.1:${TB_PORT}" SPOOL_DIR="$WORK/spool" METRICS_DIR="$WORK/metrics" \
+  BRIDGE_HOST=127.0.0.1 BRIDGE_PORT="$BRIDGE_PORT" BRIDGE_WORKERS="${BENCH_WORKERS:-1}" LOG_LEVEL=WARNING \
+    python3 serve.py &
+  PIDS+=($!)
+  URL="http://127.0.0.1:${BRIDGE_PORT}"
+  if [ "${BENCH_FORWARDER:-0}" = "1" ]; then
+    echo "      + tb_forwarder -> fake TB"
+    # tokens for loadgen's fleet (device_uuids is prefix-stable, so 10000 covers any --devices up to that)
+    (cd bench && python3 -c "import json, frames; print(json.dumps({u: 'bench-' + u for u in frames.device_uuids(10000)}))") \
+      > "$WORK/token_map.json"
+    MONGO_URI="mongodb://127.0.0.1:${MONGO_PORT}" MONGO_DB="xerxes_bench" PROJECT_API_KEY="" \
+    TB_HOST="http://127.0.0.1:${TB_PORT}" TOKEN_MAP_PATH="$WORK/token_map.json" FWD_MODE=poll LOG_LEVEL=WARNING \
+      python3 tb_forwarder.py &
+    PIDS+=($!)
+  fi
+fi
+wait_http "${URL}/health"
+
+echo "[4/4] loadgen (${TARGET})"
+python3 bench/loadgen.py --target "$TARGET" --url "$URL" "$@"
+if [ "$TARGET" = "bridge" ] && [ "${BENCH_FORWARDER:-0}" = "1" ]; then
+  sleep "${FWD_SETTLE_S:-5}"      # let the forwarder catch up before reading the TB counters
+fi
+curl -fsS "http://127.0.0.1:${TB_PORT}/stats" || true
+echo
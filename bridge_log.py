@@ -0,0 +1,196 @@
+"""
+Bridge logging: records are formatted and written to stdout by a background
+thread (QueueHandler → QueueListener), so the event loop never blocks on the
+Docker log driver.
+
+- LOG_FORMAT=json (default) | text
+- LOG_LEVEL (default INFO)
+- INFO/DEBUG are sampled (LOG_SAMPLE_INFO / LOG_SAMPLE_DEBUG, 0..1) and rate
+  limited per level (LOG_RATE_INFO / LOG_RATE_DEBUG records per second);
+  the next record that passes carries the number suppressed meanwhile.
+- WARNING and above are never sampled or dropped.
+
+Each record carries request_id / uuid bound for the current request
+(bind_request) plus any `extra` fields, e.g. stage timings.
+"""
+import os, sys, time, queue, random, logging, logging.handlers, uuid as _uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import ingest_codec as codec
+
+LOG_LEVEL        = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT       = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_INFO  = float(os.getenv("LOG_SAMPLE_INFO", "1"))
+LOG_SAMPLE_DEBUG = float(os.getenv("LOG_SAMPLE_DEBUG", "1"))
+LOG_RATE_INFO    = float(os.getenv("LOG_RATE_INFO", "200"))
+LOG_RATE_DEBUG   = float(os.getenv("LOG_RATE_DEBUG", "50"))
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_uuid_var: ContextVar[Optional[str]] = ContextVar("uuid", default=None)
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("stages", default=None)
+
+# LogRecord attributes that are not user `extra`
+_STD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind_request(request_id: Optional[str] = None) -> str:
+    """New request context: request id (given or generated) and an empty stage-timing dict."""
+    rid = request_id or _uuid.uuid4().hex[:16]
+    _request_id.set(rid)
+    _uuid_var.set(None)
+    _stages.set({})
+    return rid
+
+
+def bind_uuid(uuid: Optional[str]) -> None:
+    _uuid_var.set(uuid)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    st = _stages.get()
+    if st is not None:
+        st[stage] = round(seconds * 1000, 3)
+
+
+def stage_timings() -> Dict[str, float]:
+    return dict(_stages.get() or {})
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        # runs on the caller's side of the queue, where the contextvars live
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        if not hasattr(record, "uuid"):
+            record.uuid = _uuid_var.get()
+        return True
+
+
+class _SamplingFilter(logging.Filter):
+    """Per-level sampling + token bucket for DEBUG/INFO; WARNING+ always pass."""
+
+    def __init__(self):
+        super().__init__()
+        now = time.monotonic()
+        self._cfg = {
+            logging.INFO: (LOG_SAMPLE_INFO, LOG_RATE_INFO),
+            logging.DEBUG: (LOG_SAMPLE_DEBUG, LOG_RATE_DEBUG),
+        }
+        self._tokens = {lvl: rate for lvl, (_, rate) in self._cfg.items()}
+        self._last = {lvl: now for lvl in self._cfg}
+        self._suppressed = {lvl: 0 for lvl in self._cfg}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        lvl = logging.INFO if record.levelno >= logging.INFO else logging.DEBUG
+        sample, rate = self._cfg[lvl]
+        if sample < 1 and random.random() >= sample:
+            self._suppressed[lvl] += 1
+            return False
+        if rate > 0:
+            now = time.monotonic()
+            self._tokens[lvl] = min(rate, self._tokens[lvl] + (now - self._last[lvl]) * rate)
+            self._last[lvl] = now
+            if self._tokens[lvl] < 1:
+                self._suppressed[lvl] += 1
+                return False
+            self._tokens[lvl] -= 1
+        if self._suppressed[lvl]:
+            record.suppressed = self._suppressed[lvl]
+            self._suppressed[lvl] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _STD_ATTRS and v is not None:
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return codec.dumps(out).decode("utf-8")
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        extra = " ".join(f"{k}={v}" for k, v in record.__dict__.items() if k not in _STD_ATTRS and v is not None)
+        base = f"{datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds')} {record.levelname} {record.name} {record.getMessage()}"
+        line = f"{base} {extra}" if extra else base
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # keep `extra` fields (the stock prepare() would keep them too, but also
+        # formats exc_info eagerly on the event loop – leave that to the writer)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup() -> None:
+    """Install the queue-backed handler on the `bridge` logger (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(q, out, respect_handler_level=False)
+    _listener.start()
+
+    qh = _QueueHandler(q)
+    qh.addFilter(_SamplingFilter())
+    qh.addFilter(_ContextFilter())
+    root = logging.getLogger("bridge")
+    root.handlers[:] = [qh]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def shutdown() -> None:
+    """Drain the queue (all pending records are written) and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup()
+    return logging.getLogger(f"bridge.{name}" if not name.startswith("bridge") else name)
+
+
+class RequestContextMiddleware:
+    """Pure ASGI middleware: binds a request id (X-Request-Id / cf-ray or a new one) and echoes it back."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        hdrs = dict(scope.get("headers") or [])
+        given = hdrs.get(b"x-request-id") or hdrs.get(b"cf-ray")
+        rid = bind_request(given.decode("latin-1")[:64] if given else None)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, _send)
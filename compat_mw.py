@@ -1,7 +1,8 @@
-import os, json, datetime
+import os, datetime
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import Message, Receive
-from typing import Dict, Any, Optional, Iterable, Tuple
+from typing import Any, Optional
+
+import ingest_codec as codec
 
 def _health_keys() -> set:
     raw = os.getenv("HEALTH_KEYS", "temp,rh,pm10,co2")
@@ -34,60 +35,80 @@ def _is_synthetic(meas: dict) -> bool:
     keys = set(meas.keys())
     return len(keys) <= len(_HEALTH) and keys.issubset(_HEALTH)
 
-def _replace_header(scope_headers: Iterable[Tuple[bytes, bytes]], name: bytes, value: bytes) -> list:
-    name_l = name.lower()
-    out = []
-    seen = False
-    for k, v in scope_headers:
-        if k.lower() == name_l:
-            if not seen:
-                out.append((name, value))
-                seen = True
-            # drop duplicates
-        else:
-            out.append((k, v))
-    if not seen:
-        out.append((name, value))
-    return out
+class DecodedIngest:
+    """
+    One ingest body decoded exactly once: the original bytes (for the raw
+    log), the parsed JSON as received and the payload handed to the handler
+    (normalized when asked). `error` is set when the body is not valid JSON.
+    """
+    __slots__ = ("raw", "parsed", "payload", "error")
+
+    def __init__(self, raw: bytes, parsed: Any, payload: Any, error: Optional[str] = None):
+        self.raw = raw
+        self.parsed = parsed
+        self.payload = payload
+        self.error = error
+
+    @property
+    def raw_json(self) -> Any:
+        """What ingest_raw.body stores: parsed JSON, or the text when it did not parse."""
+        if self.error is not None:
+            return {"_raw": self.raw.decode("utf-8", "ignore")}
+        return self.parsed
+
+
+def decode_ingest(raw: bytes, normalize: bool = True, fmt: str = "json") -> DecodedIngest:
+    """
+    fmt is codec.body_format() of the request. A MessagePack/CBOR body is
+    kept as its JSON rendering in `raw`, so the raw log stays readable JSON.
+    """
+    try:
+        parsed = codec.loads_as(raw, fmt) if raw else None
+    except ValueError as e:
+        return DecodedIngest(raw, None, None, error=str(e))
+    if fmt != "json" and parsed is not None:
+        raw = codec.dumps(parsed)
+    payload = parsed
+    if normalize and isinstance(parsed, dict):
+        # normalize_payload may reshape/mutate – keep `parsed` as received
+        payload = normalize_payload(dict(parsed))
+    return DecodedIngest(raw, parsed, payload)
+
+
+def _enrich_meta(fixed: dict) -> None:
+    meta = dict(fixed.get("meta") or {})
+    meas = fixed.get("measurements") or {}
+
+    ingest = dict(meta.get("ingest") or {})
+    ingest.update({
+        "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "synthetic": _is_synthetic(meas),
+        "flavor": os.getenv("BRIDGE_FLAVOR", ""),
+        "edge": os.getenv("EDGE_UPSTREAM", ""),
+        "api": os.getenv("APP_VERSION", "v1"),
+        "keys": list(meas.keys()) if isinstance(meas, dict) else []
+    })
+    meta["ingest"] = ingest
+    fixed["meta"] = meta
+
 
 class CompatIngestMiddleware(BaseHTTPMiddleware):
+    """
+    Decodes + normalizes the ingest body once and leaves the result on
+    request.state.ingest (DecodedIngest). Handlers read it from there instead
+    of re-parsing; the body itself is no longer re-serialized.
+    """
     async def dispatch(self, request, call_next):
         path = request.url.path or ""
         if request.method == "POST" and (path.startswith("/bridge/ingest") or path == "/ingest"):
             try:
-                raw = await request.body()
+                raw = codec.decompress_body(await request.body(), request.headers.get("content-encoding"))
                 if raw:
-                    parsed = json.loads(raw.decode("utf-8"))
-                    fixed = normalize_payload(parsed)
-                    if isinstance(fixed, dict):
-                        meta = fixed.get("meta") or {}
-                        meas = fixed.get("measurements") or {}
-
-                        ingest = dict(meta.get("ingest") or {})
-                        ingest.update({
-                            "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-                            "synthetic": _is_synthetic(meas),
-                            "flavor": os.getenv("BRIDGE_FLAVOR", ""),
-                            "edge": os.getenv("EDGE_UPSTREAM", ""),
-                            "api": os.getenv("APP_VERSION", "v1"),
-                            "keys": list(meas.keys()) if isinstance(meas, dict) else []
-                        })
-                        meta["ingest"] = ingest
-                        fixed["meta"] = meta
-
-                        new_body = json.dumps(fixed, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
-
-                        # Preprogramuj receive() tak, aby odovzdal nové body handleru
-                        async def _receive() -> Message:
-                            return {"type": "http.request", "body": new_body, "more_body": False}
-                        request._receive = _receive  # type: ignore[attr-defined]
-
-                        # Uprav Content-Length hlavičku
-                        scope = request.scope
-                        scope["headers"] = _replace_header(scope.get("headers") or [],
-                                                           b"content-length",
-                                                           str(len(new_body)).encode("ascii"))
-            except Exception as e:
+                    decoded = decode_ingest(raw, normalize=True, fmt=codec.body_format(request.headers.get("content-type")))
+                    if isinstance(decoded.payload, dict):
+                        _enrich_meta(decoded.payload)
+                    request.state.ingest = decoded
+            except Exception:
                 # middleware nikdy nesmie zastaviť ingest
                 pass
 
@@ -0,0 +1,197 @@
+import os, math, asyncio, hashlib, time
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from pymongo.errors import PyMongoError, WriteError
+
+import ingest_codec as codec
+import bridge_log
+import metrics
+import write_behind as wb
+
+DEDUP_ENABLED  = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_WINDOW_S = float(os.getenv("DEDUP_WINDOW_S", "900"))
+DEDUP_EXPECTED = int(os.getenv("DEDUP_EXPECTED", "200000"))   # frames per window
+DEDUP_FP_RATE  = float(os.getenv("DEDUP_FP_RATE", "0.001"))
+DEDUP_TTL_S    = int(os.getenv("DEDUP_TTL_S", "86400"))
+DEDUP_CONFIRM_MISSES  = os.getenv("DEDUP_CONFIRM_MISSES", "1") == "1"   # 0 = filter-only dedup per worker
+DEDUP_INFLIGHT_WAIT_S = float(os.getenv("DEDUP_INFLIGHT_WAIT_S", "30"))
+DEDUP_COLL     = "ingest_dedup"
+
+log = bridge_log.get_logger("dedup")
+
+DEDUP_DUPLICATES = metrics.Counter("bridge_dedup_duplicates_total", "Frames acknowledged as duplicates without writes", ("source",))
+DEDUP_CONFIRMS   = metrics.Counter("bridge_dedup_confirms_total", "Frame keys checked against the ingest_dedup unique index", ("result",))
+
+
+def frame_key(uuid: str, ts_ms: int, merged: Dict[str, Any]) -> bytes:
+    """16-byte identity of a frame: canonical uuid, device ts and the merged measurements."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{uuid}|{ts_ms}|".encode("utf-8"))
+    h.update(codec.dumps(merged, sort_keys=True))
+    return h.digest()
+
+
+class BloomFilter:
+    def __init__(self, expected: int, fp_rate: float):
+        n = max(1, expected)
+        self.m = max(64, int(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / n * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _idx(self, key: bytes):
+        # double hashing over the two halves of the (already uniform) key
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def add(self, key: bytes) -> None:
+        for i in self._idx(key):
+            self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._idx(key))
+
+
+class Deduplicator:
+    """
+    Duplicate-frame suppression for ingest.
+
+    Every new key is recorded in ingest_dedup (_id = key, TTL on `at`)
+    through the write-behind buffer and the insert is awaited: the unique
+    _id decides across workers and restarts, a duplicate-key error means the
+    frame was accepted before. Keys of recent frames also live in two Bloom
+    filters (current + previous window, rotated every window_s); they only
+    tell an in-window repeat ("index") from an older one ("late"). With the
+    default DEDUP_CONFIRM_MISSES=1 every new frame therefore still costs one
+    ingest_dedup insert (grouped by the write-behind buffer, so concurrent
+    claims – e.g. a whole batch – share one insert_many); the filter saves
+    no round-trip. With DEDUP_CONFIRM_MISSES=0 a filter miss is accepted
+    without waiting for the insert – no Mongo wait per frame, but then a
+    retry is only caught by the same worker.
+
+    A key stays in flight from claim() until the frame is stored() or
+    released(); a second claim of it waits for that outcome first, so a
+    retry is only acknowledged as duplicate once the original was written.
+    Mongo errors during the check fail open – the frame is written.
+    """
+
+    def __init__(self, coll, window_s: float = DEDUP_WINDOW_S,
+                 expected: int = DEDUP_EXPECTED, fp_rate: float = DEDUP_FP_RATE,
+                 confirm_misses: bool = DEDUP_CONFIRM_MISSES):
+        self.coll = coll
+        self.window_s = window_s
+        self.expected = expected
+        self.fp_rate = fp_rate
+        self.confirm_misses = confirm_misses
+        self._cur = BloomFilter(expected, fp_rate)
+        self._prev = BloomFilter(1, fp_rate)
+        self._rotated_at = time.monotonic()
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        self._bg: Set[asyncio.Task] = set()
+        self._buf = wb.WriteBehindBuffer(coll) if wb.WB_ENABLED else None
+
+    async def ensure_indexes(self, ttl_s: int = DEDUP_TTL_S) -> None:
+        try:
+            await self.coll.create_index("at", expireAfterSeconds=ttl_s)
+        except PyMongoError as e:
+            log.warning("ingest_dedup TTL index not set: %s", e)
+
+    def _rotate(self) -> None:
+        if time.monotonic() - self._rotated_at >= self.window_s:
+            self._prev, self._cur = self._cur, BloomFilter(self.expected, self.fp_rate)
+            self._rotated_at = time.monotonic()
+
+    async def _record(self, key: bytes, uuid: str) -> bool:
+        """Insert the key; False when the unique _id says it was there already."""
+        try:
+            await wb.submit(self._buf, self.coll, {"_id": key.hex(), "uuid": uuid, "at": datetime.utcnow()})
+        except WriteError as e:
+            if e.code == 11000:
+                return False
+            raise
+        return True
+
+    async def _record_bg(self, key: bytes, uuid: str) -> None:
+        try:
+            if not await self._record(key, uuid):
+                DEDUP_DUPLICATES.inc("late")
+        except PyMongoError as e:
+            log.info("ingest_dedup insert failed: %s", e)
+
+    def _settle(self, key: bytes, stored: bool) -> None:
+        fut = self._inflight.pop(key, None)
+        if fut is not None and not fut.done():
+            fut.set_result(stored)
+
+    async def _wait_original(self, key: bytes) -> Optional[bool]:
+        """Outcome of the in-flight original of this key: True stored, False released, None still open."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._inflight[key]), DEDUP_INFLIGHT_WAIT_S)
+        except asyncio.TimeoutError:
+            return None
+
+    async def claim(self, key: bytes, uuid: str, confirm: bool = True) -> bool:
+        """
+        True when the frame is new and should be written – the caller then
+        reports stored() or release() – False for a duplicate. With
+        confirm=False (Mongo known down) the frame is accepted unchecked.
+        """
+        self._rotate()
+        # a released original leaves the key free – the next waiter takes it over
+        while key in self._inflight:
+            stored = await self._wait_original(key)
+            if stored:
+                DEDUP_DUPLICATES.inc("inflight")
+                return False
+            if stored is None:
+                log.warning("dedup: original frame still in flight after %.0fs, accepting retry", DEDUP_INFLIGHT_WAIT_S)
+                DEDUP_CONFIRMS.inc("timeout")
+                return True
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+
+        hit = key in self._cur or key in self._prev
+        self._cur.add(key)
+        if not confirm:
+            if hit:
+                DEDUP_CONFIRMS.inc("skipped")
+            return True
+        if not hit and not self.confirm_misses:
+            t = asyncio.ensure_future(self._record_bg(key, uuid))
+            self._bg.add(t)
+            t.add_done_callback(self._bg.discard)
+            return True
+
+        try:
+            new = await self._record(key, uuid)
+        except PyMongoError as e:
+            log.warning("dedup check failed, accepting frame: %s", e)
+            DEDUP_CONFIRMS.inc("error")
+            return True
+        DEDUP_CONFIRMS.inc("new" if new else "duplicate")
+        if not new:
+            # accepted earlier (other worker, before a restart, or before this window)
+            DEDUP_DUPLICATES.inc("index" if hit else "late")
+            self._settle(key, True)
+        return new
+
+    def stored(self, key: bytes) -> None:
+        """The claimed frame was written (or spooled); waiting retries are duplicates."""
+        self._settle(key, True)
+
+    async def release(self, key: bytes) -> None:
+        """Forget a claimed key whose frame was not stored, so the device's retry is accepted."""
+        try:
+            await self.coll.delete_one({"_id": key.hex()})
+        except PyMongoError as e:
+            log.warning("ingest_dedup release failed: %s", e)
+        finally:
+            self._settle(key, False)
+
+    async def flush(self) -> None:
+        if self._buf is not None:
+            await self._buf.flush()
+        if self._bg:
+            await asyncio.gather(*list(self._bg), return_exceptions=True)
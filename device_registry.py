@@ -0,0 +1,108 @@
+import os, time, hashlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import ingest_codec as codec
+
+DEVICE_CACHE         = os.getenv("DEVICE_CACHE", "1") == "1"
+DEVICE_TS_COALESCE_S = float(os.getenv("DEVICE_TS_COALESCE_S", "60"))
+
+# meta parts that change on every frame – not part of the "meta changed" hash
+_VOLATILE_META = ("ingest", "payload")
+_TRACKED = ("battery_v", "fw_version", "csq")
+
+
+def meta_hash(meta: Dict[str, Any]) -> str:
+    stable = {k: v for k, v in (meta or {}).items() if k not in _VOLATILE_META}
+    return hashlib.blake2b(codec.dumps(stable, sort_keys=True), digest_size=16).hexdigest()
+
+
+class DeviceRegistry:
+    """
+    In-memory view of what was last written to `devices`, keyed by canonical
+    uuid. plan() turns a frame's full $set into an update carrying only the
+    fields that changed; last_real_ts alone is written at most once per
+    coalesce_s per device, the newest pending value is written by
+    flush_ops(). A device not yet in the cache (e.g. after a restart) gets
+    the full update once.
+
+    The cache is updated when an update is planned; call invalidate() when
+    the write fails, so the next frame writes the full state again.
+    """
+
+    def __init__(self, meta_field: str = "meta", coalesce_s: float = DEVICE_TS_COALESCE_S):
+        self.meta_field = meta_field
+        self.coalesce_s = coalesce_s
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self.planned = 0
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def plan(self, uuid: str, orig_uuid: str, safe_set: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        meta = safe_set.get(self.meta_field) or {}
+        mh = meta_hash(meta)
+        ts: datetime = safe_set["last_real_ts"]
+        e = self._devices.get(uuid)
+
+        if e is None:
+            self._devices[uuid] = {
+                **{k: safe_set.get(k) for k in _TRACKED},
+                "meta_hash": mh, "aliases": {orig_uuid},
+                "ts_written_at": now, "ts_pending": None,
+            }
+            self.planned += 1
+            return {
+                "$setOnInsert": {"uuid": uuid},
+                "$set": safe_set,
+                "$addToSet": {"aliases": {"$each": [orig_uuid]}},
+            }
+
+        changed: Dict[str, Any] = {}
+        for k in _TRACKED:
+            if k in safe_set and safe_set[k] != e[k]:
+                changed[k] = e[k] = safe_set[k]
+        if mh != e["meta_hash"]:
+            changed[self.meta_field] = meta
+            e["meta_hash"] = mh
+        new_alias = orig_uuid not in e["aliases"]
+
+        # last_real_ts rides along with any other change, else at most once per coalesce_s
+        if changed or new_alias or now - e["ts_written_at"] >= self.coalesce_s:
+            changed["last_real_ts"] = ts
+            e["ts_written_at"] = now
+            e["ts_pending"] = None
+        else:
+            e["ts_pending"] = ts
+            self.skipped += 1
+            return None
+
+        update: Dict[str, Any] = {"$setOnInsert": {"uuid": uuid}, "$set": changed}
+        if new_alias:
+            e["aliases"].add(orig_uuid)
+            update["$addToSet"] = {"aliases": {"$each": [orig_uuid]}}
+        self.planned += 1
+        return update
+
+    def invalidate(self, uuid: str) -> None:
+        self._devices.pop(uuid, None)
+
+    def flush_ops(self, force: bool = False) -> List[UpdateOne]:
+        """UpdateOne ops for last_real_ts values held back longer than coalesce_s (all of them with force)."""
+        now = time.monotonic()
+        ops: List[UpdateOne] = []
+        for uuid, e in self._devices.items():
+            ts = e["ts_pending"]
+            if ts is None or (not force and now - e["ts_written_at"] < self.coalesce_s):
+                continue
+            ops.append(UpdateOne({"uuid": uuid}, {"$set": {"last_real_ts": ts}}))
+            e["ts_pending"] = None
+            e["ts_written_at"] = now
+        return ops
+
+    def stats(self) -> Tuple[int, int, int]:
+        return len(self._devices), self.planned, self.skipped
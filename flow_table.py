@@ -2,8 +2,7 @@
 import os
 import sys
 import json
-import requests
-from pymongo import MongoClient
+from startup_trace import TRACE, mongo_client
 from datetime import datetime, timedelta
 
 TB_BASE = os.getenv("TB_BASE", "https://eu.thingsboard.cloud")
@@ -20,7 +19,7 @@ since_dt = datetime.utcnow() - timedelta(hours=LOOKBACK_HOURS)
 # LOAD MONGO MAP
 # ----------------------------------------------------------------------
 def load_mongo():
-    client = MongoClient(MONGO_URI)
+    client = mongo_client(MONGO_URI)
     coll = client[MONGO_DB][MONGO_COLL]
     docs = coll.aggregate([
         {"$match": {"ts": {"$gte": since_dt}}},
@@ -42,6 +41,7 @@ def load_mongo():
 # LOAD TB MAP
 # ----------------------------------------------------------------------
 def load_tb():
+    import requests   # only needed here; keeps the import off the cold start
     hdr = {"X-Authorization": f"Bearer {TB_JWT}"}
     devs = requests.get(f"{TB_BASE}/api/tenant/devices?pageSize=500&page=0", headers=hdr).json()
     out = {}
@@ -113,8 +113,11 @@ def main():
         print("ERROR: missing MONGO_URI", file=sys.stderr)
         sys.exit(1)
 
-    mongo_map = load_mongo()
-    tb_map = load_tb()
+    TRACE.mark("import")
+    with TRACE.phase("mongo_query"):
+        mongo_map = load_mongo()
+    with TRACE.phase("tb_query"):
+        tb_map = load_tb()
     rows = classify(mongo_map, tb_map)
 
     print("uuid,device_id,path_class,has_mongo,has_tb,mongo_count,tb_count,last_mongo_ts,last_tb_ts")
@@ -0,0 +1,274 @@
+import os, json, math, re, zlib
+from typing import Any, AsyncIterable, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback, same results – just slower
+    orjson = None
+
+# optional binary body formats; without the package the content type gets 415
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+HAS_ORJSON = orjson is not None
+
+INGEST_MAX_BODY_BYTES = int(os.getenv("INGEST_MAX_BODY_BYTES", str(1024 * 1024)))         # after decompression
+INGEST_BATCH_MAX_BYTES = int(os.getenv("INGEST_BATCH_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+def loads(raw: bytes | str) -> Any:
+    """
+    orjson fast path; anything orjson refuses (NaN/Infinity, ints beyond
+    64 bit, ...) is retried with stdlib json so accept/reject stays identical.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, sort_keys=sort_keys, default=str).encode("utf-8")
+
+
+class BodyError(ValueError):
+    """Request body that cannot be read at all (→ HTTP status_code, not a 422)."""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+class _Inflater:
+    """
+    Incremental gzip/deflate decoder that stops at `limit` decompressed bytes.
+    A gzip body may hold several members (RFC 1952, e.g. `cat a.gz b.gz`);
+    they are decoded one after another. Data after a deflate stream is a 400.
+    """
+
+    def __init__(self, encoding: str, limit: int):
+        self.encoding = encoding
+        self.limit = limit
+        self.total = 0
+        self._d: Optional[Any] = None
+        self._head = b""
+
+    def _make(self, first: bytes):
+        if self.encoding in ("gzip", "x-gzip"):
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # "deflate" is zlib-wrapped per RFC 9110, but raw deflate is common in the wild
+        zlib_header = len(first) >= 2 and first[0] & 0x0F == 8 and (first[0] << 8 | first[1]) % 31 == 0
+        return zlib.decompressobj(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._d is None:
+            self._head += chunk
+            if len(self._head) < 2:
+                return b""
+            chunk, self._head = self._head, b""
+            self._d = self._make(chunk)
+        out = bytearray()
+        while True:
+            try:
+                part = self._d.decompress(chunk, self.limit - self.total + 1)
+            except zlib.error as e:
+                raise BodyError(400, f"invalid {self.encoding} body: {e}")
+            self.total += len(part)
+            if self.total > self.limit:
+                raise BodyError(413, f"body exceeds {self.limit} bytes")
+            out += part
+            if not (self._d.eof and self._d.unused_data):
+                return bytes(out)
+            # bytes past the end of this stream: the next gzip member
+            if self.encoding == "deflate":
+                raise BodyError(400, "invalid deflate body: data after end of stream")
+            chunk = self._d.unused_data
+            self._d = self._make(chunk)
+
+    def finish(self) -> bytes:
+        if self._d is None:
+            if not self._head:
+                return b""
+            self._d = self._make(self._head)
+            return self.feed(b"")
+        if not self._d.eof:
+            raise BodyError(400, f"truncated {self.encoding} body")
+        return b""
+
+
+def _inflater(content_encoding: Optional[str], limit: int) -> Optional[_Inflater]:
+    enc = (content_encoding or "identity").strip().lower()
+    if enc in ("", "identity"):
+        return None
+    if enc in ("gzip", "x-gzip", "deflate"):
+        return _Inflater(enc, limit)
+    raise BodyError(415, f"unsupported Content-Encoding: {enc}")
+
+
+async def read_body(chunks: AsyncIterable[bytes], content_encoding: Optional[str] = None,
+                    limit: int = INGEST_MAX_BODY_BYTES) -> bytes:
+    """Request body from the ASGI stream, decompressed on the fly; BodyError past `limit` bytes."""
+    inf = _inflater(content_encoding, limit)
+    out = bytearray()
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise BodyError(413, f"body exceeds {limit} bytes")
+        out += inf.feed(chunk) if inf is not None else chunk
+    if inf is not None:
+        out += inf.finish()
+    return bytes(out)
+
+
+def decompress_body(raw: bytes, content_encoding: Optional[str] = None,
+                    limit: int = INGEST_MAX_BODY_BYTES) -> bytes:
+    """Same as read_body() for a body that is already in memory."""
+    inf = _inflater(content_encoding, limit)
+    if inf is None:
+        if len(raw) > limit:
+            raise BodyError(413, f"body exceeds {limit} bytes")
+        return raw
+    out = bytearray()
+    for i in range(0, len(raw), 64 * 1024):
+        out += inf.feed(raw[i:i + 64 * 1024])
+    return bytes(out + inf.finish())
+
+
+def body_format(content_type: Optional[str]) -> str:
+    """json | msgpack | cbor from the Content-Type; BodyError 415 when the package for it is missing."""
+    ct = (content_type or "").split(";", 1)[0].strip().lower()
+    if ct in ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack"):
+        if msgpack is None:
+            raise BodyError(415, "application/msgpack needs the msgpack package")
+        return "msgpack"
+    if ct == "application/cbor":
+        if cbor2 is None:
+            raise BodyError(415, "application/cbor needs the cbor2 package")
+        return "cbor"
+    return "json"
+
+
+def loads_as(raw: bytes, fmt: str = "json") -> Any:
+    """Parse a body in the given format; every failure is a ValueError like bad JSON."""
+    if fmt == "msgpack":
+        try:
+            return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise ValueError(f"invalid msgpack: {e}") from None
+    if fmt == "cbor":
+        try:
+            return cbor2.loads(raw)
+        except Exception as e:
+            raise ValueError(f"invalid cbor: {e}") from None
+    return loads(raw)
+
+
+class FrameValidationError(ValueError):
+    """Carries pydantic-style error dicts ({type, loc, msg, input})."""
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(errors)
+        self._errors = errors
+
+    def errors(self) -> List[Dict[str, Any]]:
+        return self._errors
+
+
+class IngestFrame:
+    """
+    Ingest body (replaces the pydantic IngestBody). validate_frame() applies
+    the same lax rules pydantic v2 applied to that model, so the accepted /
+    rejected outcome of every body is unchanged.
+    """
+    __slots__ = ("uuid", "meta", "measurements", "values", "ts")
+
+    def __init__(self, uuid: Optional[str] = None, meta: Optional[Dict[str, Any]] = None,
+                 measurements: Optional[Dict[str, Any]] = None, values: Optional[Dict[str, Any]] = None,
+                 ts: Optional[int] = None):
+        self.uuid = uuid
+        self.meta = meta
+        self.measurements = measurements
+        self.values = values
+        self.ts = ts
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+_INT_RE = re.compile(r"[+-]?\d+")
+_INT_FLOAT_RE = re.compile(r"[+-]?\d+\.0*")
+
+
+def _err(kind: str, field: str, msg: str, value: Any) -> Dict[str, Any]:
+    return {"type": kind, "loc": (field,), "msg": msg, "input": value}
+
+
+def _to_int(field: str, v: Any, errors: List[Dict[str, Any]]) -> Optional[int]:
+    # bool is an int subclass and pydantic (lax) accepts it as well
+    if isinstance(v, int):
+        return int(v)
+    if isinstance(v, float):
+        if math.isnan(v) or math.isinf(v):
+            errors.append(_err("finite_number", field, "Input should be a finite number", v))
+        elif not v.is_integer():
+            errors.append(_err("int_from_float", field, "Input should be a valid integer, got a number with a fractional part", v))
+        else:
+            return int(v)
+        return None
+    if isinstance(v, str):
+        s = v.strip()
+        if _INT_RE.fullmatch(s):
+            return int(s)
+        if _INT_FLOAT_RE.fullmatch(s):
+            return int(s.split(".", 1)[0])
+        errors.append(_err("int_parsing", field, "Input should be a valid integer, unable to parse string as an integer", v))
+        return None
+    errors.append(_err("int_type", field, "Input should be a valid integer", v))
+    return None
+
+
+def validate_frame(obj: Any) -> IngestFrame:
+    if not isinstance(obj, dict):
+        raise FrameValidationError([{
+            "type": "model_attributes_type", "loc": (),
+            "msg": "Input should be a valid dictionary or object to extract fields from", "input": obj,
+        }])
+    errors: List[Dict[str, Any]] = []
+    frame = IngestFrame()
+
+    v = obj.get("uuid")
+    if v is not None:
+        if isinstance(v, str):
+            frame.uuid = v
+        else:
+            errors.append(_err("string_type", "uuid", "Input should be a valid string", v))
+
+    for field in ("meta", "measurements", "values"):
+        v = obj.get(field)
+        if v is None:
+            continue
+        if isinstance(v, dict):
+            # shallow copy like pydantic – handlers mutate meta, the raw log must not see it
+            setattr(frame, field, dict(v))
+        else:
+            errors.append(_err("dict_type", field, "Input should be a valid dictionary", v))
+
+    v = obj.get("ts")
+    if v is not None:
+        frame.ts = _to_int("ts", v, errors)
+
+    if errors:
+        raise FrameValidationError(errors)
+    return frame
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Compatibility replay for ingest_codec: every body is decoded + validated by
+the old path (stdlib json + the pydantic IngestBody model app.py used) and by
+the new one (ingest_codec.loads + validate_frame). Any difference in parsed
+data, accepted/rejected outcome or error type/location is reported.
+
+Corpus sources:
+  --mongo N        last N ingest_raw bodies (default 2000; compact docs too)
+  --corpus FILE    NDJSON replay file, one raw body per line ({"raw": "..."});
+                   default tests/data/ingest_compat_corpus.ndjson (anonymised
+                   fleet bodies, also replayed by tests/test_ingest_codec_compat.py)
+  --save FILE      write the corpus that was replayed (incl. built-ins)
+Built-in edge cases (ts as str/float/bool, uuid as int, non-dict meta, ...)
+are always replayed.
+
+Exit code 1 when any body differs.
+"""
+import os, sys, json, argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+import ingest_codec as codec
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/?authSource=admin")
+MONGO_DB  = os.getenv("MONGO_DB", "xerxes")
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "data", "ingest_compat_corpus.ndjson")
+
+
+class IngestBody(BaseModel):
+    """Reference: the model app.py validated ingest bodies with before ingest_codec."""
+    uuid: Optional[str] = None
+    meta: Optional[Dict[str, Any]] = None
+    measurements: Optional[Dict[str, Any]] = None
+    values: Optional[Dict[str, Any]] = None
+    ts: Optional[int] = None
+
+
+BUILTIN = [
+    '{"uuid":"229252442470304","ts":1762782999000,"values":{"temp":20.9,"rh":44.4},"meta":{"version":"v1.5.0"}}',
+    '{"meta":{"uuid":229252442470304},"values":{"pm10":0.1}}',
+    '{"uuid":"Sensor-1","measurements":{"temp":1},"values":{"temp":2}}',
+    '{"uuid":"1","ts":"1762782999000"}',
+    '{"uuid":"1","ts":" 1762782999 "}',
+    '{"uuid":"1","ts":"1762782999.000"}',
+    '{"uuid":"1","ts":"1762782999.5"}',
+    '{"uuid":"1","ts":1762782999.0}',
+    '{"uuid":"1","ts":1762782999.5}',
+    '{"uuid":"1","ts":true}',
+    '{"uuid":"1","ts":null}',
+    '{"uuid":"1","ts":[1]}',
+    '{"uuid":"1","ts":NaN}',
+    '{"uuid":229252442470304,"values":{"a":1}}',
+    '{"uuid":"1","meta":[]}',
+    '{"uuid":"1","values":"x"}',
+    '{"uuid":"1","measurements":{}}',
+    '[{"uuid":"1"}]',
+    '"just a string"',
+    '{}',
+    '{"uuid":"1","values":{"a":1}',
+    '',
+]
+
+
+def _old(raw: bytes):
+    try:
+        data = json.loads(raw) if raw else None
+    except ValueError:
+        return ("json_invalid", None)
+    if data is None:
+        return ("missing", None)
+    try:
+        # FastAPI validates body models with from_attributes=True (→ model_attributes_type for non-objects)
+        return ("ok", data, IngestBody.model_validate(data, from_attributes=True).model_dump())
+    except ValidationError as e:
+        return ("reject", data, sorted((err["type"], tuple(err["loc"])) for err in e.errors()))
+
+
+def _new(raw: bytes):
+    try:
+        data = codec.loads(raw) if raw else None
+    except ValueError:
+        return ("json_invalid", None)
+    if data is None:
+        return ("missing", None)
+    try:
+        return ("ok", data, codec.validate_frame(data).as_dict())
+    except codec.FrameValidationError as e:
+        return ("reject", data, sorted((err["type"], tuple(err["loc"])) for err in e.errors()))
+
+
+def _same(a, b) -> bool:
+    # NaN != NaN – compare through a canonical JSON rendering instead
+    return json.dumps(a, sort_keys=True, default=str) == json.dumps(b, sort_keys=True, default=str)
+
+
+def compare(raw: bytes) -> Optional[Tuple[tuple, tuple]]:
+    """(old, new) outcome when the two paths disagree on this body, else None."""
+    old, new = _old(raw), _new(raw)
+    if old[0] != new[0] or not _same(old[1:], new[1:]):
+        return old, new
+    return None
+
+
+def load_corpus(path: str) -> List[bytes]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["raw"].encode("utf-8") for line in f if line.strip()]
+
+
+def load_mongo(limit: int) -> List[bytes]:
+    from pymongo import MongoClient
+    import raw_store
+    db = MongoClient(MONGO_URI, serverSelectionTimeoutMS=3000)[MONGO_DB]
+    out: List[bytes] = []
+    # iter_raw expands RAW_LOG_MODE=compact documents (blob/codec) to the full shape
+    for d in raw_store.iter_raw(db, {"sampled": {"$ne": False}}, limit=limit):
+        body = d.get("body")
+        if isinstance(body, dict) and set(body.keys()) == {"_raw"}:
+            out.append(str(body["_raw"]).encode("utf-8"))
+        elif body is not None:
+            out.append(json.dumps(body, ensure_ascii=False, default=str).encode("utf-8"))
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Replay ingest bodies through the old and new ingest codec")
+    ap.add_argument("--mongo", type=int, default=2000, metavar="N", help="replay last N ingest_raw bodies (0 = skip)")
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS, help="NDJSON corpus file ({\"raw\": \"...\"} per line)")
+    ap.add_argument("--save", help="write the replayed corpus to this NDJSON file")
+    args = ap.parse_args()
+
+    corpus: List[bytes] = [b.encode("utf-8") for b in BUILTIN]
+    if args.corpus and os.path.exists(args.corpus):
+        corpus += load_corpus(args.corpus)
+    if args.mongo:
+        try:
+            corpus += load_mongo(args.mongo)
+        except Exception as e:
+            print(f"[COMPAT][WARN] ingest_raw not loaded: {e}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            for raw in corpus:
+                f.write(json.dumps({"raw": raw.decode("utf-8", "ignore")}, ensure_ascii=False) + "\n")
+
+    diffs = 0
+    for raw in corpus:
+        d = compare(raw)
+        if d is not None:
+            old, new = d
+            diffs += 1
+            print(f"[COMPAT][DIFF] body={raw[:200]!r}\n    old={old}\n    new={new}")
+
+    print(f"[COMPAT] bodies={len(corpus)} identical={len(corpus) - diffs} diffs={diffs} orjson={codec.HAS_ORJSON}")
+    return 1 if diffs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,11 @@ set -euo pipefail
 UUID="${1:-229252442470304}"
 /usr/bin/docker exec -i mongo mongosh -u root -p 'ROOT_STRONG_PASSWORD' --authenticationDatabase admin --quiet --eval '
 var dbx=db.getSiblingDB("xerxes");
-dbx.ingest_raw.find({uuid:"'$UUID'"}, {ts:1,uuid:1,ip:1,body:1})
+dbx.ingest_raw.find({uuid:"'$UUID'"}, {ts:1,uuid:1,ip:1,body:1,keys:1,codec:1,sampled:1})
   .sort({ts:-1}).limit(5)
   .forEach(function(d){
-    var keys = d.body?.values? Object.keys(d.body.values): (d.body?.measurements? Object.keys(d.body.measurements):[]);
-    printjson({ts:d.ts, ip:d.ip, uuid:d.uuid, keys:keys, hasMeta: !!(d.body?.meta)});
+    var keys = d.body?.values? Object.keys(d.body.values): (d.body?.measurements? Object.keys(d.body.measurements):(d.keys||[]));
+    printjson({ts:d.ts, ip:d.ip, uuid:d.uuid, keys:keys, hasMeta: !!(d.body?.meta), compact: !!d.codec, sampled: d.sampled !== false});
   });'
+# RAW_LOG_MODE=compact: plné telo + headers (dekomprimované) cez reader
+# python3 /opt/xerxes-bridge/raw_store.py "$UUID" --limit 2
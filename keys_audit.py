@@ -0,0 +1,115 @@
+import os, asyncio, hashlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import bridge_log
+
+log = bridge_log.get_logger("keys_audit")
+
+KEYS_AUDIT_MODE    = os.getenv("KEYS_AUDIT_MODE", "rollup").lower()   # rollup | full
+KEYS_AUDIT_FLUSH_S = float(os.getenv("KEYS_AUDIT_FLUSH_S", "30"))
+ROLLUP_COLL        = "keys_audit_rollup"
+
+
+def key_signature(raw_keys: List[str], meas_keys: List[str]) -> str:
+    s = ",".join(sorted(raw_keys)) + "|" + ",".join(sorted(meas_keys))
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class KeysAuditAggregator:
+    """
+    keys_audit without one document per frame.
+
+    detail() returns the detail document (the old keys_audit record) only
+    when the uuid shows a signature not seen before by this process, or when
+    keys are missing in measurements – that is what still goes to keys_audit.
+    record() counts the frame under (uuid, hour, key-set signature) in memory
+    and must only be called once the measurement write is confirmed (live
+    insert, or spool replay); flush() turns the counts into $inc upserts on
+    keys_audit_rollup.
+    """
+
+    def __init__(self, rollup_col, flush_s: float = KEYS_AUDIT_FLUSH_S):
+        self.rollup_col = rollup_col
+        self.flush_s = flush_s
+        self._counts: Dict[Tuple[str, datetime, str], Dict[str, Any]] = {}
+        self._known: Dict[str, set] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def detail(self, audit: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        sig = key_signature(audit["raw_keys"], audit["meas_keys"])
+        if sig in self._known.get(audit["uuid"], ()) and not audit["missing_in_meas"]:
+            return None
+        return {**audit, "sig": sig}
+
+    def record(self, audit: Dict[str, Any]) -> None:
+        uuid, ts = audit["uuid"], audit["ts"]
+        sig = key_signature(audit["raw_keys"], audit["meas_keys"])
+        hour = ts.replace(minute=0, second=0, microsecond=0)
+        c = self._counts.get((uuid, hour, sig))
+        if c is None:
+            self._counts[(uuid, hour, sig)] = {
+                "count": 1, "first_ts": ts, "last_ts": ts,
+                "raw_keys": audit["raw_keys"], "meas_keys": audit["meas_keys"],
+                "missing_in_meas": audit["missing_in_meas"],
+            }
+        else:
+            c["count"] += 1
+            c["first_ts"] = min(c["first_ts"], ts)
+            c["last_ts"] = max(c["last_ts"], ts)
+        self._known.setdefault(uuid, set()).add(sig)
+
+    def _ops(self, counts) -> List[UpdateOne]:
+        return [
+            UpdateOne(
+                {"_id": f"{uuid}:{hour:%Y%m%d%H}:{sig}"},
+                {
+                    "$setOnInsert": {"uuid": uuid, "hour": hour, "sig": sig, "raw_keys": c["raw_keys"],
+                                     "meas_keys": c["meas_keys"], "missing_in_meas": c["missing_in_meas"]},
+                    "$inc": {"count": c["count"]},
+                    "$min": {"first_ts": c["first_ts"]},
+                    "$max": {"last_ts": c["last_ts"]},
+                },
+                upsert=True,
+            )
+            for (uuid, hour, sig), c in counts.items()
+        ]
+
+    async def flush(self) -> None:
+        if not self._counts:
+            return
+        counts, self._counts = self._counts, {}
+        try:
+            await self.rollup_col.bulk_write(self._ops(counts), ordered=False)
+        except Exception as e:
+            log.warning("[AUDIT] keys_audit rollup flush failed: %s", e)
+            # keep the counts for the next round
+            for k, c in counts.items():
+                cur = self._counts.get(k)
+                if cur is None:
+                    self._counts[k] = c
+                else:
+                    cur["count"] += c["count"]
+                    cur["first_ts"] = min(cur["first_ts"], c["first_ts"])
+                    cur["last_ts"] = max(cur["last_ts"], c["last_ts"])
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_s)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -3,5 +3,10 @@ set -euo pipefail
 UUID="${1:-229252442470304}"
 /usr/bin/docker exec -i mongo mongosh -u root -p 'ROOT_STRONG_PASSWORD' --authenticationDatabase admin --quiet --eval '
 var dbx=db.getSiblingDB("xerxes");
-dbx.keys_audit.find({uuid:"'$UUID'"}, {_id:0,ts:1,raw_keys:1,meas_keys:1,missing_in_meas:1})
-  .sort({ts:-1}).limit(5).forEach(d=>printjson(d));'
+print("== keys_audit (detail: nová / nesediaca sada kľúčov) ==");
+dbx.keys_audit.find({uuid:"'$UUID'"}, {_id:0,ts:1,sig:1,raw_keys:1,meas_keys:1,missing_in_meas:1})
+  .sort({ts:-1}).limit(5).forEach(d=>printjson(d));
+print("== keys_audit_rollup (posledných 24h, počty framov per hodina a sada kľúčov) ==");
+dbx.keys_audit_rollup.find({uuid:"'$UUID'", hour:{$gte:new Date(Date.now()-24*3600*1000)}},
+  {_id:0,hour:1,sig:1,count:1,meas_keys:1,missing_in_meas:1})
+  .sort({hour:-1}).limit(24).forEach(d=>printjson(d));'
@@ -0,0 +1,346 @@
+"""
+Minimal Prometheus text-format metrics (no prometheus_client dependency).
+
+Counters, gauges and histograms are plain dict/int updates from the event
+loop thread – no locks on the hot path. Values fed from pymongo's own
+threads (connection pool events) go through MongoPoolListener, which keeps
+its own lock off the request path.
+"""
+import os, bisect, threading, time, asyncio
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+import ingest_codec as codec
+
+PROMETHEUS_METRICS = os.getenv("PROMETHEUS_METRICS", "true").lower() in ("1", "true", "yes")
+# multi-worker mode (serve.py): every worker drops its samples here, /metrics merges them
+METRICS_DIR        = os.getenv("METRICS_DIR", "/tmp/bridge-metrics")
+METRICS_SNAPSHOT_S = float(os.getenv("METRICS_SNAPSHOT_S", "5"))
+# device-reported profile labels: explicit whitelist, else the first METRICS_PROFILE_MAX seen; the rest → "other"
+METRICS_PROFILES    = [p.strip() for p in os.getenv("METRICS_PROFILES", "").split(",") if p.strip()]
+METRICS_PROFILE_MAX = int(os.getenv("METRICS_PROFILE_MAX", "32"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _fmt_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        _REGISTRY.append(self)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{n}{lbl} {_num(v)}" for n, lbl, v in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, n: float = 1) -> None:
+        k = tuple(str(v) for v in label_values)
+        self._values[k] = self._values.get(k, 0) + n
+
+    def samples(self):
+        return [(self.name, _fmt_labels(self.labels, k), v) for k, v in list(self._values.items())]
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(tuple(str(v) for v in label_values), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._fn = fn
+
+    def set(self, v: float, *label_values: str) -> None:
+        self._values[tuple(str(x) for x in label_values)] = v
+
+    def inc(self, *label_values: str, n: float = 1) -> None:
+        k = tuple(str(v) for v in label_values)
+        self._values[k] = self._values.get(k, 0) + n
+
+    def dec(self, *label_values: str, n: float = 1) -> None:
+        self.inc(*label_values, n=-n)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._fn = fn
+
+    def samples(self):
+        if self._fn is not None:
+            try:
+                return [(self.name, "", float(self._fn()))]
+            except Exception:
+                return []
+        return [(self.name, _fmt_labels(self.labels, k), v) for k, v in list(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, v: float, *label_values: str) -> None:
+        k = tuple(str(x) for x in label_values)
+        h = self._values.get(k)
+        if h is None:
+            h = self._values[k] = [[0] * (len(self.buckets) + 1), 0.0]
+        h[0][bisect.bisect_left(self.buckets, v)] += 1
+        h[1] += v
+
+    def time(self, *label_values: str) -> "_Timer":
+        return _Timer(self, label_values)
+
+    def samples(self):
+        out = []
+        for k, (counts, total) in list(self._values.items()):
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append((f"{self.name}_bucket", _fmt_labels(self.labels, k, f'le="{_num(le)}"'), acc))
+            out.append((f"{self.name}_count", _fmt_labels(self.labels, k), acc))
+            out.append((f"{self.name}_sum", _fmt_labels(self.labels, k), total))
+        return out
+
+
+class _Timer:
+    __slots__ = ("h", "labels", "t0")
+
+    def __init__(self, h: Histogram, labels: Tuple[str, ...]):
+        self.h = h
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.h.observe(time.perf_counter() - self.t0, *self.labels)
+        return False
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _REGISTRY) + "\n"
+
+
+# --- multi-worker aggregation ---
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"worker-{pid}.json")
+
+
+def write_snapshot() -> None:
+    """This worker's samples → METRICS_DIR/worker-<pid>.json (atomic replace)."""
+    snap = {m.name: {"kind": m.kind, "help": m.help, "samples": m.samples()} for m in _REGISTRY}
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    with open(path + ".tmp", "wb") as f:
+        f.write(codec.dumps(snap))
+    os.replace(path + ".tmp", path)
+
+
+def remove_snapshot() -> None:
+    try:
+        os.unlink(_snapshot_path(os.getpid()))
+    except OSError:
+        pass
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _with_label(lbl: str, extra: str) -> str:
+    return "{" + (lbl[1:-1] + "," if lbl else "") + extra + "}"
+
+
+def render_merged() -> str:
+    """
+    All workers in one exposition: counters and histograms are summed,
+    gauges keep one series per worker (label worker="<pid>"). This
+    process contributes live values, the others their last snapshot.
+    """
+    me = os.getpid()
+    snaps: Dict[int, Dict] = {me: {m.name: {"kind": m.kind, "help": m.help, "samples": m.samples()} for m in _REGISTRY}}
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    for n in names:
+        if not (n.startswith("worker-") and n.endswith(".json")):
+            continue
+        try:
+            pid = int(n[7:-5])
+        except ValueError:
+            continue
+        if pid == me:
+            continue
+        if not _alive(pid):
+            try:
+                os.unlink(os.path.join(METRICS_DIR, n))
+            except OSError:
+                pass
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, n), "rb") as f:
+                snaps[pid] = codec.loads(f.read())
+        except (OSError, ValueError):
+            continue
+
+    out: List[str] = []
+    for m in _REGISTRY:
+        merged: Dict[Tuple[str, str], float] = {}
+        for pid, snap in snaps.items():
+            entry = snap.get(m.name)
+            if not entry:
+                continue
+            for name, lbl, v in entry["samples"]:
+                if m.kind == "gauge":
+                    lbl = _with_label(lbl, f'worker="{pid}"')
+                merged[(name, lbl)] = merged.get((name, lbl), 0) + v
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        out += [f"{n}{lbl} {_num(v)}" for (n, lbl), v in merged.items()]
+    return "\n".join(out) + "\n"
+
+
+async def snapshot_loop(interval_s: float = METRICS_SNAPSHOT_S) -> None:
+    while True:
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+        await asyncio.sleep(interval_s)
+
+
+# --- bridge metrics ---
+
+INGEST_REQUESTS = Counter("bridge_ingest_requests_total", "Ingest HTTP responses by path and status code", ("path", "status"))
+INGEST_INFLIGHT = Gauge("bridge_ingest_inflight", "Ingest requests currently in flight")
+INGEST_STAGE    = Histogram("bridge_ingest_stage_seconds", "Ingest latency per stage", ("stage",))
+INGEST_FRAMES   = Counter("bridge_ingest_frames_total", "Accepted frames by device profile", ("profile",))
+MONGO_POOL_OUT  = Gauge("bridge_mongo_pool_checked_out", "Mongo connections currently checked out")
+MONGO_POOL_OPEN = Gauge("bridge_mongo_pool_open", "Mongo connections currently open")
+MONGO_UP        = Gauge("bridge_mongo_up", "1 while the background ping reaches Mongo")
+MONGO_PING_MS   = Gauge("bridge_mongo_ping_ms", "Latency of the last successful background ping")
+STARTUP_SECONDS = Gauge("bridge_startup_seconds", "Duration of each startup phase", ("phase",))
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Feeds the Mongo pool gauges; called from pymongo's threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._out = 0
+        self._open = 0
+        MONGO_POOL_OUT.set_function(lambda: self._out)
+        MONGO_POOL_OPEN.set_function(lambda: self._open)
+
+    def _add(self, attr: str, n: int) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + n)
+
+    def connection_checked_out(self, event): self._add("_out", 1)
+    def connection_checked_in(self, event):  self._add("_out", -1)
+    def connection_created(self, event):     self._add("_open", 1)
+    def connection_closed(self, event):      self._add("_open", -1)
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
+
+
+_profiles = set(METRICS_PROFILES)
+
+
+def profile_label(profile: str) -> str:
+    """Bounded value for the INGEST_FRAMES profile label (device strings must not create series at will)."""
+    if profile in _profiles:
+        return profile
+    if METRICS_PROFILES or len(_profiles) >= METRICS_PROFILE_MAX:
+        return "other"
+    _profiles.add(profile)
+    return profile
+
+
+def _route_label(scope) -> str:
+    # route template set by the router (e.g. /bridge/ingest/batch); unmatched paths (404) share one label
+    return getattr(scope.get("route"), "path", None) or "other"
+
+
+class IngestMetricsMiddleware:
+    """Pure ASGI middleware: status counter + in-flight gauge for the ingest paths."""
+
+    def __init__(self, app, prefix: str = "/bridge/ingest"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "") if scope["type"] == "http" else ""
+        if not path.startswith(self.prefix):
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        INGEST_INFLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            INGEST_INFLIGHT.dec()
+            INGEST_STAGE.observe(time.perf_counter() - t0, "total")
+            INGEST_REQUESTS.inc(_route_label(scope), status["code"])
@@ -1,26 +1,56 @@
+import os, asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 from settings import settings
 from datetime import datetime, timezone
 
+import bridge_log
+
+log = bridge_log.get_logger("mongo")
+
+# connections each worker opens before it starts serving (0 = lazy, pymongo default)
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "0"))
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "100"))
+
 _client = None
+_db = None
 _coll = None
 
-async def init_mongo() -> bool:
-    global _client, _coll
-    if not settings.MONGO_URI:
+async def init_mongo(uri: str | None = None, db_name: str | None = None,
+                     event_listeners: list | None = None, connect: bool = True) -> bool:
+    """connect=False only builds the (lazy) client – no ping, no pool warm-up."""
+    global _client, _db, _coll
+    uri = uri or settings.MONGO_URI
+    db_name = db_name or settings.MONGO_DB
+    if not uri:
         return False
     try:
-        _client = AsyncIOMotorClient(settings.MONGO_URI, serverSelectionTimeoutMS=2000)
-        db = _client[settings.MONGO_DB]
-        await db.command("ping")
+        _client = AsyncIOMotorClient(uri, serverSelectionTimeoutMS=2000,
+                                     minPoolSize=MONGO_MIN_POOL, maxPoolSize=MONGO_MAX_POOL,
+                                     event_listeners=event_listeners or [])
+        db = _client[db_name]
+        if connect:
+            await db.command("ping")
+            await warm_pool(db)
+        _db = db
         _coll = db[settings.MONGO_COLL]
-        print("[MONGO] init OK:", settings.MONGO_DB, settings.MONGO_COLL)
+        log.info("init OK", extra={"db": db_name, "coll": settings.MONGO_COLL})
         return True
     except Exception as e:
-        print("[MONGO] init FAIL:", e)
-        _client = None; _coll = None
+        log.error("init FAIL: %s", e)
+        _client = None; _db = None; _coll = None
         return False
 
+async def warm_pool(db=None) -> None:
+    """Concurrent pings check out (and so open) MONGO_MIN_POOL connections now, not on the first requests."""
+    db = db if db is not None else _db
+    if db is not None and MONGO_MIN_POOL > 1:
+        await asyncio.gather(*(db.command("ping") for _ in range(MONGO_MIN_POOL)))
+
+
+def get_db():
+    """Motor database handle set up by init_mongo() (None before init)."""
+    return _db
+
 async def _ensure_mongo() -> bool:
     global _coll
     if _coll is not None:
@@ -31,7 +61,7 @@ async def insert_measurement(doc: dict) -> bool:
     global _coll
     try:
         if not await _ensure_mongo():
-            print("[MONGO] SKIP insert (no client)")
+            log.warning("SKIP insert (no client)")
             return False
 
         ts_field = getattr(settings, "TS_TIME_FIELD", "time")
@@ -51,8 +81,8 @@ async def insert_measurement(doc: dict) -> bool:
             doc[mf] = {}
 
         r = await _coll.insert_one(doc)
-        print("[MONGO] insert OK:", r.inserted_id, "uuid=", doc.get("uuid"))
+        log.debug("insert OK", extra={"id": str(r.inserted_id), "uuid": doc.get("uuid")})
         return True
     except Exception as e:
-        print("[MONGO] insert FAIL:", e)
+        log.error("insert FAIL: %s", e, extra={"uuid": doc.get("uuid")})
         return False
@@ -0,0 +1,93 @@
+import os, time, asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import bridge_log
+
+log = bridge_log.get_logger("mongo.health")
+
+MONGO_HEALTH_INTERVAL_S = float(os.getenv("MONGO_HEALTH_INTERVAL_S", "2"))
+MONGO_HEALTH_TIMEOUT_S  = float(os.getenv("MONGO_HEALTH_TIMEOUT_S", "1.5"))
+MONGO_HEALTH_FAILS      = int(os.getenv("MONGO_HEALTH_FAILS", "2"))
+MONGO_FAST_FAIL         = os.getenv("MONGO_FAST_FAIL", "1") == "1"
+
+
+class MongoHealthMonitor:
+    """
+    Pings Mongo on a schedule in the background and keeps the result, so
+    request handlers can read the connection state without any I/O.
+
+    Mongo is reported down only after `fail_threshold` consecutive failed
+    pings, and up again on the first successful one.
+    """
+
+    def __init__(self, db, interval_s: float = MONGO_HEALTH_INTERVAL_S,
+                 timeout_s: float = MONGO_HEALTH_TIMEOUT_S,
+                 fail_threshold: int = MONGO_HEALTH_FAILS, initially_up: bool = True):
+        self.db = db
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.fail_threshold = max(1, fail_threshold)
+        self.up = initially_up
+        self.latency_ms: Optional[float] = None
+        self.last_ok_at: Optional[datetime] = None
+        self.last_check_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def down(self) -> bool:
+        return not self.up
+
+    async def check(self) -> bool:
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.db.command("ping"), timeout=self.timeout_s)
+        except Exception as e:
+            self.consecutive_failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self.up and self.consecutive_failures >= self.fail_threshold:
+                self.up = False
+                log.warning("down after %d failed pings: %s", self.consecutive_failures, self.last_error)
+        else:
+            self.latency_ms = round((time.perf_counter() - t0) * 1000, 2)
+            self.last_ok_at = datetime.now(timezone.utc)
+            self.consecutive_failures = 0
+            if not self.up:
+                log.warning("up again (ping %s ms)", self.latency_ms)
+            self.up = True
+        finally:
+            self.last_check_at = datetime.now(timezone.utc)
+        return self.up
+
+    async def _run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "up": self.up,
+            "latency_ms": self.latency_ms,
+            "last_ok_at": self.last_ok_at.isoformat() if self.last_ok_at else None,
+            "last_check_at": self.last_check_at.isoformat() if self.last_check_at else None,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+    def retry_after_s(self) -> int:
+        return max(1, int(round(self.interval_s)))
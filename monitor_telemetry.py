@@ -5,7 +5,7 @@ import time
 import datetime as dt
 from typing import Dict, Any, List, Tuple
 
-from pymongo import MongoClient
+from startup_trace import TRACE, mongo_client
 from urllib import request, error
 import json
 
@@ -60,7 +60,7 @@ def http_json(url: str, method="GET", data=None, headers=None, timeout=10) -> Tu
 
 
 def load_mongo_maps(lookback_min: int):
-    client = MongoClient(MONGO_URI)
+    client = mongo_client(MONGO_URI)
     dbx = client[MONGO_DB]
 
     since = dt.datetime.utcnow() - dt.timedelta(minutes=lookback_min)
@@ -182,6 +182,7 @@ def classify(uuid: str,
 
 
 def main():
+    TRACE.mark("import")
     lookback = LOOKBACK_MIN
     if len(sys.argv) > 1:
         try:
@@ -191,7 +192,8 @@ def main():
 
     print(f"{C_CYAN}=== TELEMETRY MONITOR (last {lookback} min) ==={C_RESET}")
 
-    raw_map, meas_map = load_mongo_maps(lookback)
+    with TRACE.phase("mongo_query"):
+        raw_map, meas_map = load_mongo_maps(lookback)
 
     # zoznam všetkých uuid, ktoré sa aspoň niekde objavili
     all_uuids = sorted(set(raw_map.keys()) | set(meas_map.keys()), key=str)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+ingest_raw storage modes + reader.
+
+RAW_LOG_MODE=full     – document as before: {uuid, ts, ip, headers, body}
+RAW_LOG_MODE=compact  – {uuid, ts, ip, keys, hv, h, codec, blob, size}
+    blob  = original request bytes, zstd-compressed (zlib if zstandard is missing)
+    h     = hash of the stable header set, interned once in ingest_raw_headers
+    hv    = per-request headers (cf-ray, content-length, ...) kept inline
+    keys  = measurement keys, so quick mongosh checks still work
+
+Sampling (RAW_SAMPLE_RATE, RAW_SAMPLE_RATES="uuid=0.1,uuid2=0") only decides
+whether the payload is stored: an unsampled frame still leaves a
+{uuid, ts, ip, sampled: false} stub, so frame counts and gap diagnostics on
+ingest_raw stay exact. Retention is the TTL index on ts (RAW_TTL_S).
+
+Reader: iter_raw() (pymongo) / read_raw() (Motor) return every document in
+the full shape regardless of how it was stored.
+CLI:    python3 raw_store.py <uuid> [--limit N]
+"""
+import os, sys, random, hashlib, zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bson import Binary
+
+import ingest_codec as codec
+import bridge_log
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW_LOG_MODE       = os.getenv("RAW_LOG_MODE", "full").lower()
+RAW_SAMPLE_RATE    = float(os.getenv("RAW_SAMPLE_RATE", "1"))
+RAW_SAMPLE_RATES   = os.getenv("RAW_SAMPLE_RATES", "")
+RAW_TTL_S          = int(os.getenv("RAW_TTL_S", "86400"))
+RAW_ZSTD_LEVEL     = int(os.getenv("RAW_ZSTD_LEVEL", "3"))
+RAW_INLINE_HEADERS = {h.strip().lower() for h in os.getenv(
+    "RAW_INLINE_HEADERS",
+    "content-length,cf-ray,cf-connecting-ip,x-forwarded-for,x-real-ip,x-request-id,cdn-loop,true-client-ip",
+).split(",") if h.strip()}
+
+RAW_COLL     = "ingest_raw"
+HEADERS_COLL = "ingest_raw_headers"
+
+log = bridge_log.get_logger("raw")
+
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in spec.split(","):
+        if "=" in part:
+            u, r = part.split("=", 1)
+            try:
+                out[u.strip()] = float(r)
+            except ValueError:
+                log.warning("[RAW] bad RAW_SAMPLE_RATES entry: %r", part)
+    return out
+
+
+_zstd_c = None
+
+
+def compress(raw: bytes) -> Tuple[str, bytes]:
+    global _zstd_c
+    if zstandard is not None:
+        if _zstd_c is None:
+            _zstd_c = zstandard.ZstdCompressor(level=RAW_ZSTD_LEVEL)
+        return "zstd", _zstd_c.compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def decompress(kind: str, blob: bytes) -> bytes:
+    if kind == "zstd":
+        if zstandard is None:
+            raise RuntimeError("ingest_raw blob is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if kind == "zlib":
+        return zlib.decompress(blob)
+    return bytes(blob)
+
+
+def headers_hash(headers: Dict[str, str]) -> str:
+    return hashlib.blake2b(codec.dumps(headers, sort_keys=True), digest_size=12).hexdigest()
+
+
+def _split_headers(headers: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    stable, inline = {}, {}
+    for k, v in headers.items():
+        (inline if k.lower() in RAW_INLINE_HEADERS else stable)[k] = v
+    return stable, inline
+
+
+class RawLogger:
+    """Turns the full ingest_raw document into what RAW_LOG_MODE / sampling store."""
+
+    def __init__(self, db, mode: str = RAW_LOG_MODE, sample_rate: float = RAW_SAMPLE_RATE,
+                 sample_rates: str = RAW_SAMPLE_RATES):
+        self.db = db
+        self.mode = mode if mode in ("full", "compact") else "full"
+        self.sample_rate = sample_rate
+        self.sample_rates = _parse_rates(sample_rates)
+        self.headers_col = db[HEADERS_COLL]
+        self._known_headers: set = set()
+
+    def sampled(self, uuid: Any) -> bool:
+        rate = self.sample_rates.get(str(uuid), self.sample_rate)
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    async def _intern(self, stable: Dict[str, str]) -> Optional[str]:
+        h = headers_hash(stable)
+        if h in self._known_headers:
+            return h
+        try:
+            await self.headers_col.update_one(
+                {"_id": h}, {"$setOnInsert": {"headers": stable, "first_seen": datetime.utcnow()}}, upsert=True)
+        except Exception as e:
+            log.warning("[RAW] header interning failed: %s", e)
+            return None
+        self._known_headers.add(h)
+        return h
+
+    async def prepare(self, raw_doc: Dict[str, Any], raw: bytes, intern: bool = True) -> Dict[str, Any]:
+        """intern=False (Mongo down) keeps the headers inline instead of waiting on ingest_raw_headers."""
+        if not self.sampled(raw_doc.get("uuid")):
+            return {"uuid": raw_doc.get("uuid"), "ts": raw_doc["ts"], "ip": raw_doc.get("ip"), "sampled": False}
+        if self.mode == "full":
+            return raw_doc
+
+        body = raw_doc.get("body")
+        vals = (body.get("values") or body.get("measurements")) if isinstance(body, dict) else None
+        stable, inline = _split_headers(raw_doc.get("headers") or {})
+        kind, blob = compress(raw)
+        doc: Dict[str, Any] = {
+            "uuid": raw_doc.get("uuid"),
+            "ts": raw_doc["ts"],
+            "ip": raw_doc.get("ip"),
+            "keys": list(vals.keys()) if isinstance(vals, dict) else [],
+            "hv": inline,
+            "codec": kind,
+            "blob": Binary(blob),
+            "size": len(raw),
+        }
+        h = await self._intern(stable) if intern else None
+        if h is None:
+            doc["headers"] = raw_doc.get("headers") or {}
+        else:
+            doc["h"] = h
+        return doc
+
+
+async def ensure_retention(db, ttl_s: int = RAW_TTL_S) -> None:
+    """TTL index on ingest_raw.ts (collMod when an index on ts already exists with another TTL)."""
+    if ttl_s <= 0:
+        return
+    coll = db[RAW_COLL]
+    try:
+        await coll.create_index("ts", expireAfterSeconds=ttl_s)
+    except Exception as e:
+        try:
+            await db.command("collMod", RAW_COLL, index={"keyPattern": {"ts": 1}, "expireAfterSeconds": ttl_s})
+        except Exception as e2:
+            log.warning("[RAW] TTL index not set (%s; %s)", e, e2)
+
+
+# --- reader ---
+
+def expand_doc(doc: Dict[str, Any], headers_by_hash: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+    """Any stored ingest_raw document → {uuid, ts, ip, headers, body[, sampled]}."""
+    if "blob" not in doc:
+        return doc
+    out = {k: v for k, v in doc.items() if k not in ("blob", "codec", "h", "hv", "keys", "size")}
+    headers = dict(headers_by_hash.get(doc.get("h"), {}) if doc.get("h") else doc.get("headers") or {})
+    headers.update(doc.get("hv") or {})
+    out["headers"] = headers
+    raw = decompress(doc.get("codec", ""), doc["blob"])
+    try:
+        out["body"] = codec.loads(raw)
+    except ValueError:
+        out["body"] = {"_raw": raw.decode("utf-8", "ignore")}
+    return out
+
+
+def iter_raw(db, query: Optional[Dict[str, Any]] = None, limit: int = 0,
+             sort: Optional[List[Tuple[str, int]]] = None) -> Iterator[Dict[str, Any]]:
+    """pymongo reader: ingest_raw documents in the full shape, decompressed."""
+    cur = db[RAW_COLL].find(query or {}).sort(sort or [("ts", -1)])
+    if limit:
+        cur = cur.limit(limit)
+    headers_by_hash: Dict[str, Dict[str, str]] = {}
+    for d in cur:
+        h = d.get("h")
+        if h and h not in headers_by_hash:
+            hd = db[HEADERS_COLL].find_one({"_id": h}) or {}
+            headers_by_hash[h] = hd.get("headers") or {}
+        yield expand_doc(d, headers_by_hash)
+
+
+async def read_raw(db, query: Optional[Dict[str, Any]] = None, limit: int = 0,
+                   sort: Optional[List[Tuple[str, int]]] = None) -> List[Dict[str, Any]]:
+    """Motor reader, same result as iter_raw()."""
+    cur = db[RAW_COLL].find(query or {}).sort(sort or [("ts", -1)])
+    if limit:
+        cur = cur.limit(limit)
+    headers_by_hash: Dict[str, Dict[str, str]] = {}
+    out: List[Dict[str, Any]] = []
+    async for d in cur:
+        h = d.get("h")
+        if h and h not in headers_by_hash:
+            hd = await db[HEADERS_COLL].find_one({"_id": h}) or {}
+            headers_by_hash[h] = hd.get("headers") or {}
+        out.append(expand_doc(d, headers_by_hash))
+    return out
+
+
+def main() -> None:
+    import argparse, json
+    from pymongo import MongoClient
+
+    ap = argparse.ArgumentParser(description="Show ingest_raw frames (compact/compressed ones decoded)")
+    ap.add_argument("uuid", nargs="?", help="device uuid (default: all devices)")
+    ap.add_argument("--limit", type=int, default=5)
+    args = ap.parse_args()
+
+    uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017/?authSource=admin")
+    db = MongoClient(uri, serverSelectionTimeoutMS=3000)[os.getenv("MONGO_DB", "xerxes")]
+    for d in iter_raw(db, {"uuid": args.uuid} if args.uuid else {}, limit=args.limit):
+        d.pop("_id", None)
+        print(json.dumps(d, ensure_ascii=False, default=str, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -251,7 +251,8 @@ echo "[5/6] Normalize filenames in proxy config"
 sed -i 's/way.conf/bridge.conf/' "$COM/EEXXPOSE" 2>/dev/null || true
 
 echo "[6/6] Deploy + wait healthy + test"
-docker compose -f "$COMPOSE" up -d --force-recreate
+# --timeout: let the old container drain in-flight frames and flush its buffers (BRIDGE_DRAIN_S)
+docker compose -f "$COMPOSE" up -d --force-recreate --timeout 30
 
 for i in {1..40}; do
   st=$(docker inspect -f '{{.State.Health.Status}}' xerxes-bridge-xerxes-bridge-1 2>/dev/null || echo "unknown")
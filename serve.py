@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Bridge server entry point: python3 serve.py
+
+BRIDGE_WORKERS=N (default: CPU count) uvicorn worker processes share the
+listening socket. Nothing is shared between them: each worker builds its own
+Motor pool (MONGO_MIN_POOL connections opened before it accepts traffic),
+write-behind buffers, spool slot (SPOOL_DIR, SPOOL_DIR/w1, ...), dedup filter
+and admission limits. /metrics on any worker returns the sum over all
+workers (snapshots in METRICS_DIR).
+
+SIGTERM: workers stop accepting, finish in-flight requests for up to
+BRIDGE_DRAIN_S, then run the shutdown hooks (write-behind flush, spool
+fsync, rollup flush) – docker's stop_grace_period must be longer than that.
+"""
+import os, sys, inspect
+
+import uvicorn
+
+HOST           = os.getenv("BRIDGE_HOST", "0.0.0.0")
+PORT           = int(os.getenv("BRIDGE_PORT", "8080"))
+BRIDGE_WORKERS = int(os.getenv("BRIDGE_WORKERS", "0")) or (os.cpu_count() or 1)
+BRIDGE_DRAIN_S = int(os.getenv("BRIDGE_DRAIN_S", "20"))
+
+
+def main() -> int:
+    # workers read it (metrics aggregation, log fields); spawned processes inherit the env
+    os.environ["BRIDGE_WORKERS"] = str(BRIDGE_WORKERS)
+    kwargs = dict(host=HOST, port=PORT, workers=BRIDGE_WORKERS)
+    if "timeout_graceful_shutdown" in inspect.signature(uvicorn.Config).parameters:
+        kwargs["timeout_graceful_shutdown"] = BRIDGE_DRAIN_S
+    print(f"[SERVE] {BRIDGE_WORKERS} worker(s) on {HOST}:{PORT}, drain {BRIDGE_DRAIN_S}s", flush=True)
+    uvicorn.run("app:app", **kwargs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
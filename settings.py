@@ -11,6 +11,10 @@ class Settings(BaseSettings):
     TB_TIMEOUT_S: int = 5
     TB_RETRY_MAX: int = 5
     TB_RETRY_BACKOFF_BASE_MS: int = 200
+    TB_POOL_PER_HOST: int = 32       # open connections to TB (aiohttp limit_per_host)
+    TB_POOL_TOTAL: int = 64
+    TB_KEEPALIVE_S: float = 30       # idle keep-alive before a pooled connection is closed
+    TB_DNS_TTL_S: int = 300
     TOKEN_MAP_PATH: str = "/data/token_map.json"
     BIND_HOST: str = "0.0.0.0"
     BIND_PORT: int = 8080
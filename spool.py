@@ -0,0 +1,435 @@
+"""
+Local write-ahead spool for frames that could not be written to Mongo.
+
+Layout (SPOOL_DIR):
+    seg-000000000001.log   append-only segments, one record per line:
+                           "<crc32 hex> <extended JSON>\\n"
+    cursor                 "<segment> <offset>" of the first record not yet replayed
+
+A record is the list of writes of one frame, e.g.
+    [{"i": "ingest_raw", "d": {...}}, {"i": "measurements", "d": {...}},
+     {"u": "devices", "q": {"uuid": ...}, "d": {"$set": ...}}]
+(i = insert_one, u = upsert). An upsert with "g": <field> is guarded by
+that $set timestamp (devices last_real_ts / last_seen_ts): replay $max-es
+the field and sets the rest only when the spooled value is still the
+newest, so a record replayed after newer live writes does not roll the
+document back. An {"a": <kind>, "d": {...}} entry is not a write: once the
+record's writes are applied the replayer hands it to its on_applied hook
+(e.g. the keys_audit rollup count of a spooled frame).
+Documents are bson extended JSON, so datetimes, ObjectIds and Binary blobs
+come back with their types.
+
+append() returns once the record is fsync'd; fsyncs are batched – every
+SPOOL_FSYNC_MS one fsync (in a worker thread) covers all records written
+meanwhile. Segments rotate at SPOOL_SEGMENT_BYTES; append() raises SpoolFull
+once SPOOL_MAX_BYTES of undrained data is on disk.
+
+On startup a torn last line (crash in the middle of a write) is truncated,
+and lines with a bad checksum are skipped. SpoolReplayer drains records in
+order with insert_many / bulk_write while Mongo is up and moves the cursor
+after each applied batch – delivery is at-least-once, a crash between apply
+and cursor write replays that batch again. Collections without a unique
+_id (the time-series measurements) are passed as time_fields: before
+inserting into them the replayer skips the _ids already there, so a replayed
+batch does not duplicate frames.
+"""
+import os, asyncio, fcntl, zlib, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson import json_util
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import bridge_log
+import metrics
+
+SPOOL_ENABLED       = os.getenv("SPOOL_ENABLED", "1") == "1"
+SPOOL_DIR           = os.getenv("SPOOL_DIR", "/data/spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+SPOOL_MAX_BYTES     = int(os.getenv("SPOOL_MAX_BYTES", str(512 * 1024 * 1024)))
+SPOOL_FSYNC_MS      = float(os.getenv("SPOOL_FSYNC_MS", "20"))
+SPOOL_DRAIN_BATCH   = int(os.getenv("SPOOL_DRAIN_BATCH", "500"))
+SPOOL_DRAIN_IDLE_S  = float(os.getenv("SPOOL_DRAIN_IDLE_S", "1"))
+
+_JSON_OPTS = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED, tz_aware=True)
+_CURSOR = "cursor"
+
+log = bridge_log.get_logger("spool")
+
+SPOOL_BYTES    = metrics.Gauge("bridge_spool_bytes", "Undrained bytes in the local spool")
+SPOOL_DEPTH    = metrics.Gauge("bridge_spool_frames", "Undrained frames in the local spool")
+SPOOL_APPENDED = metrics.Counter("bridge_spool_appended_total", "Frames written to the local spool")
+SPOOL_DRAINED  = metrics.Counter("bridge_spool_drained_total", "Spooled frames replayed into Mongo")
+SPOOL_DROPPED  = metrics.Counter("bridge_spool_dropped_total", "Spooled writes Mongo rejected permanently", ("reason",))
+
+
+class SpoolFull(Exception):
+    pass
+
+
+_slot_lock: Optional[int] = None
+
+
+def claim_dir(base: str = SPOOL_DIR, slots: int = 64) -> str:
+    """
+    Spool directory owned by this process. Workers (serve.py) take the first
+    slot whose lock is free – slot 0 is `base` itself, slot n is base/w<n> –
+    so each spool has one writer and a restarted worker picks up (and
+    drains) whatever a previous one left behind.
+    """
+    global _slot_lock
+    for n in range(slots):
+        path = base if n == 0 else os.path.join(base, f"w{n}")
+        os.makedirs(path, exist_ok=True)
+        fd = os.open(os.path.join(path, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        _slot_lock = fd                          # held for the life of the process
+        return path
+    raise RuntimeError(f"no free spool slot under {base}")
+
+
+def _seg_name(seq: int) -> str:
+    return f"seg-{seq:012d}.log"
+
+
+def _encode(ops: List[Dict[str, Any]]) -> bytes:
+    body = json_util.dumps(ops, json_options=_JSON_OPTS).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(body), body)
+
+
+def _decode(line: bytes) -> Optional[List[Dict[str, Any]]]:
+    crc, _, body = line.rstrip(b"\n").partition(b" ")
+    try:
+        if int(crc, 16) != zlib.crc32(body):
+            return None
+        return json_util.loads(body, json_options=_JSON_OPTS)
+    except ValueError:
+        return None
+
+
+class Spool:
+    def __init__(self, path: str = SPOOL_DIR, segment_bytes: int = SPOOL_SEGMENT_BYTES,
+                 max_bytes: int = SPOOL_MAX_BYTES, fsync_ms: float = SPOOL_FSYNC_MS):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_s = max(0.0, fsync_ms) / 1000.0
+        self._fd: Optional[int] = None
+        self._seq = 0
+        self._size = 0
+        self._retired: List[int] = []          # rotated fds, closed after their fsync
+        self._waiters: List[asyncio.Future] = []
+        self._sync_handle: Optional[asyncio.TimerHandle] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self.cursor: Tuple[int, int] = (0, 0)
+        self.depth = 0
+        self.bytes = 0
+        SPOOL_DEPTH.set_function(lambda: self.depth)
+        SPOOL_BYTES.set_function(lambda: self.bytes)
+
+    # --- recovery ---
+
+    def segments(self) -> List[int]:
+        return sorted(int(n[4:16]) for n in os.listdir(self.path) if n.startswith("seg-") and n.endswith(".log"))
+
+    def _seg_path(self, seq: int) -> str:
+        return os.path.join(self.path, _seg_name(seq))
+
+    def open(self) -> None:
+        """Recover after a crash (torn tail, cursor) and open the newest segment for appending."""
+        os.makedirs(self.path, exist_ok=True)
+        segs = self.segments()
+        if segs:
+            last = self._seg_path(segs[-1])
+            with open(last, "rb+") as f:
+                data = f.read()
+                keep = data.rfind(b"\n") + 1
+                if keep != len(data):
+                    log.warning("truncating torn record in %s (%d bytes)", last, len(data) - keep)
+                    f.truncate(keep)
+                    os.fsync(f.fileno())
+
+        self.cursor = self._read_cursor(segs)
+        for seq in segs:
+            if seq < self.cursor[0]:
+                os.unlink(self._seg_path(seq))
+        segs = [s for s in segs if s >= self.cursor[0]]
+
+        self.depth, self.bytes = 0, 0
+        for seq in segs:
+            start = self.cursor[1] if seq == self.cursor[0] else 0
+            with open(self._seg_path(seq), "rb") as f:
+                f.seek(start)
+                for line in f:
+                    self.depth += 1
+                    self.bytes += len(line)
+
+        self._seq = segs[-1] if segs else max(self.cursor[0], 1)
+        self._open_segment(self._seq)
+        if self.depth:
+            log.warning("recovered %d spooled frames (%d bytes) from %s", self.depth, self.bytes, self.path)
+
+    def _read_cursor(self, segs: List[int]) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, _CURSOR)) as f:
+                seq, off = f.read().split()
+                return int(seq), int(off)
+        except (OSError, ValueError):
+            return (segs[0] if segs else 1, 0)
+
+    def save_cursor(self, cursor: Tuple[int, int]) -> None:
+        tmp = os.path.join(self.path, _CURSOR + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(f"{cursor[0]} {cursor[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, _CURSOR))
+        self.cursor = cursor
+
+    def _open_segment(self, seq: int) -> None:
+        self._fd = os.open(self._seg_path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._seq = seq
+
+    # --- writer ---
+
+    async def append(self, ops: List[Dict[str, Any]]) -> None:
+        line = _encode(ops)
+        if self.bytes + len(line) > self.max_bytes:
+            raise SpoolFull(f"spool full ({self.bytes} bytes)")
+        if self._size and self._size + len(line) > self.segment_bytes:
+            self._retired.append(self._fd)
+            self._open_segment(self._seq + 1)
+        os.write(self._fd, line)
+        self._size += len(line)
+        self.depth += 1
+        self.bytes += len(line)
+        SPOOL_APPENDED.inc()
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        if self._sync_handle is None and self._sync_task is None:
+            self._sync_handle = asyncio.get_running_loop().call_later(self.fsync_s, self._start_sync)
+        await fut
+
+    def _start_sync(self) -> None:
+        self._sync_handle = None
+        self._sync_task = asyncio.get_running_loop().create_task(self._sync())
+
+    async def _sync(self) -> None:
+        waiters, self._waiters = self._waiters, []
+        retired, self._retired = self._retired, []
+        fd = self._fd
+        err: Optional[BaseException] = None
+        try:
+            await asyncio.to_thread(self._fsync_all, retired, fd)
+        except OSError as e:
+            err = e
+            log.error("spool fsync failed: %s", e)
+        for w in waiters:
+            if not w.done():
+                w.set_exception(err) if err else w.set_result(None)
+        self._sync_task = None
+        if self._waiters:
+            self._sync_handle = asyncio.get_running_loop().call_later(self.fsync_s, self._start_sync)
+
+    @staticmethod
+    def _fsync_all(retired: List[int], fd: int) -> None:
+        for r in retired:
+            os.fsync(r)
+            os.close(r)
+        os.fsync(fd)
+
+    # --- reader ---
+
+    def read_batch(self, max_records: int) -> Tuple[List[List[Dict[str, Any]]], Tuple[int, int], int, int]:
+        """Up to max_records complete records after the cursor → (records, new cursor, lines, bytes consumed)."""
+        seq, off = self.cursor
+        records: List[List[Dict[str, Any]]] = []
+        lines = consumed = 0
+        while len(records) < max_records:
+            try:
+                f = open(self._seg_path(seq), "rb")
+            except FileNotFoundError:
+                if seq < self._seq:
+                    seq, off = seq + 1, 0
+                    continue
+                break
+            with f:
+                f.seek(off)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break                           # still being written
+                    off += len(line)
+                    lines += 1
+                    consumed += len(line)
+                    rec = _decode(line)
+                    if rec is None:
+                        log.warning("skipping corrupt spool record in %s", _seg_name(seq))
+                        SPOOL_DROPPED.inc("corrupt")
+                    else:
+                        records.append(rec)
+                    if len(records) >= max_records:
+                        break
+            if len(records) >= max_records or seq >= self._seq:
+                break
+            seq, off = seq + 1, 0
+        return records, (seq, off), lines, consumed
+
+    def commit(self, cursor: Tuple[int, int], lines: int, consumed: int) -> None:
+        """Persist the cursor after a replayed batch and delete fully drained segments."""
+        self.save_cursor(cursor)
+        self.depth = max(0, self.depth - lines)
+        self.bytes = max(0, self.bytes - consumed)
+        for seq in self.segments():
+            if seq < cursor[0]:
+                os.unlink(self._seg_path(seq))
+
+    async def close(self) -> None:
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._start_sync()
+        if self._sync_task is not None:
+            await self._sync_task
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+class SpoolReplayer:
+    """Background drain: spooled records → Mongo, in order, while the health monitor reports Mongo up."""
+
+    def __init__(self, spool: Spool, db, health=None, batch: int = SPOOL_DRAIN_BATCH,
+                 idle_s: float = SPOOL_DRAIN_IDLE_S,
+                 on_applied: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 time_fields: Optional[Dict[str, str]] = None):
+        self.spool = spool
+        self.db = db
+        self.health = health
+        self.batch = max(1, batch)
+        self.idle_s = idle_s
+        self.on_applied = on_applied
+        self.time_fields = time_fields or {}     # {collection without unique _id: its time field}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _requests(op: Dict[str, Any]) -> List[Any]:
+        if "i" in op:
+            return [InsertOne(op["d"])]
+        field, upd = op.get("g"), op["d"]
+        ts = (upd.get("$set") or {}).get(field) if field else None
+        if ts is None:
+            return [UpdateOne(op["q"], upd, upsert=True)]
+        # guarded: create/alias + $max of the timestamp, the rest only while this value is the newest
+        rest = {k: v for k, v in upd["$set"].items() if k != field}
+        first = {k: v for k, v in upd.items() if k != "$set"}
+        first["$max"] = {field: ts}
+        reqs = [UpdateOne(op["q"], first, upsert=True)]
+        if rest:
+            reqs.append(UpdateOne({**op["q"], field: ts}, {"$set": rest}))
+        return reqs
+
+    async def _unapplied(self, coll: str, reqs: List[Any]) -> List[Any]:
+        """Inserts into a collection without a unique _id, minus those a previous replay already made."""
+        field = self.time_fields[coll]
+        docs = [r._doc for r in reqs]
+        ids = [d["_id"] for d in docs if "_id" in d]
+        times = [d[field] for d in docs if field in d]
+        if not ids or not times:
+            return reqs
+        found = await self.db[coll].find(
+            {"_id": {"$in": ids}, field: {"$gte": min(times), "$lte": max(times)}}, {"_id": 1}).to_list(None)
+        if not found:
+            return reqs
+        there = {d["_id"] for d in found}
+        SPOOL_DROPPED.inc("duplicate", n=len(there))
+        return [r for r, d in zip(reqs, docs) if d.get("_id") not in there]
+
+    async def _apply(self, records: List[List[Dict[str, Any]]]) -> None:
+        # consecutive writes to the same collection go out as one bulk_write
+        runs: List[Tuple[str, List[Any]]] = []
+        applied: List[Dict[str, Any]] = []
+        for rec in records:
+            for op in rec:
+                if "a" in op:
+                    applied.append(op)
+                    continue
+                coll = op.get("i") or op.get("u")
+                reqs = self._requests(op)
+                if runs and runs[-1][0] == coll:
+                    runs[-1][1].extend(reqs)
+                else:
+                    runs.append((coll, reqs))
+        for coll, reqs in runs:
+            if coll in self.time_fields:
+                reqs = await self._unapplied(coll, reqs)
+            # upserts of one uuid (devices) must land in spool order – the last state wins;
+            # inserts carry their own _id and can go unordered
+            ordered = any(isinstance(r, UpdateOne) for r in reqs)
+            while reqs:
+                try:
+                    await self.db[coll].bulk_write(reqs, ordered=ordered)
+                    break
+                except BulkWriteError as e:
+                    # duplicate _id = already applied before a crash; anything else would fail forever
+                    errors = e.details.get("writeErrors", [])
+                    for we in errors:
+                        if we.get("code") != 11000:
+                            log.warning("spooled write to %s rejected: %s", coll, we.get("errmsg"))
+                            SPOOL_DROPPED.inc("rejected")
+                    if not ordered or not errors:
+                        break
+                    # an ordered bulk stops at the failed op – go on with the rest
+                    reqs = reqs[max(we["index"] for we in errors) + 1:]
+        if self.on_applied is not None:
+            for op in applied:
+                self.on_applied(op["a"], op["d"])
+
+    async def drain_once(self) -> int:
+        records, cursor, lines, consumed = self.spool.read_batch(self.batch)
+        if cursor == self.spool.cursor:
+            return 0
+        if records:
+            await self._apply(records)
+        self.spool.commit(cursor, lines, consumed)
+        SPOOL_DRAINED.inc(n=len(records))
+        return len(records)
+
+    async def _run(self) -> None:
+        backoff = self.idle_s
+        while True:
+            if self.spool.depth == 0 or (self.health is not None and self.health.down):
+                await asyncio.sleep(self.idle_s)
+                continue
+            t0 = time.perf_counter()
+            try:
+                n = await self.drain_once()
+            except PyMongoError as e:
+                log.warning("spool replay failed, retrying in %.1fs: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = self.idle_s
+            if n:
+                log.info("spool replayed", extra={"frames": n, "left": self.spool.depth,
+                                                  "ms": round((time.perf_counter() - t0) * 1000, 1)})
+            else:
+                await asyncio.sleep(self.idle_s)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,83 @@
+"""
+Cold-start tracing for the bridge and the cron/CLI tools.
+
+    from startup_trace import TRACE, mongo_client
+    with TRACE.phase("mongo_query"):
+        ...
+
+Phases are wall-clock durations since the previous mark; the first one is
+measured from the import of this module (import it first). STARTUP_TRACE=1
+prints the table to stderr when the process exits; the service also logs it
+and exports bridge_startup_seconds{phase}. For import-level detail use
+`python3 -X importtime app.py`.
+
+mongo_client() builds a pymongo client on first use only (pymongo itself is
+imported then), with a short server-selection timeout so a cron run fails
+fast instead of hanging 30 s on an unreachable Mongo.
+"""
+import os, sys, time, atexit
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+
+_T0 = time.perf_counter()
+
+STARTUP_TRACE       = os.getenv("STARTUP_TRACE", "0") == "1"
+CLI_MONGO_TIMEOUT_MS = int(os.getenv("CLI_MONGO_TIMEOUT_MS", "5000"))
+
+
+class StartupTrace:
+    def __init__(self):
+        self.phases: List[Tuple[str, float]] = []
+        self._last = _T0
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.phases.append((name, now - t0))
+            self._last = now
+
+    def mark(self, name: str) -> None:
+        """Time since the previous phase/mark ended, e.g. mark("import") right after the imports."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total_s(self) -> float:
+        return time.perf_counter() - _T0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"total_ms": round(self.total_s * 1000, 1),
+                "phases": {n: round(s * 1000, 1) for n, s in self.phases}}
+
+    def report(self, out=sys.stderr) -> None:
+        for n, s in self.phases:
+            print(f"[TRACE] {n:<20} {s * 1000:8.1f} ms", file=out)
+        print(f"[TRACE] {'total':<20} {self.total_s * 1000:8.1f} ms", file=out)
+
+
+TRACE = StartupTrace()
+
+if STARTUP_TRACE:
+    atexit.register(TRACE.report)
+
+_clients: Dict[str, Any] = {}
+
+
+def mongo_client(uri: str, **kwargs) -> Any:
+    """Cached pymongo MongoClient for CLI tools, created (and pymongo imported) on first call."""
+    c = _clients.get(uri)
+    if c is None:
+        with TRACE.phase("mongo_client"):
+            from pymongo import MongoClient
+            kwargs.setdefault("serverSelectionTimeoutMS", CLI_MONGO_TIMEOUT_MS)
+            kwargs.setdefault("maxPoolSize", 4)
+            kwargs.setdefault("appname", os.path.basename(sys.argv[0]) or "xerxes-cli")
+            c = _clients[uri] = MongoClient(uri, **kwargs)
+            # close explicitly – interpreter exit otherwise waits on the monitor threads
+            atexit.register(c.close)
+    return c
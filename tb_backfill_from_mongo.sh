@@ -11,10 +11,14 @@ set -a
 source /opt/xerxes-bridge/tb_jwt.env
 set +a
 
-# napr. posledných 7 dní
+# napr. posledných 7 dní – len uuid bez watermarku v tb_sync_state; už poslané sa neopakuje
+# zámerný re-send: tb_backfill_from_mongo.sh --reset [--uuid <uuid> ...]
 LOOKBACK_MIN=$((7*24*60))
 export LOOKBACK_MIN
+# paralelne zariadenia + strop TB requestov/s (prispôsob limitom TB tenantu)
+export TB_SYNC_WORKERS="${TB_SYNC_WORKERS:-8}"
+export TB_SYNC_RATE="${TB_SYNC_RATE:-20}"
 
 echo "$(date -Is) TB_BACKFILL start (LOOKBACK_MIN=$LOOKBACK_MIN)"
-python3 /opt/xerxes-bridge/tb_sync_from_mongo.py
+python3 /opt/xerxes-bridge/tb_sync_from_mongo.py --since "$LOOKBACK_MIN" "$@"
 echo "$(date -Is) TB_BACKFILL done"
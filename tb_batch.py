@@ -0,0 +1,129 @@
+import os, time, asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import bridge_log
+import metrics
+
+TB_BATCH_WINDOW_MS = float(os.getenv("TB_BATCH_WINDOW_MS", "250"))
+TB_BATCH_MAX       = int(os.getenv("TB_BATCH_MAX", "100"))      # points per POST
+
+log = bridge_log.get_logger("tb_batch")
+
+TB_BATCH_POINTS = metrics.Histogram("bridge_tb_batch_points", "Telemetry points per TB POST",
+                                    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+TB_BATCHES      = metrics.Counter("bridge_tb_batches_total", "TB telemetry batch POSTs by result", ("result",))
+TB_BATCH_QUEUED = metrics.Gauge("bridge_tb_batch_queued", "Telemetry points waiting for their device's next TB batch")
+
+Point = Dict[str, Any]
+PostFn = Callable[[str, List[Point]], Awaitable[Any]]
+FailFn = Callable[[str, List[Point], BaseException], Awaitable[None]]
+
+
+class TBBatcher:
+    """
+    Per-device (per TB token) batching of telemetry points.
+
+    Points of a token are collected for window_ms or until max_points are
+    waiting, then sent as one JSON-array POST. Each token has at most one
+    POST in flight and batches go out in submit order, so a device's points
+    reach TB in order. tb_client retries a failed POST with backoff; when it
+    gives up, only that batch fails – its futures get the exception and
+    on_failure (e.g. the outbox) receives the points – and the token's
+    following batches go on.
+    """
+
+    def __init__(self, window_ms: float = TB_BATCH_WINDOW_MS, max_points: int = TB_BATCH_MAX,
+                 post: Optional[PostFn] = None, on_failure: Optional[FailFn] = None):
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_points = max(1, max_points)
+        if post is None:
+            import tb_client            # settings-based client; callers with their own session pass `post`
+            post = tb_client.post_telemetry_batch
+        self.post = post
+        self.on_failure = on_failure
+        self._queues: Dict[str, Deque[Tuple[Point, asyncio.Future]]] = {}
+        self._full: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        TB_BATCH_QUEUED.set_function(lambda: self.queued)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def submit(self, token: str, point: Point) -> asyncio.Future:
+        """
+        Queue one {ts, values} point (a bare values dict gets ts=now). The
+        returned future resolves when its batch is accepted by TB; it need
+        not be awaited.
+        """
+        if "values" not in point:
+            point = {"ts": int(time.time() * 1000), "values": point}
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_retrieve)
+        q = self._queues.setdefault(token, deque())
+        q.append((point, fut))
+        if token not in self._tasks:
+            self._full[token] = asyncio.Event()
+            self._tasks[token] = asyncio.ensure_future(self._drain(token))
+        elif len(q) >= self.max_points:
+            self._full[token].set()
+        return fut
+
+    async def _drain(self, token: str) -> None:
+        q = self._queues[token]
+        full = self._full[token]
+        try:
+            while q:
+                if len(q) < self.max_points and self.window_s:
+                    full.clear()
+                    try:
+                        await asyncio.wait_for(full.wait(), self.window_s)
+                    except asyncio.TimeoutError:
+                        pass
+                batch = [q.popleft() for _ in range(min(self.max_points, len(q)))]
+                await self._send(token, batch)
+        finally:
+            self._tasks.pop(token, None)
+            self._full.pop(token, None)
+            if not q:
+                self._queues.pop(token, None)
+
+    async def _send(self, token: str, batch: List[Tuple[Point, asyncio.Future]]) -> None:
+        points = [p for p, _ in batch]
+        TB_BATCH_POINTS.observe(len(points))
+        try:
+            await self.post(token, points)
+        except Exception as e:
+            TB_BATCHES.inc("failed")
+            log.warning("TB batch failed", extra={"points": len(points), "error": str(e)})
+            if self.on_failure is not None:
+                try:
+                    await self.on_failure(token, points, e)
+                except Exception as e2:
+                    log.error("TB batch on_failure hook failed: %s", e2)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        TB_BATCHES.inc("ok")
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_result(len(points))
+
+    async def flush(self) -> None:
+        """Send everything queued now, without waiting out the windows."""
+        for ev in list(self._full.values()):
+            ev.set()
+        self.window_s, window = 0.0, self.window_s
+        try:
+            while self._tasks:
+                await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+        finally:
+            self.window_s = window
+
+
+def _retrieve(fut: asyncio.Future) -> None:
+    # failures are logged (and handed to on_failure); fire-and-forget callers need not await
+    if not fut.cancelled():
+        fut.exception()
@@ -1,22 +1,112 @@
-import aiohttp, asyncio
+import aiohttp, asyncio, time
+from typing import Optional
 from settings import settings
+import metrics
 
 TB_TELEM_PATH = "/api/v1/{token}/telemetry"
 TB_ATTR_PATH  = "/api/v1/{token}/attributes"
 
-async def _post_tb(url: str, payload: dict):
+TB_CONNECTIONS = metrics.Counter("bridge_tb_connections_total", "Connections used for TB requests: new (handshake) or reused from the pool", ("kind",))
+TB_CONNECT     = metrics.Histogram("bridge_tb_connect_seconds", "Time to open a new TB connection (DNS + TCP + TLS)")
+TB_DNS         = metrics.Counter("bridge_tb_dns_total", "TB host name resolutions by cache result", ("result",))
+TB_REQUESTS    = metrics.Counter("bridge_tb_requests_total", "TB HTTP responses by status class", ("status",))
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    tc = aiohttp.TraceConfig()
+
+    async def create_start(session, ctx, params):
+        ctx.connect_t0 = time.perf_counter()
+
+    async def create_end(session, ctx, params):
+        TB_CONNECTIONS.inc("new")
+        TB_CONNECT.observe(time.perf_counter() - ctx.connect_t0)
+
+    async def reuse(session, ctx, params):
+        TB_CONNECTIONS.inc("reused")
+
+    async def dns_hit(session, ctx, params):
+        TB_DNS.inc("hit")
+
+    async def dns_miss(session, ctx, params):
+        TB_DNS.inc("miss")
+
+    tc.on_connection_create_start.append(create_start)
+    tc.on_connection_create_end.append(create_end)
+    tc.on_connection_reuseconn.append(reuse)
+    tc.on_dns_cache_hit.append(dns_hit)
+    tc.on_dns_cache_miss.append(dns_miss)
+    return tc
+
+
+class TBSession:
+    """
+    One long-lived aiohttp session for all TB pushes: a bounded keep-alive
+    pool (TB_POOL_PER_HOST connections to the TB host) and a DNS cache, so a
+    push normally goes out on an already open TLS connection.
+
+    aiohttp (like TB's HTTP endpoint) does not pipeline; concurrency comes
+    from the pooled connections instead.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    conn = aiohttp.TCPConnector(
+                        limit=settings.TB_POOL_TOTAL,
+                        limit_per_host=settings.TB_POOL_PER_HOST,
+                        ttl_dns_cache=settings.TB_DNS_TTL_S,
+                        keepalive_timeout=settings.TB_KEEPALIVE_S,
+                    )
+                    self._session = aiohttp.ClientSession(
+                        connector=conn,
+                        timeout=aiohttp.ClientTimeout(total=settings.TB_TIMEOUT_S),
+                        trace_configs=[_trace_config()],
+                    )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+tb_session = TBSession()
+
+
+async def startup() -> None:
+    """Open the pool up front (first push would do it lazily)."""
+    await tb_session.get()
+
+
+async def shutdown() -> None:
+    await tb_session.close()
+
+
+def bind_app(app) -> None:
+    """Tie the TB session to a FastAPI/Starlette app's lifecycle."""
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+
+
+async def _post_tb(url: str, payload):
     delay = settings.TB_RETRY_BACKOFF_BASE_MS / 1000.0
     for attempt in range(settings.TB_RETRY_MAX):
         try:
-            timeout = aiohttp.ClientTimeout(total=settings.TB_TIMEOUT_S)
-            async with aiohttp.ClientSession(timeout=timeout) as s:
-                async with s.post(url, json=payload) as r:
-                    text = await r.text()
-                    if 200 <= r.status < 300:
-                        return text
-                    if 500 <= r.status < 600:
-                        raise RuntimeError(f"TB 5xx {r.status}")
-                    raise RuntimeError(f"TB 4xx {r.status}: {text}")
+            s = await tb_session.get()
+            async with s.post(url, json=payload) as r:
+                text = await r.text()
+                TB_REQUESTS.inc(f"{r.status // 100}xx")
+                if 200 <= r.status < 300:
+                    return text
+                if 500 <= r.status < 600:
+                    raise RuntimeError(f"TB 5xx {r.status}")
+                raise RuntimeError(f"TB 4xx {r.status}: {text}")
         except Exception:
             if attempt == settings.TB_RETRY_MAX - 1:
                 raise
@@ -25,7 +115,14 @@ async def _post_tb(url: str, payload: dict):
 
 async def post_telemetry(token: str, telemetry: dict):
     url = f"{settings.TB_HOST}{TB_TELEM_PATH.format(token=token)}"
-    return await _post_tb(url, telemetry)
+    with metrics.INGEST_STAGE.time("tb_push"):
+        return await _post_tb(url, telemetry)
+
+async def post_telemetry_batch(token: str, points: list):
+    """Several {ts, values} points of one device in one POST (TB takes a JSON array)."""
+    url = f"{settings.TB_HOST}{TB_TELEM_PATH.format(token=token)}"
+    with metrics.INGEST_STAGE.time("tb_push_batch"):
+        return await _post_tb(url, points)
 
 async def post_attributes(token: str, attrs: dict):
     url = f"{settings.TB_HOST}{TB_ATTR_PATH.format(token=token)}"
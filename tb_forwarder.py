@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Real-time Mongo → ThingsBoard forwarder (long-running; replaces the
+tb_sync_from_mongo cron for live data – the two keep separate state, so the
+xb_scrape timer is disabled and tb_sync_from_mongo.py only runs by hand with
+--since/--reset/--uuid for backfills; an unattended run skips itself while
+tb_forwarder_state is fresh).
+
+New measurements are picked up in one of two ways:
+
+- stream: a change stream on the collection (replica set, regular
+  collection), resumed from the persisted resume token;
+- poll:   standalone mongod, or a time-series collection (change streams are
+  not available there) – every FWD_POLL_S the documents with
+  meta.ingest.received_at after the persisted watermark are read. The query
+  starts FWD_OVERLAP_S before the watermark so frames that landed late
+  (write-behind, multiple workers) are not missed; the _ids seen in that
+  overlap are saved with the watermark, so nothing is sent twice – not even
+  across a restart.
+
+FWD_MODE=auto tries the stream and falls back to polling. Real device frames
+(origin=device, not synthetic) with a token in TOKEN_MAP_PATH are posted
+per device in batches (tb_batch.TBBatcher over the pooled tb_client
+session); a batch TB refuses goes to the tb_outbox, and while a device has
+points waiting there its new ones queue behind them (as in xerxes_to_tb).
+The resume token / watermark in tb_forwarder_state moves only after every
+frame before it was delivered or outboxed – when the outbox cannot take a
+failed batch, the page is read again.
+"""
+import os, sys, time, json, signal, asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import bridge_log
+import metrics
+import mongo_client as mongo
+from settings import settings
+from tb_batch import TBBatcher
+from tb_outbox import Outbox, OutboxDispatcher
+import tb_client
+
+MONGO_URI          = os.getenv("MONGO_URI", settings.MONGO_URI or "")
+MONGO_DB           = os.getenv("MONGO_DB", "xerxes")
+MONGO_COL          = os.getenv("MONGO_COL", "measurements")
+TS_TIME_FIELD      = os.getenv("TS_TIME_FIELD", "ts")
+TS_META_FIELD      = os.getenv("TS_META_FIELD", "meta")
+FWD_MODE           = os.getenv("FWD_MODE", "auto")            # auto | stream | poll
+FWD_STATE_COLL     = os.getenv("FWD_STATE_COLL", "tb_forwarder_state")
+FWD_BATCH          = int(os.getenv("FWD_BATCH", "500"))        # frames read before a checkpoint
+FWD_FLUSH_MS       = float(os.getenv("FWD_FLUSH_MS", "500"))
+FWD_POLL_S         = float(os.getenv("FWD_POLL_S", "2"))
+FWD_OVERLAP_S      = float(os.getenv("FWD_OVERLAP_S", "30"))
+FWD_START_MIN      = float(os.getenv("FWD_START_MIN", "0"))    # fresh state: start this many minutes back
+FWD_TOKEN_RELOAD_S = float(os.getenv("FWD_TOKEN_RELOAD_S", "60"))
+FWD_METRICS_PORT   = int(os.getenv("FWD_METRICS_PORT", "0"))   # 0 = no /metrics listener
+
+log = bridge_log.get_logger("tb_forwarder")
+
+FWD_FRAMES = metrics.Counter("bridge_tb_forwarder_frames_total", "Frames seen by the TB forwarder by outcome", ("result",))
+FWD_LAG    = metrics.Gauge("bridge_tb_forwarder_lag_seconds", "Receive time of the last forwarded frame behind now")
+FWD_MODE_G = metrics.Gauge("bridge_tb_forwarder_mode", "1 for the active source (stream|poll)", ("mode",))
+
+# change streams unsupported: not a replica set (40573), time-series collection = view (166)
+_NO_STREAM_CODES = {40573, 166}
+
+
+class _NoChangeStream(Exception):
+    pass
+
+
+class _NotForwarded(Exception):
+    """Points of a page reached neither TB nor the outbox – its state must not be saved."""
+
+
+class TokenMap:
+    """uuid → TB device token from TOKEN_MAP_PATH ({project: {uuid: token}} or flat), reloaded on change."""
+
+    def __init__(self, path: str = settings.TOKEN_MAP_PATH):
+        self.path = path
+        self._map: Dict[str, str] = {}
+        self._mtime = 0.0
+        self._checked = 0.0
+
+    def _load(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("token map not loaded: %s", e)
+            return
+        flat: Dict[str, str] = {}
+        for k, v in (data or {}).items():
+            if isinstance(v, dict):
+                flat.update({str(u): t for u, t in v.items()})
+            elif isinstance(v, str):
+                flat[str(k)] = v
+        self._map, self._mtime = flat, mtime
+        log.info("token map loaded", extra={"devices": len(flat)})
+
+    def get(self, uuid: str) -> Optional[str]:
+        now = time.monotonic()
+        if now - self._checked >= FWD_TOKEN_RELOAD_S or not self._map:
+            self._checked = now
+            self._load()
+        return self._map.get(uuid)
+
+
+def _received_at(doc: Dict[str, Any]) -> Optional[datetime]:
+    ra = ((doc.get(TS_META_FIELD) or {}).get("ingest") or {}).get("received_at")
+    return ra if isinstance(ra, datetime) else None
+
+
+class Forwarder:
+    def __init__(self, db, tokens: TokenMap, outbox: Outbox, post=None):
+        self.coll = db[MONGO_COL]
+        self.state_coll = db[FWD_STATE_COLL]
+        self.batcher = TBBatcher(post=post, on_failure=self._tb_batch_failed)
+        self.tokens = tokens
+        self.outbox = outbox
+        self._lost = 0
+        self.state: Dict[str, Any] = {}
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    # --- state ---
+
+    async def load_state(self) -> None:
+        self.state = await self.state_coll.find_one({"_id": MONGO_COL}) or {"_id": MONGO_COL}
+
+    async def save_state(self, **fields) -> None:
+        self.state.update(fields)
+        await self.state_coll.update_one({"_id": MONGO_COL},
+                                         {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}}, upsert=True)
+
+    # --- frames → TB ---
+
+    def _point(self, doc: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        ingest = (doc.get(TS_META_FIELD) or {}).get("ingest") or {}
+        if ingest.get("synthetic") or ingest.get("origin", "device") != "device":
+            FWD_FRAMES.inc("skipped")
+            return None
+        token = self.tokens.get(str(doc.get("uuid")))
+        if not token:
+            FWD_FRAMES.inc("no_token")
+            return None
+        ts = doc.get(TS_TIME_FIELD)
+        values = {k: v for k, v in (doc.get("measurements") or {}).items()
+                  if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        if not isinstance(ts, datetime) or not values:
+            FWD_FRAMES.inc("empty")
+            return None
+        ts_ms = int(ts.replace(tzinfo=timezone.utc).timestamp() * 1000) if ts.tzinfo is None else int(ts.timestamp() * 1000)
+        return token, {"ts": ts_ms, "values": values}
+
+    async def _tb_batch_failed(self, token: str, points: List[Dict[str, Any]], e: BaseException) -> None:
+        try:
+            await self.outbox.put_many(token, points, f"{type(e).__name__}: {e}")
+        except PyMongoError as e2:
+            self._lost += len(points)
+            log.error("TB outbox put failed, %d points not forwarded: %s", len(points), e2)
+
+    async def forward(self, docs: List[Dict[str, Any]]) -> None:
+        """
+        Hand the frames to the batcher and wait until each batch was delivered
+        or outboxed; raises _NotForwarded when some points got neither.
+        """
+        self._lost = 0
+        futs = []
+        behind: Dict[str, List[Dict[str, Any]]] = {}
+        for d in docs:
+            tp = self._point(d)
+            if tp is None:
+                continue
+            token, point = tp
+            if token in behind or self.outbox.backlogged(token):
+                # older points of this device still wait in the outbox – keep the order
+                behind.setdefault(token, []).append(point)
+            else:
+                futs.append(self.batcher.submit(token, point))
+        for token, points in behind.items():
+            try:
+                await self.outbox.put_many(token, points, "backlog")
+            except PyMongoError as e:
+                raise _NotForwarded(f"outbox put failed: {e}")
+            FWD_FRAMES.inc("outboxed", n=len(points))
+        if not futs:
+            return
+        await self.batcher.flush()
+        res = await asyncio.gather(*futs, return_exceptions=True)
+        failed = sum(1 for r in res if isinstance(r, BaseException))
+        FWD_FRAMES.inc("sent", n=len(res) - failed)
+        if failed - self._lost:
+            FWD_FRAMES.inc("outboxed", n=failed - self._lost)
+        if self._lost:
+            FWD_FRAMES.inc("lost", n=self._lost)
+            raise _NotForwarded(f"{self._lost} points neither delivered nor outboxed")
+        ra = [r for r in map(_received_at, docs) if r is not None]
+        if ra:
+            FWD_LAG.set(max(0.0, (datetime.utcnow() - max(ra).replace(tzinfo=None)).total_seconds()))
+
+    async def _forward_retrying(self, docs: List[Dict[str, Any]]) -> bool:
+        """forward() until the page is delivered or outboxed; False when stopped first."""
+        while True:
+            try:
+                await self.forward(docs)
+                return True
+            except _NotForwarded as e:
+                log.warning("page not forwarded, retrying in %.0fs: %s", FWD_POLL_S, e)
+            if await self._pause(FWD_POLL_S):
+                return False
+
+    async def _pause(self, seconds: float) -> bool:
+        """Sleep unless stopped meanwhile; True when stopping."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        return self._stopping.is_set()
+
+    # --- sources ---
+
+    async def _open_stream(self):
+        """Change stream resumed from the saved token; the first event (or None) comes along."""
+        kw: Dict[str, Any] = {"max_await_time_ms": int(FWD_FLUSH_MS)}
+        if self.state.get("resume_token"):
+            kw["resume_after"] = self.state["resume_token"]
+        stream = self.coll.watch([{"$match": {"operationType": "insert"}}], **kw)
+        try:
+            # the server rejects an unsupported stream on the first aggregate/getMore
+            first = await stream.try_next()
+        except OperationFailure as e:
+            await stream.close()
+            if e.code == 286 and "resume_after" in kw:
+                # resume point fell off the oplog – start from now (backfill the gap with tb_sync_from_mongo.py --since)
+                log.warning("resume token expired, change stream restarts from now")
+                await self.save_state(resume_token=None)
+                return await self._open_stream()
+            if e.code in _NO_STREAM_CODES or "change stream" in str(e).lower():
+                raise _NoChangeStream(str(e))
+            raise
+        return stream, first, "resume_after" in kw
+
+    async def run_stream(self) -> None:
+        stream, first, resumed = await self._open_stream()
+        FWD_MODE_G.set(1, "stream")
+        log.info("forwarding from change stream", extra={"resumed": resumed})
+        async with stream:
+            while not self._stopping.is_set():
+                docs: List[Dict[str, Any]] = [first["fullDocument"]] if first else []
+                first = None
+                deadline = time.monotonic() + FWD_FLUSH_MS / 1000.0
+                while len(docs) < FWD_BATCH and time.monotonic() < deadline and not self._stopping.is_set():
+                    change = await stream.try_next()
+                    if change is None:
+                        break
+                    docs.append(change["fullDocument"])
+                if docs and not await self._forward_retrying(docs):
+                    return                  # stopped before the page got out – its resume token stays unsaved
+                token = stream.resume_token
+                if token is not None and token != self.state.get("resume_token"):
+                    await self.save_state(resume_token=token, mode="stream")
+
+    async def run_poll(self) -> None:
+        FWD_MODE_G.set(1, "poll")
+        field = f"{TS_META_FIELD}.ingest.received_at"
+        try:
+            await self.coll.create_index(field)
+        except PyMongoError as e:
+            log.warning("index on %s not created, polling scans: %s", field, e)
+        wm: datetime = self.state.get("watermark") or (datetime.utcnow() - timedelta(minutes=FWD_START_MIN))
+        wm = wm.replace(tzinfo=None)
+        # {_id: received_at} of frames sent inside the overlap – persisted with the watermark
+        seen: Dict[Any, datetime] = {e["_id"]: e["at"].replace(tzinfo=None) for e in self.state.get("seen") or []}
+        log.info("forwarding by polling", extra={"watermark": wm.isoformat()})
+        while not self._stopping.is_set():
+            # late frames inside the overlap that were not seen yet, then everything after the watermark
+            late = await (self.coll.find({field: {"$gte": wm - timedelta(seconds=FWD_OVERLAP_S), "$lte": wm},
+                                          "_id": {"$nin": list(seen)}})
+                          .sort([(field, 1), ("_id", 1)]).to_list(FWD_BATCH))
+            new = await (self.coll.find({field: {"$gt": wm}})
+                         .sort([(field, 1), ("_id", 1)]).limit(FWD_BATCH).to_list(FWD_BATCH))
+            fresh = [d for d in late + new if d["_id"] not in seen]
+            if fresh:
+                try:
+                    await self.forward(fresh)
+                except _NotForwarded as e:
+                    # watermark and seen stay put – the same page is read again
+                    log.warning("page not forwarded, polling it again: %s", e)
+                    await self._pause(FWD_POLL_S)
+                    continue
+                for d in fresh:
+                    seen[d["_id"]] = (_received_at(d) or wm).replace(tzinfo=None)
+                wm = max(wm, max(seen[d["_id"]] for d in fresh))
+                cut = wm - timedelta(seconds=FWD_OVERLAP_S)
+                seen = {k: v for k, v in seen.items() if v >= cut}
+                await self.save_state(watermark=wm, seen=[{"_id": k, "at": v} for k, v in seen.items()],
+                                      mode="poll")
+            if len(new) < FWD_BATCH:
+                await self._pause(FWD_POLL_S)
+
+    async def run(self) -> None:
+        await self.load_state()
+        if FWD_MODE in ("auto", "stream"):
+            try:
+                await self.run_stream()
+                return
+            except _NoChangeStream as e:
+                if FWD_MODE == "stream":
+                    raise
+                log.info("change stream unavailable, polling instead: %s", e)
+        await self.run_poll()
+
+
+async def _serve_metrics(port: int):
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
+
+
+async def _main() -> int:
+    if not await mongo.init_mongo(MONGO_URI, MONGO_DB):
+        log.error("Mongo unavailable (%s)", MONGO_DB)
+        return 2
+    db = mongo.get_db()
+    outbox = Outbox(db)
+    await outbox.ensure_indexes()
+    dispatcher = OutboxDispatcher(outbox, tb_client.post_telemetry_batch)
+    fwd = Forwarder(db, TokenMap(), outbox)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, fwd.stop)
+    runner = await _serve_metrics(FWD_METRICS_PORT) if FWD_METRICS_PORT else None
+    await tb_client.startup()
+    dispatcher.start()
+    try:
+        await fwd.run()
+    finally:
+        await fwd.batcher.flush()
+        await dispatcher.stop()
+        await tb_client.shutdown()
+        if runner is not None:
+            await runner.cleanup()
+        log.info("forwarder stopped")
+        bridge_log.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,254 @@
+"""
+Durable outbox for ThingsBoard telemetry (Mongo collection tb_outbox).
+
+A push that TB did not take is stored as
+    {token, point: {ts, values}, attempts, next_at, created_at, last_error}
+with the point's original ts, so a late delivery lands at the right time in
+TB. OutboxDispatcher drains it in the background:
+
+- per token in _id (arrival) order – while a token's oldest item waits for
+  its backoff, nothing newer of that token is sent;
+- up to TB_BATCH_MAX points of a token per array POST, OUTBOX_CONCURRENCY
+  tokens in parallel, next round right away while there is work (catch-up
+  after an outage goes out in bulk);
+- a failed batch is retried after OUTBOX_BACKOFF_S * 2^attempts (capped at
+  OUTBOX_BACKOFF_MAX_S, with jitter); after OUTBOX_MAX_ATTEMPTS it moves to
+  tb_outbox_dead.
+
+Several dispatchers may drain one collection (xerxes_to_tb workers,
+tb_forwarder): a token is only sent by the dispatcher holding its lease in
+<coll>_leases ({_id: token, owner, until}, taken with findOneAndUpdate,
+renewed per batch, expiring after OUTBOX_LEASE_S), so a token's points never
+go out twice in parallel or out of order.
+
+Delivery is at-least-once (a crash between the POST and the delete sends the
+batch again; TB overwrites the same ts).
+"""
+import os, random, socket, asyncio, uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import bridge_log
+import metrics
+
+OUTBOX_COLL          = os.getenv("OUTBOX_COLL", "tb_outbox")
+OUTBOX_DEAD_COLL     = os.getenv("OUTBOX_DEAD_COLL", "tb_outbox_dead")
+OUTBOX_MAX_ATTEMPTS  = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+OUTBOX_BACKOFF_S     = float(os.getenv("OUTBOX_BACKOFF_S", "5"))
+OUTBOX_BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", "900"))
+OUTBOX_POLL_S        = float(os.getenv("OUTBOX_POLL_S", "2"))
+OUTBOX_ROUND_MAX     = int(os.getenv("OUTBOX_ROUND_MAX", "5000"))     # items fetched per round
+OUTBOX_CONCURRENCY   = int(os.getenv("OUTBOX_CONCURRENCY", "8"))      # tokens posted in parallel
+OUTBOX_DEAD_TTL_S    = int(os.getenv("OUTBOX_DEAD_TTL_S", str(30 * 86400)))
+OUTBOX_LEASE_S       = float(os.getenv("OUTBOX_LEASE_S", "120"))      # per-token dispatch lease
+TB_BATCH_MAX         = int(os.getenv("TB_BATCH_MAX", "100"))          # same knob as tb_batch
+
+log = bridge_log.get_logger("tb_outbox")
+
+OUTBOX_DEPTH      = metrics.Gauge("bridge_tb_outbox_depth", "Telemetry points waiting in the TB outbox")
+OUTBOX_OLDEST_AGE = metrics.Gauge("bridge_tb_outbox_oldest_age_seconds", "Age of the oldest point in the TB outbox")
+OUTBOX_ITEMS      = metrics.Counter("bridge_tb_outbox_items_total", "TB outbox points by outcome", ("result",))
+
+PostFn = Callable[[str, List[Dict[str, Any]]], Awaitable[Any]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _backoff_s(attempts: int) -> float:
+    base = min(OUTBOX_BACKOFF_MAX_S, OUTBOX_BACKOFF_S * (2 ** max(0, attempts - 1)))
+    return base * random.uniform(0.8, 1.2)
+
+
+class Outbox:
+    def __init__(self, db, coll: str = OUTBOX_COLL, dead_coll: str = OUTBOX_DEAD_COLL,
+                 lease_s: float = OUTBOX_LEASE_S):
+        self.coll = db[coll]
+        self.dead = db[dead_coll]
+        self.leases = db[f"{coll}_leases"]
+        self.lease_s = lease_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._backlog: Set[str] = set()
+        self.depth = 0
+        self.oldest_at: Optional[datetime] = None
+        OUTBOX_DEPTH.set_function(lambda: self.depth)
+        OUTBOX_OLDEST_AGE.set_function(
+            lambda: (_now() - self.oldest_at).total_seconds() if self.oldest_at else 0)
+
+    async def ensure_indexes(self) -> None:
+        try:
+            await self.coll.create_index([("next_at", ASCENDING), ("_id", ASCENDING)])
+            await self.coll.create_index([("token", ASCENDING), ("_id", ASCENDING)])
+            await self.dead.create_index("dead_at", expireAfterSeconds=OUTBOX_DEAD_TTL_S)
+            await self.leases.create_index("until", expireAfterSeconds=0)
+        except PyMongoError as e:
+            log.warning("tb_outbox indexes not set: %s", e)
+
+    def backlogged(self, token: str) -> bool:
+        """True while older points of this token are still queued – new ones must queue behind them."""
+        return token in self._backlog
+
+    async def put(self, token: str, point: Dict[str, Any], error: Optional[str] = None) -> None:
+        """Queue one {ts, values} point; raises PyMongoError when it could not be stored."""
+        await self.put_many(token, [point], error)
+
+    async def put_many(self, token: str, points: List[Dict[str, Any]], error: Optional[str] = None) -> None:
+        if not points:
+            return
+        now = _now()
+        await self.coll.insert_many([
+            {"token": token, "point": p, "attempts": 0, "next_at": now, "created_at": now, "last_error": error}
+            for p in points
+        ], ordered=True)
+        self._backlog.add(token)
+        self.depth += len(points)
+        if self.oldest_at is None:
+            self.oldest_at = now
+        OUTBOX_ITEMS.inc("queued", n=len(points))
+
+    async def refresh_stats(self) -> None:
+        self.depth = await self.coll.estimated_document_count()
+        first = await self.coll.find_one({}, {"created_at": 1}, sort=[("_id", ASCENDING)])
+        self.oldest_at = first["created_at"].replace(tzinfo=timezone.utc) if first else None
+        self._backlog = set(await self.coll.distinct("token")) if self.depth else set()
+
+    async def lease(self, token: str) -> bool:
+        """Take or renew this dispatcher's lease on a token; False while another one holds it."""
+        now = _now()
+        try:
+            await self.leases.find_one_and_update(
+                {"_id": token, "$or": [{"owner": self.owner}, {"until": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "until": now + timedelta(seconds=self.lease_s)}},
+                upsert=True)
+        except DuplicateKeyError:
+            # the filter missed (held by someone else) and the upsert hit the existing _id
+            return False
+        return True
+
+    async def release(self, tokens: List[str]) -> None:
+        await self.leases.delete_many({"_id": {"$in": tokens}, "owner": self.owner})
+
+    async def due(self, limit: int = OUTBOX_ROUND_MAX) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Due items grouped per token, in order, cut at the token's first item
+        still in backoff – only tokens this dispatcher got the lease on
+        (release() them after sending).
+        """
+        now = _now()
+        tokens = await self.coll.distinct("token", {"next_at": {"$lte": now}})
+        leased = [t for t in tokens if await self.lease(t)]
+        if not leased:
+            return {}
+        # read after taking the lease: whatever a previous holder already sent is gone
+        items = await self.coll.find({"token": {"$in": leased}, "next_at": {"$lte": now}}) \
+            .sort("_id", ASCENDING).to_list(limit)
+        by_token: Dict[str, List[Dict[str, Any]]] = {}
+        for it in items:
+            by_token.setdefault(it["token"], []).append(it)
+        idle = [t for t in leased if t not in by_token]
+        if idle:
+            await self.release(idle)
+        if not by_token:
+            return by_token
+        blocked = await self.coll.aggregate([
+            {"$match": {"token": {"$in": list(by_token)}, "next_at": {"$gt": now}}},
+            {"$group": {"_id": "$token", "first": {"$min": "$_id"}}},
+        ]).to_list(None)
+        for b in blocked:
+            by_token[b["_id"]] = [it for it in by_token[b["_id"]] if it["_id"] < b["first"]]
+        empty = [t for t, its in by_token.items() if not its]
+        if empty:
+            await self.release(empty)
+        return {t: its for t, its in by_token.items() if its}
+
+    async def delivered(self, items: List[Dict[str, Any]]) -> None:
+        await self.coll.delete_many({"_id": {"$in": [it["_id"] for it in items]}})
+        OUTBOX_ITEMS.inc("sent", n=len(items))
+
+    async def failed(self, items: List[Dict[str, Any]], error: str,
+                     max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> None:
+        attempts = max(it["attempts"] for it in items) + 1
+        if attempts >= max_attempts:
+            now = _now()
+            await self.dead.insert_many([{**it, "attempts": attempts, "last_error": error, "dead_at": now} for it in items])
+            await self.coll.delete_many({"_id": {"$in": [it["_id"] for it in items]}})
+            OUTBOX_ITEMS.inc("dead", n=len(items))
+            log.error("TB outbox items dead-lettered", extra={"points": len(items), "attempts": attempts, "error": error})
+            return
+        await self.coll.update_many(
+            {"_id": {"$in": [it["_id"] for it in items]}},
+            {"$set": {"attempts": attempts, "last_error": error,
+                      "next_at": _now() + timedelta(seconds=_backoff_s(attempts))}})
+        OUTBOX_ITEMS.inc("retry", n=len(items))
+
+
+class OutboxDispatcher:
+    """Background drain of the outbox through `post(token, points)` (e.g. tb_client.post_telemetry_batch)."""
+
+    def __init__(self, outbox: Outbox, post: PostFn, batch: int = TB_BATCH_MAX,
+                 concurrency: int = OUTBOX_CONCURRENCY, poll_s: float = OUTBOX_POLL_S):
+        self.outbox = outbox
+        self.post = post
+        self.batch = max(1, batch)
+        self.concurrency = max(1, concurrency)
+        self.poll_s = poll_s
+        self._task: Optional[asyncio.Task] = None
+
+    async def _send_token(self, token: str, items: List[Dict[str, Any]]) -> None:
+        for i in range(0, len(items), self.batch):
+            chunk = items[i:i + self.batch]
+            if i and not await self.outbox.lease(token):
+                return                      # lease lost (expired during a slow round) – the new holder goes on
+            try:
+                await self.post(token, [it["point"] for it in chunk])
+            except Exception as e:
+                # the rest of this token waits behind the failed chunk
+                await self.outbox.failed(chunk, f"{type(e).__name__}: {e}")
+                return
+            await self.outbox.delivered(chunk)
+
+    async def drain_once(self) -> int:
+        due = await self.outbox.due()
+        if not due:
+            return 0
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def one(token: str, items: List[Dict[str, Any]]) -> None:
+            async with sem:
+                try:
+                    await self._send_token(token, items)
+                finally:
+                    await self.outbox.release([token])
+
+        await asyncio.gather(*(one(t, its) for t, its in due.items()))
+        return sum(len(its) for its in due.values())
+
+    async def _run(self) -> None:
+        while True:
+            n = 0
+            try:
+                n = await self.drain_once()
+                await self.outbox.refresh_stats()
+                if n:
+                    log.info("TB outbox drained", extra={"points": n, "left": self.outbox.depth})
+            except PyMongoError as e:
+                log.warning("TB outbox round failed: %s", e)
+            if not n:
+                await asyncio.sleep(self.poll_s)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
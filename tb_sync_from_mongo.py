@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import os
 import json
+import time
+import argparse
+import threading
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, List, Tuple
 from urllib import request, parse, error
 from pymongo import MongoClient
@@ -35,7 +39,50 @@ if os.path.exists(TOKEN_MAP_PATH):
     except Exception:
         TOKEN_MAP = {}
 
+class RateLimiter:
+    """Token bucket shared by all worker threads: at most `rate` TB requests/s (bursts up to `burst`)."""
+
+    def __init__(self, rate: float, burst: float = 0):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+TB_RATE = float(os.getenv("TB_SYNC_RATE", "0"))          # TB requests/s over all workers (0 = no limit)
+TB_429_RETRIES = int(os.getenv("TB_SYNC_429_RETRIES", "3"))
+RATE: "RateLimiter | None" = None
+STATS = {"requests": 0, "throttled": 0}
+_stats_lock = threading.Lock()
+
 def http_json(url: str, method="GET", data=None, headers=None, timeout=25) -> Tuple[int, Any]:
+    """TB request through the shared rate limiter; 429 (tenant rate limit) is retried with backoff."""
+    for attempt in range(TB_429_RETRIES + 1):
+        if RATE is not None:
+            RATE.acquire()
+        code, body = _http_json(url, method, data, headers, timeout)
+        with _stats_lock:
+            STATS["requests"] += 1
+            if code == 429:
+                STATS["throttled"] += 1
+        if code != 429 or attempt == TB_429_RETRIES:
+            return code, body
+        time.sleep(min(30.0, 2.0 ** attempt))
+    return code, body
+
+def _http_json(url: str, method="GET", data=None, headers=None, timeout=25) -> Tuple[int, Any]:
     req = request.Request(url, method=method)
     for k, v in (headers or {}).items():
         req.add_header(k, v)
@@ -161,43 +208,55 @@ def tb_ensure_device(token: str, uuid: str) -> str:
         body = json.loads(resp.read().decode("utf-8"))
         return body["id"]["id"]
 
-def main():
-    # Musíme mať TB_JWT v prostredí (source tb_jwt.env)
-    if not TB_JWT:
-        raise SystemError("TB_JWT missing. Run: source /opt/xerxes-bridge/tb_jwt.env")
+SYNC_STATE_COLL = os.getenv("TB_SYNC_STATE_COLL", "tb_sync_state")
+PAGE = int(os.getenv("TB_SYNC_PAGE", "500"))
+# tb_forwarder posiela živé dáta s vlastným stavom – plánovaný beh by ich poslal druhýkrát
+FWD_STATE_COLL = os.getenv("FWD_STATE_COLL", "tb_forwarder_state")
+FWD_ACTIVE_MIN = float(os.getenv("FWD_ACTIVE_MIN", "10"))
 
-    # časové okno – napr. posledných LOOKBACK_MIN minút
-    since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(minutes=LOOKBACK_MIN)
+# filter na REAL dáta (origin=device, nie synthetic)
+REAL = {
+    "meta.ingest.origin": "device",
+    "$or": [
+        {"is_synth": {"$exists": False}},
+        {"is_synth": False},
+    ],
+}
 
-    # pripojenie na Mongo (používame MONGO_URI, DB_NAME, COLL_MEAS zhora)
-    client = MongoClient(MONGO_URI)
-    coll = client.get_database(DB_NAME).get_collection(COLL_MEAS)
-
-    # filter na REAL dáta (origin=device, nie synthetic)
-    REAL = {
-        "ts": {"$gte": since},
-        "meta.ingest.origin": "device",
-        "$or": [
-            {"is_synth": {"$exists": False}},
-            {"is_synth": False},
-        ],
-    }
+def parse_since(v: str) -> dt.datetime:
+    """--since: ISO dátum/čas (UTC) alebo počet minút dozadu."""
+    try:
+        return dt.datetime.now(dt.timezone.utc) - dt.timedelta(minutes=float(v))
+    except ValueError:
+        pass
+    t = dt.datetime.fromisoformat(v.replace("Z", "+00:00"))
+    return t if t.tzinfo else t.replace(tzinfo=dt.timezone.utc)
+
+def after_watermark(wm: Dict[str, Any]) -> Dict[str, Any]:
+    """Dokumenty za watermarkom (ts, _id) – _id rozlišuje framy s rovnakým ts."""
+    return {"$or": [{"ts": {"$gt": wm["ts"]}}, {"ts": wm["ts"], "_id": {"$gt": wm["doc_id"]}}]}
 
-    uuids = list(coll.distinct("uuid", REAL))
-    print(f"[tb_sync] UUIDs in last {LOOKBACK_MIN} min: {len(uuids)}")
+def forwarder_active(database) -> bool:
+    """tb_forwarder uložil stav za posledných FWD_ACTIVE_MIN minút (beží)."""
+    cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(minutes=FWD_ACTIVE_MIN)
+    return database.get_collection(FWD_STATE_COLL).find_one({"updated_at": {"$gte": cutoff}}) is not None
 
-    for u in uuids:
+def sync_uuid(coll, state, u: str, since: dt.datetime) -> Tuple[int, int]:
+    """
+    Pošle do TB framy uuid za jeho watermarkom (bez watermarku od `since`),
+    po stránkach PAGE. Watermark sa posunie len po 2xx z TB.
+    Vracia (poslané framy, stav posledného POST).
+    """
+    wm = state.find_one({"_id": u})
+    sent, code = 0, 200
+    device_id = None
+    while True:
         q = dict(REAL)
         q["uuid"] = u
-
-        docs = list(
-            coll.find(q)
-            .sort("ts", 1)
-            .limit(500)
-        )
-
+        q = {"$and": [q, after_watermark(wm)]} if wm else {**q, "ts": {"$gte": since}}
+        docs = list(coll.find(q).sort([("ts", 1), ("_id", 1)]).limit(PAGE))
         if not docs:
-            continue
+            break
 
         # pripravíme sériu (ts_ms, values) pre TB
         series: List[Tuple[int, Dict[str, Any]]] = []
@@ -205,7 +264,7 @@ def main():
             ts = d.get("ts")
             if not isinstance(ts, dt.datetime):
                 continue
-            ts_ms = int(ts.timestamp() * 1000)
+            ts_ms = int(ts.replace(tzinfo=dt.timezone.utc).timestamp() * 1000)
 
             values = d.get("measurements") or {}
             if not isinstance(values, dict) or not values:
@@ -213,25 +272,104 @@ def main():
 
             series.append((ts_ms, values))
 
-        if not series:
-            continue
+        if series:
+            # ensure device v TB (raz za uuid)
+            if device_id is None:
+                try:
+                    device_id = ensure_device(TB_JWT, str(u))
+                except Exception as e:
+                    print(f"[tb_sync] ensure_device failed for uuid={u}: {e}")
+                    return sent, -1
+            try:
+                code = post_telemetry_jwt(TB_JWT, device_id, series)
+            except Exception as e:
+                print(f"[tb_sync] post_telemetry failed for uuid={u}: {e}")
+                return sent, -1
+            if not 200 <= code < 300:
+                print(f"[tb_sync] uuid={u} → device={device_id}, frames={len(series)}, status={code} (watermark kept)")
+                return sent, code
+            sent += len(series)
 
-        # ensure device v TB
-        try:
-            device_id = ensure_device(TB_JWT, str(u))
-        except Exception as e:
-            print(f"[tb_sync] ensure_device failed for uuid={u}: {e}")
-            continue
+        last = docs[-1]
+        wm = {"_id": u, "ts": last["ts"], "doc_id": last["_id"]}
+        state.replace_one({"_id": u}, {**wm, "updated_at": dt.datetime.now(dt.timezone.utc)}, upsert=True)
+        if len(docs) < PAGE:
+            break
+    if sent:
+        print(f"[tb_sync] uuid={u} → device={device_id}, frames={sent}, status={code}")
+    return sent, code
 
-        # pošleme telemetry
-        try:
-            code = post_telemetry_jwt(TB_JWT, device_id, series)
-            print(
-                f"[tb_sync] uuid={u} → device={device_id}, "
-                f"frames={len(series)}, status={code}"
-            )
-        except Exception as e:
-            print(f"[tb_sync] post_telemetry failed for uuid={u}: {e}")
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Mongo → TB sync (incremental, per-uuid watermark v tb_sync_state)")
+    ap.add_argument("--since", help="uuid bez watermarku: od kedy (ISO čas UTC alebo minúty dozadu; default LOOKBACK_MIN)")
+    ap.add_argument("--reset", action="store_true", help="zmaž watermarky (--uuid alebo všetky) – zámerný backfill od --since")
+    ap.add_argument("--uuid", nargs="*", help="len tieto uuid")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("TB_SYNC_WORKERS", "1")),
+                    help="paralelne spracované uuid (každé uuid v jednom vlákne → poradie framov zariadenia ostáva)")
+    ap.add_argument("--rate", type=float, default=TB_RATE,
+                    help="max TB requestov/s spolu za všetky vlákna (tenant limit; 0 = bez limitu)")
+    args = ap.parse_args(argv)
+
+    # Musíme mať TB_JWT v prostredí (source tb_jwt.env)
+    if not TB_JWT:
+        raise SystemError("TB_JWT missing. Run: source /opt/xerxes-bridge/tb_jwt.env")
+
+    # časové okno – uuid s dátami za posledných LOOKBACK_MIN minút (alebo od --since)
+    since = parse_since(args.since) if args.since else \
+        dt.datetime.now(dt.timezone.utc) - dt.timedelta(minutes=LOOKBACK_MIN)
+
+    # pripojenie na Mongo (používame MONGO_URI, DB_NAME, COLL_MEAS zhora)
+    client = MongoClient(MONGO_URI)
+    database = client.get_database(DB_NAME)
+    coll = database.get_collection(COLL_MEAS)
+    state = database.get_collection(SYNC_STATE_COLL)
+
+    # bez --since/--reset/--uuid ide o plánovaný beh (timer) – živé dáta už posiela tb_forwarder
+    if not (args.since or args.reset or args.uuid) and forwarder_active(database):
+        print(f"[tb_sync] tb_forwarder is active ({FWD_STATE_COLL} updated < {FWD_ACTIVE_MIN:g} min ago), "
+              f"skipping – backfill explicitly with --since/--reset/--uuid")
+        return
+
+    if args.reset:
+        n = state.delete_many({"_id": {"$in": args.uuid}} if args.uuid else {}).deleted_count
+        print(f"[tb_sync] reset {n} watermark(s)")
+
+    uuids = args.uuid or list(coll.distinct("uuid", {**REAL, "ts": {"$gte": since}}))
+    print(f"[tb_sync] UUIDs since {since.isoformat(timespec='seconds')}: {len(uuids)}")
+
+    global RATE
+    RATE = RateLimiter(args.rate) if args.rate > 0 else None
+    workers = max(1, args.workers)
+
+    t0 = time.monotonic()
+    total, done, failed = 0, 0, []
+    last_report = t0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tb_sync") as pool:
+        futs = {pool.submit(sync_uuid, coll, state, u, since): u for u in uuids}
+        for f in as_completed(futs):
+            u = futs[f]
+            done += 1
+            try:
+                sent, code = f.result()
+            except Exception as e:
+                print(f"[tb_sync] uuid={u} failed: {e}")
+                sent, code = 0, -1
+            total += sent
+            if not 200 <= code < 300:
+                failed.append(u)
+            now = time.monotonic()
+            if now - last_report >= 10:
+                last_report = now
+                print(f"[tb_sync] progress {done}/{len(uuids)} uuids, {total} frames, "
+                      f"{total / (now - t0):.1f} frames/s")
+
+    elapsed = time.monotonic() - t0
+    print(f"[tb_sync] done: {len(uuids)} uuids ({len(failed)} failed), {total} frames sent, "
+          f"{STATS['requests']} TB requests ({STATS['throttled']} throttled) in {elapsed:.1f}s "
+          f"→ {total / elapsed if elapsed else 0:.1f} frames/s, {STATS['requests'] / elapsed if elapsed else 0:.1f} req/s "
+          f"(workers={workers}, rate={args.rate or '-'})")
+    if failed:
+        print(f"[tb_sync] failed uuids: {','.join(map(str, failed[:50]))}{' …' if len(failed) > 50 else ''}")
 
 if __name__ == "__main__":
     main()
@@ -4,7 +4,7 @@ import csv
 import datetime as dt
 from typing import Dict, Any, List, Tuple
 
-from pymongo import MongoClient
+from startup_trace import TRACE, mongo_client
 from urllib import request, error
 import json
 
@@ -64,7 +64,7 @@ def http_json(url: str, method="GET", data=None,
 # =========================
 
 def load_mongo_last_real() -> Dict[str, Dict[str, Any]]:
-    client = MongoClient(MONGO_URI)
+    client = mongo_client(MONGO_URI)
     coll = client.get_database(DB_NAME).get_collection(COLL_MEAS)
 
     since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=LOOKBACK_DAYS)
@@ -175,13 +175,16 @@ def load_tb_last_ts(device_id: str) -> dt.datetime | None:
 # =========================
 
 def main():
+    TRACE.mark("import")
     print(f"[audit] LOOKBACK_DAYS={LOOKBACK_DAYS}")
     print("[audit] Loading Mongo last REAL per uuid...")
-    mongo_map = load_mongo_last_real()
+    with TRACE.phase("mongo_query"):
+        mongo_map = load_mongo_last_real()
     print(f"[audit] Mongo uuids: {len(mongo_map)}")
 
     print("[audit] Loading TB devices...")
-    tb_devs = load_tb_devices()
+    with TRACE.phase("tb_devices"):
+        tb_devs = load_tb_devices()
 
     # všetky uuid z Mongo + TB (mená devices v TB sú uuid)
     all_ids = set(mongo_map.keys()) | set(tb_devs.keys())
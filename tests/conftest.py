@@ -0,0 +1,102 @@
+import os, sys, asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+# the bridge modules live flat in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROJECT_API_KEY", "")
+
+
+def run(aw):
+    return asyncio.run(aw)
+
+
+class _Collection:
+    """mongomock-motor collection whose bulk_write runs the requests one by one (its own chokes on pymongo 4.11+ requests)."""
+
+    def __init__(self, coll):
+        self._coll = coll
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+    async def bulk_write(self, requests, ordered=True, **kw):
+        from pymongo import InsertOne, UpdateOne
+        from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+        errors = []
+        for i, r in enumerate(requests):
+            try:
+                if isinstance(r, InsertOne):
+                    await self._coll.insert_one(r._doc)
+                elif isinstance(r, UpdateOne):
+                    await self._coll.update_one(r._filter, r._doc, upsert=r._upsert)
+                else:
+                    raise NotImplementedError(type(r).__name__)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": 0})
+
+
+class _Database:
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def __getitem__(self, name):
+        return _Collection(self._db[name])
+
+    def get_collection(self, name, **kw):
+        return _Collection(self._db.get_collection(name, **kw))
+
+
+@pytest.fixture
+def mongo_db():
+    """In-memory Motor-compatible database (mongomock-motor, see tests/requirements.txt)."""
+    mm = pytest.importorskip("mongomock_motor")
+    return _Database(mm.AsyncMongoMockClient()["xerxes"])
+
+
+@pytest.fixture
+def bridge(mongo_db, monkeypatch):
+    """app with its Mongo globals on the in-memory database, as after _init_mongo (no write-behind/spool/dedup)."""
+    pytest.importorskip("fastapi")
+    import app
+    from keys_audit import KeysAuditAggregator, ROLLUP_COLL
+    from raw_store import RawLogger
+
+    for name, value in {
+        "db": mongo_db, "collection": mongo_db["measurements"], "devices_col": mongo_db["devices"],
+        "raw_db": mongo_db["ingest_raw"], "audit_col": mongo_db["keys_audit"], "raw_log": RawLogger(mongo_db),
+        "keys_rollup": KeysAuditAggregator(mongo_db[ROLLUP_COLL]),
+        "ts_wb": None, "raw_wb": None, "audit_wb": None, "mongo_health": None, "device_registry": None,
+        "spool_log": None, "spool_replayer": None, "dedup": None, "admission": None, "PROJECT_API_KEY": "",
+    }.items():
+        monkeypatch.setattr(app, name, value)
+    return app
+
+
+def make_request(path: str, body: bytes, headers: Optional[Dict[str, str]] = None):
+    """Starlette Request for a POST with the whole body in one message."""
+    from starlette.requests import Request
+
+    hdrs: List[Tuple[bytes, bytes]] = [(k.lower().encode(), v.encode())
+                                       for k, v in {"content-type": "application/json", **(headers or {})}.items()]
+    scope: Dict[str, Any] = {"type": "http", "method": "POST", "path": path, "headers": hdrs,
+                             "query_string": b"", "client": ("127.0.0.1", 40000)}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
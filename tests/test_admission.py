@@ -0,0 +1,95 @@
+"""admission.AdmissionController: FIFO slots, per-uuid cap, Retry-After."""
+import asyncio, json
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+from conftest import make_request, run
+
+
+def test_waiters_get_slots_in_fifo_order():
+    ctl = AdmissionController(max_inflight=1, queue_max=8, queue_timeout_ms=1000, per_uuid_max=0)
+    order = []
+
+    async def req(name):
+        await ctl.acquire()
+        order.append(name)
+        await asyncio.sleep(0.01)
+        ctl.release()
+
+    async def go():
+        await ctl.acquire()                      # the slot is busy, everyone queues
+        tasks = [asyncio.ensure_future(req(n)) for n in "abcde"]
+        await asyncio.sleep(0.01)
+        assert len(ctl._waiters) == 5
+        ctl.release()
+        await asyncio.gather(*tasks)
+
+    run(go())
+    assert order == list("abcde")
+    assert ctl.inflight == 0
+
+
+def test_full_queue_and_queue_timeout_are_503():
+    ctl = AdmissionController(max_inflight=1, queue_max=1, queue_timeout_ms=20, per_uuid_max=0)
+
+    async def go():
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await ctl.acquire()
+        with pytest.raises(AdmissionRejected) as late:
+            await waiter
+        return full.value, late.value
+
+    full, late = run(go())
+    assert (full.status_code, full.reason) == (503, "queue_full")
+    assert (late.status_code, late.reason) == (503, "timeout")
+
+
+def test_per_uuid_cap_is_429_and_frees_on_release():
+    ctl = AdmissionController(max_inflight=8, queue_max=8, per_uuid_max=2, retry_max_s=30)
+
+    async def go():
+        await ctl.acquire("dev-1")
+        await ctl.acquire("dev-1")
+        with pytest.raises(AdmissionRejected) as e:
+            await ctl.acquire("dev-1")
+        await ctl.acquire("dev-2")               # other devices are not affected
+        ctl.release("dev-1")
+        await ctl.acquire("dev-1")
+        return e.value
+
+    e = run(go())
+    assert (e.status_code, e.reason) == (429, "per_uuid")
+    assert 1 <= e.retry_after <= 30
+
+
+def test_retry_after_follows_backlog_and_rate():
+    ctl = AdmissionController(max_inflight=4, retry_max_s=30)
+    assert ctl.retry_after_s() == 30             # no completions observed yet
+    ctl.inflight, ctl._rate = 4, 2.0             # 4 running + this one at 2 done/s
+    assert ctl.retry_after_s() == 3
+    ctl._rate = 1000.0
+    assert ctl.retry_after_s() == 1
+    ctl._rate = 0.01
+    assert ctl.retry_after_s() == 30
+
+
+def test_ingest_answers_429_with_retry_after(bridge, monkeypatch):
+    from fastapi import HTTPException
+
+    ctl = AdmissionController(per_uuid_max=1)
+    monkeypatch.setattr(bridge, "admission", ctl)
+    body = json.dumps({"uuid": "dev-1", "ts": 1700000000, "values": {"t": 1}}).encode()
+
+    async def go():
+        await ctl.acquire("dev-1")               # the device already holds its one slot
+        req = make_request("/bridge/ingest", body)
+        await bridge.ingest(req, await bridge._ingest_payload(req))
+
+    with pytest.raises(HTTPException) as e:
+        run(go())
+    assert e.value.status_code == 429
+    assert 1 <= int(e.value.headers["Retry-After"]) <= ctl.retry_max_s
@@ -0,0 +1,72 @@
+"""Duplicate suppression on /bridge/ingest/batch (dedup.Deduplicator on the in-memory database)."""
+import json
+
+import pytest
+
+from conftest import make_request, run
+
+
+class _Counting:
+    """Collection proxy counting insert_many round-trips."""
+
+    def __init__(self, coll):
+        self._coll = coll
+        self.insert_many_calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+    async def insert_many(self, docs, **kw):
+        self.insert_many_calls += 1
+        return await self._coll.insert_many(docs, **kw)
+
+
+@pytest.fixture
+def deduped(bridge, mongo_db, monkeypatch):
+    import dedup
+    coll = _Counting(mongo_db[dedup.DEDUP_COLL])
+    monkeypatch.setattr(bridge, "dedup", dedup.Deduplicator(coll))
+    return bridge, coll
+
+
+def _frames(n, uuid="dev-1"):
+    return [{"uuid": uuid, "ts": 1700000000 + i, "values": {"t": i}} for i in range(n)]
+
+
+async def _post(bridge, frames):
+    resp = await bridge.ingest_batch(make_request("/bridge/ingest/batch", json.dumps(frames).encode()))
+    return json.loads(resp.body)
+
+
+def test_batch_claims_share_one_dedup_flush(deduped):
+    bridge, coll = deduped
+
+    async def go():
+        out = await _post(bridge, _frames(150))
+        return out, coll.insert_many_calls
+
+    out, calls = run(go())
+    assert out["accepted"] == 150
+    assert calls == 1
+
+
+def test_resent_batch_is_duplicate(deduped):
+    bridge, _ = deduped
+
+    async def go():
+        first = await _post(bridge, _frames(20))
+        again = await _post(bridge, _frames(20))
+        return first, again, await bridge.collection.count_documents({})
+
+    first, again, stored = run(go())
+    assert [r["status"] for r in first["items"]] == [201] * 20
+    assert [r["detail"] for r in again["items"]] == ["duplicate"] * 20
+    assert stored == 20
+
+
+def test_copy_inside_a_batch_shares_the_first_outcome(deduped):
+    bridge, _ = deduped
+    frames = _frames(3)
+    out = run(_post(bridge, frames + [frames[1]]))
+    assert [r["status"] for r in out["items"]] == [201, 201, 201, 200]
+    assert out["items"][3]["detail"] == "duplicate"
@@ -0,0 +1,47 @@
+"""/bridge/ingest/batch writes against the in-memory database."""
+import json
+
+from conftest import make_request, run
+
+
+def _batch(bridge, frames):
+    req = make_request("/bridge/ingest/batch", json.dumps(frames).encode())
+    resp = run(bridge.ingest_batch(req))
+    return json.loads(resp.body)
+
+
+def _frame(uuid, ts, **values):
+    return {"uuid": uuid, "ts": ts, "values": values, "meta": {"version": "v1.5.0"}}
+
+
+def _details(bridge):
+    return run(bridge.audit_col.find({}, {"_id": 0, "uuid": 1, "meas_keys": 1, "sig": 1}).to_list(None))
+
+
+def test_new_key_set_writes_audit_detail(bridge):
+    out = _batch(bridge, [_frame("dev-1", 1700000000, t=21.5, h=40), _frame("dev-1", 1700000060, t=21.6, h=41)])
+    assert out["accepted"] == 2
+    details = _details(bridge)
+    # one detail for the new key set, the second frame is only counted in the rollup
+    assert len(details) == 1
+    assert details[0]["uuid"] == "dev-1" and sorted(details[0]["meas_keys"]) == ["h", "t"]
+
+
+def test_known_key_set_is_rollup_only_and_change_is_detailed(bridge):
+    _batch(bridge, [_frame("dev-1", 1700000000, t=21.5)])
+    _batch(bridge, [_frame("dev-1", 1700000060, t=21.6)])
+    assert len(_details(bridge)) == 1
+    _batch(bridge, [_frame("dev-1", 1700000120, t=21.7, co2=600)])
+    details = _details(bridge)
+    assert len(details) == 2
+    assert sorted(details[1]["meas_keys"]) == ["co2", "t"]
+    counts = {uuid for uuid, _, _ in bridge.keys_rollup._counts}
+    assert counts == {"dev-1"}
+
+
+def test_batch_matches_single_ingest(bridge):
+    _batch(bridge, [_frame("dev-2", 1700000000, t=1)])
+    req = make_request("/bridge/ingest", json.dumps(_frame("dev-3", 1700000000, t=1)).encode())
+    decoded = run(bridge._ingest_payload(req))
+    run(bridge.ingest(req, decoded))
+    assert sorted(d["uuid"] for d in _details(bridge)) == ["dev-2", "dev-3"]
@@ -0,0 +1,78 @@
+"""ingest_codec body decoding: gzip members, deflate/zlib detection, size caps."""
+import gzip, json, zlib
+
+import pytest
+
+import ingest_codec as codec
+from conftest import make_request, run
+
+BODY = json.dumps({"uuid": "dev-1", "ts": 1700000000, "values": {"t": 21.5, "h": 40}}).encode()
+
+
+async def _chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def _read(data, encoding, size=7, limit=codec.INGEST_MAX_BODY_BYTES):
+    return run(codec.read_body(_chunks(data, size), encoding, limit))
+
+
+def _raw_deflate(data):
+    c = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+
+def test_concatenated_gzip_members_are_all_decoded():
+    a, b = BODY[:20], BODY[20:]
+    body = gzip.compress(a) + gzip.compress(b)
+    assert codec.decompress_body(body, "gzip") == BODY
+    # every chunk boundary, including one exactly at the member border
+    for size in range(1, len(body) + 1):
+        assert _read(body, "gzip", size) == BODY
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "Deflate "])
+def test_zlib_wrapped_and_raw_deflate(encoding):
+    assert _read(zlib.compress(BODY), encoding) == BODY
+    assert _read(_raw_deflate(BODY), encoding) == BODY
+    assert codec.decompress_body(_raw_deflate(BODY), encoding) == BODY
+
+
+@pytest.mark.parametrize("body,encoding", [
+    (zlib.compress(BODY) + b"junk", "deflate"),
+    (gzip.compress(BODY)[:-6], "gzip"),
+    (b"not compressed at all", "gzip"),
+])
+def test_broken_bodies_are_400(body, encoding):
+    with pytest.raises(codec.BodyError) as e:
+        _read(body, encoding)
+    assert e.value.status_code == 400
+
+
+def test_decompressed_size_is_capped():
+    bomb = gzip.compress(b"0" * (2 * 1024 * 1024))
+    assert len(bomb) < codec.INGEST_MAX_BODY_BYTES
+    for read in (lambda: _read(bomb, "gzip", 64 * 1024), lambda: codec.decompress_body(bomb, "gzip")):
+        with pytest.raises(codec.BodyError) as e:
+            read()
+        assert e.value.status_code == 413
+
+
+def test_plain_body_over_limit_and_unknown_encoding():
+    with pytest.raises(codec.BodyError) as e:
+        _read(b"x" * 101, None, limit=100)
+    assert e.value.status_code == 413
+    with pytest.raises(codec.BodyError) as e:
+        _read(BODY, "br")
+    assert e.value.status_code == 415
+
+
+def test_oversized_body_is_413_on_ingest(bridge):
+    from fastapi import HTTPException
+
+    bomb = gzip.compress(b" " * (codec.INGEST_MAX_BODY_BYTES + 1))
+    req = make_request("/bridge/ingest", bomb, {"content-encoding": "gzip"})
+    with pytest.raises(HTTPException) as e:
+        run(bridge._ingest_payload(req))
+    assert e.value.status_code == 413
@@ -0,0 +1,17 @@
+"""ingest_codec must accept, reject and parse every body exactly like the old json + pydantic path."""
+import pytest
+
+pytest.importorskip("pydantic")
+
+import ingest_codec_compat as compat
+
+CORPUS = [b.encode("utf-8") for b in compat.BUILTIN] + compat.load_corpus(compat.DEFAULT_CORPUS)
+
+
+def test_corpus_is_not_empty():
+    assert len(compat.load_corpus(compat.DEFAULT_CORPUS)) >= 20
+
+
+@pytest.mark.parametrize("raw", CORPUS, ids=lambda raw: raw[:40].decode("utf-8", "replace"))
+def test_same_outcome_as_pydantic(raw):
+    assert compat.compare(raw) is None
@@ -0,0 +1,125 @@
+"""spool.Spool (segments, CRC, recovery) and SpoolReplayer (order, guarded devices upserts, re-apply)."""
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from conftest import run
+from spool import Spool, SpoolReplayer, _seg_name
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _spool(path, **kw):
+    sp = Spool(str(path), fsync_ms=0, **kw)
+    sp.open()
+    return sp
+
+
+def _append_all(sp, records):
+    async def go():
+        for r in records:
+            await sp.append(r)
+        await sp.close()
+    run(go())
+
+
+def _frame_ops(n, uuid="dev-1", battery=3.7):
+    ts = T0 + timedelta(minutes=n)
+    return [
+        {"i": "measurements", "d": {"_id": ObjectId(), "uuid": uuid, "ts": ts, "measurements": {"t": n}}},
+        {"u": "devices", "q": {"uuid": uuid}, "g": "last_real_ts",
+         "d": {"$setOnInsert": {"uuid": uuid}, "$set": {"last_real_ts": ts, "battery_v": battery},
+               "$addToSet": {"aliases": {"$each": [f"sensor-{uuid}"]}}}},
+    ]
+
+
+def test_records_round_trip_with_bson_types(tmp_path):
+    rec = _frame_ops(1)
+    _append_all(_spool(tmp_path), [rec])
+    sp = _spool(tmp_path)
+    records, cursor, lines, _ = sp.read_batch(10)
+    assert sp.depth == 1 and lines == 1
+    assert records == [rec]
+    assert isinstance(records[0][0]["d"]["_id"], ObjectId)
+    assert records[0][0]["d"]["ts"] == rec[0]["d"]["ts"]
+
+
+def test_bad_checksum_is_skipped(tmp_path):
+    _append_all(_spool(tmp_path), [_frame_ops(1), _frame_ops(2)])
+    seg = tmp_path / _seg_name(1)
+    data = bytearray(seg.read_bytes())
+    data[20] ^= 0x01                               # inside the first record's JSON
+    seg.write_bytes(bytes(data))
+    records, _, lines, _ = _spool(tmp_path).read_batch(10)
+    assert lines == 2
+    assert [r[0]["d"]["measurements"]["t"] for r in records] == [2]
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    _append_all(_spool(tmp_path), [_frame_ops(1), _frame_ops(2)])
+    seg = tmp_path / _seg_name(1)
+    with open(seg, "ab") as f:
+        f.write(b"deadbeef [{\"i\": \"measurements\", \"d\": {")   # crash in the middle of a write
+    sp = _spool(tmp_path)
+    assert sp.depth == 2
+    assert seg.read_bytes().endswith(b"\n")
+    _append_all(sp, [_frame_ops(3)])
+    records, _, _, _ = _spool(tmp_path).read_batch(10)
+    assert [r[0]["d"]["measurements"]["t"] for r in records] == [1, 2, 3]
+
+
+def test_cursor_and_segments_survive_restart(tmp_path):
+    _append_all(_spool(tmp_path, segment_bytes=400), [_frame_ops(n) for n in range(5)])
+    sp = _spool(tmp_path, segment_bytes=400)
+    assert len(sp.segments()) > 1
+    records, cursor, lines, consumed = sp.read_batch(3)
+    sp.commit(cursor, lines, consumed)
+    assert all(seq >= cursor[0] for seq in sp.segments())
+    sp = _spool(tmp_path, segment_bytes=400)
+    assert sp.depth == 2
+    records, _, _, _ = sp.read_batch(10)
+    assert [r[0]["d"]["measurements"]["t"] for r in records] == [3, 4]
+
+
+def test_replay_applies_devices_upserts_in_order(tmp_path, mongo_db):
+    _append_all(_spool(tmp_path), [_frame_ops(1, battery=3.9), _frame_ops(2, battery=3.8), _frame_ops(3, battery=3.7)])
+    applied = []
+    sp = _spool(tmp_path)
+    rp = SpoolReplayer(sp, mongo_db, on_applied=lambda kind, d: applied.append(kind),
+                       time_fields={"measurements": "ts"})
+
+    async def go():
+        n = await rp.drain_once()
+        return n, await mongo_db["devices"].find_one({"uuid": "dev-1"}), await mongo_db["measurements"].count_documents({})
+
+    n, dev, stored = run(go())
+    assert n == 3 and stored == 3 and sp.depth == 0
+    assert dev["last_real_ts"].replace(tzinfo=timezone.utc) == T0 + timedelta(minutes=3)
+    assert dev["battery_v"] == 3.7
+
+
+def test_replay_does_not_roll_back_newer_live_state(tmp_path, mongo_db):
+    _append_all(_spool(tmp_path), [_frame_ops(1, battery=3.9)])
+    newer = T0 + timedelta(hours=1)
+
+    async def go():
+        await mongo_db["devices"].insert_one({"uuid": "dev-1", "last_real_ts": newer, "battery_v": 3.5, "aliases": []})
+        await SpoolReplayer(_spool(tmp_path), mongo_db).drain_once()
+        return await mongo_db["devices"].find_one({"uuid": "dev-1"})
+
+    dev = run(go())
+    assert dev["last_real_ts"].replace(tzinfo=timezone.utc) == newer
+    assert dev["battery_v"] == 3.5
+    assert dev["aliases"] == ["sensor-dev-1"]
+
+
+def test_reapplied_batch_does_not_duplicate_measurements(tmp_path, mongo_db):
+    records = [_frame_ops(n) for n in range(4)]
+    rp = SpoolReplayer(_spool(tmp_path), mongo_db, time_fields={"measurements": "ts"})
+
+    async def go():
+        await rp._apply(records[:2])                 # crash after these, before the cursor moved
+        await rp._apply(records)
+        return await mongo_db["measurements"].count_documents({})
+
+    assert run(go()) == 4
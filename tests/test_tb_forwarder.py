@@ -0,0 +1,110 @@
+"""tb_forwarder.Forwarder: state only moves past frames that were delivered or outboxed."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from conftest import run
+
+pytest.importorskip("aiohttp")
+
+import tb_forwarder as fwd_mod
+from tb_outbox import Outbox
+
+
+class _Tokens:
+    def get(self, uuid):
+        return f"tok-{uuid}"
+
+
+class _TB:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.posts = []
+
+    async def __call__(self, token, points):
+        if self.fail:
+            raise RuntimeError("TB 5xx 503")
+        self.posts.append((token, [p["values"]["t"] for p in points]))
+
+
+def _doc(uuid, n, received_at=None):
+    return {"uuid": uuid, "ts": datetime(2026, 1, 1) + timedelta(seconds=n), "measurements": {"t": n},
+            "meta": {"ingest": {"origin": "device", "synthetic": False,
+                                "received_at": received_at or datetime.utcnow()}}}
+
+
+async def _broken_put(token, points, error=None):
+    raise AutoReconnect("mongo down")
+
+
+@pytest.fixture
+def forwarder(mongo_db):
+    tb = _TB()
+    return fwd_mod.Forwarder(mongo_db, _Tokens(), Outbox(mongo_db), post=tb), tb
+
+
+def test_delivered_points(forwarder):
+    fwd, tb = forwarder
+    run(fwd.forward([_doc("a", 1), _doc("a", 2), _doc("b", 3)]))
+    assert sorted(tb.posts) == [("tok-a", [1, 2]), ("tok-b", [3])]
+
+
+def test_refused_batch_goes_to_outbox(forwarder):
+    fwd, tb = forwarder
+    tb.fail = True
+    run(fwd.forward([_doc("a", 1), _doc("a", 2)]))
+    items = run(fwd.outbox.coll.find({}).sort("_id", 1).to_list(None))
+    assert [it["point"]["values"]["t"] for it in items] == [1, 2]
+
+
+def test_outbox_put_failure_raises(forwarder, monkeypatch):
+    fwd, tb = forwarder
+    tb.fail = True
+    monkeypatch.setattr(fwd.outbox, "put_many", _broken_put)
+    with pytest.raises(fwd_mod._NotForwarded):
+        run(fwd.forward([_doc("a", 1)]))
+
+
+def test_backlogged_device_queues_behind_outbox(forwarder):
+    fwd, tb = forwarder
+
+    async def go():
+        await fwd.outbox.put("tok-a", {"ts": 0, "values": {"t": 0}}, "TB 5xx")
+        await fwd.forward([_doc("a", 1), _doc("b", 2), _doc("a", 3)])
+        return await fwd.outbox.coll.find({"token": "tok-a"}).sort("_id", 1).to_list(None)
+
+    items = run(go())
+    assert tb.posts == [("tok-b", [2])]
+    assert [it["point"]["values"]["t"] for it in items] == [0, 1, 3]
+
+
+def test_poll_keeps_watermark_when_page_is_lost(forwarder, monkeypatch):
+    fwd, tb = forwarder
+    tb.fail = True
+    monkeypatch.setattr(fwd_mod, "FWD_POLL_S", 0.01)
+    monkeypatch.setattr(fwd.outbox, "put_many", _broken_put)
+    received = datetime.utcnow()
+
+    async def go():
+        await fwd.coll.insert_many([_doc("a", 1, received), _doc("a", 2, received)])
+        await fwd.load_state()
+        task = asyncio.ensure_future(fwd.run_poll())
+        await asyncio.sleep(0.1)
+        fwd.stop()
+        await task
+        lost = await fwd.state_coll.find_one({})
+        # the outbox is back: the same page goes out and the watermark moves
+        monkeypatch.undo()
+        fwd._stopping.clear()
+        task = asyncio.ensure_future(fwd.run_poll())
+        await asyncio.sleep(0.1)
+        fwd.stop()
+        await task
+        return lost, await fwd.state_coll.find_one({}), await fwd.outbox.coll.count_documents({})
+
+    lost, saved, outboxed = run(go())
+    assert lost is None
+    assert saved["watermark"] >= received.replace(microsecond=received.microsecond // 1000 * 1000)
+    assert outboxed == 2
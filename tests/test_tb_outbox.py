@@ -0,0 +1,93 @@
+"""tb_outbox: per-token order, backoff, and per-token leases between dispatchers sharing one collection."""
+import asyncio
+
+from conftest import run
+from tb_outbox import Outbox, OutboxDispatcher
+
+
+class _TB:
+    def __init__(self, delay=0.0, fail_tokens=()):
+        self.delay = delay
+        self.fail_tokens = set(fail_tokens)
+        self.posts = []
+
+    def post_as(self, owner):
+        async def post(token, points):
+            self.posts.append((owner, token, [p["values"]["n"] for p in points]))
+            await asyncio.sleep(self.delay)
+            if token in self.fail_tokens:
+                raise RuntimeError("TB 5xx 503")
+        return post
+
+
+def _point(n):
+    return {"ts": 1700000000000 + n, "values": {"n": n}}
+
+
+async def _fill(outbox, tokens, ns):
+    for n in ns:
+        for t in tokens:
+            await outbox.put(t, _point(n))
+
+
+def test_two_dispatchers_never_send_a_token_twice(mongo_db):
+    tb = _TB(delay=0.02)
+    a, b = Outbox(mongo_db), Outbox(mongo_db)
+    da = OutboxDispatcher(a, tb.post_as("a"), batch=2)
+    db_ = OutboxDispatcher(b, tb.post_as("b"), batch=2)
+    held, free = ["tok-0", "tok-1", "tok-2"], ["tok-3", "tok-4", "tok-5"]
+
+    async def go():
+        await _fill(a, held, range(3))
+        round_a = asyncio.ensure_future(da.drain_once())
+        await asyncio.sleep(0.005)                # a holds the leases of `held` and is posting
+        await _fill(a, held, range(3, 5))
+        await _fill(a, free, range(5))
+        await db_.drain_once()
+        b_first = [tok for owner, tok, _ in tb.posts if owner == "b"]
+        await round_a
+        while await a.coll.count_documents({}):
+            await asyncio.gather(da.drain_once(), db_.drain_once())
+        return b_first, await a.leases.count_documents({})
+
+    b_first, leases = run(go())
+    assert set(b_first) == set(free)              # nothing of a's leased tokens
+    assert leases == 0
+    for t in held + free:
+        sent = [n for _, tok, pts in tb.posts if tok == t for n in pts]
+        assert sent == list(range(5))             # each point once, in order
+
+
+def test_leased_token_is_skipped_until_the_lease_expires(mongo_db):
+    a, b = Outbox(mongo_db, lease_s=0.05), Outbox(mongo_db, lease_s=0.05)
+
+    async def go():
+        await _fill(a, ["tok-1", "tok-2"], range(1))
+        assert await a.lease("tok-1")
+        held = await b.due()
+        await asyncio.sleep(0.06)
+        expired = await b.due()
+        return held, expired
+
+    held, expired = run(go())
+    assert list(held) == ["tok-2"]
+    assert sorted(expired) == ["tok-1", "tok-2"]
+
+
+def test_failed_batch_backs_off_and_keeps_order(mongo_db):
+    tb = _TB(fail_tokens={"tok-1"})
+    outbox = Outbox(mongo_db)
+    d = OutboxDispatcher(outbox, tb.post_as("a"), batch=2)
+
+    async def go():
+        await _fill(outbox, ["tok-1", "tok-2"], range(4))
+        await d.drain_once()
+        items = await outbox.coll.find({"token": "tok-1"}).sort("_id", 1).to_list(None)
+        # the failed chunk is in backoff – nothing newer of its token goes out meanwhile
+        return items, await outbox.due()
+
+    items, due = run(go())
+    assert [p for _, t, p in tb.posts if t == "tok-1"] == [[0, 1]]
+    assert [p for _, t, p in tb.posts if t == "tok-2"] == [[0, 1], [2, 3]]
+    assert [it["attempts"] for it in items] == [1, 1, 0, 0]
+    assert due == {}
@@ -0,0 +1,34 @@
+"""tb_sync_from_mongo.py leaves live data to a running tb_forwarder."""
+import datetime as dt
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import tb_sync_from_mongo as sync
+
+
+def _db(updated_min_ago):
+    db = mongomock.MongoClient()[sync.DB_NAME]
+    if updated_min_ago is not None:
+        at = dt.datetime.now(dt.timezone.utc) - dt.timedelta(minutes=updated_min_ago)
+        db[sync.FWD_STATE_COLL].insert_one({"_id": "measurements", "updated_at": at})
+    return db
+
+
+def test_forwarder_active_on_fresh_state():
+    assert sync.forwarder_active(_db(1))
+
+
+def test_forwarder_inactive_when_stale_or_missing():
+    assert not sync.forwarder_active(_db(sync.FWD_ACTIVE_MIN + 5))
+    assert not sync.forwarder_active(_db(None))
+
+
+def test_scheduled_run_skips_while_forwarder_runs(monkeypatch, capsys):
+    db = _db(1)
+    monkeypatch.setattr(sync, "TB_JWT", "jwt")
+    monkeypatch.setattr(sync, "MongoClient", lambda uri: db.client)
+    monkeypatch.setattr(sync, "sync_uuid", lambda *a: pytest.fail("scheduled run must not sync"))
+    sync.main([])
+    assert "skipping" in capsys.readouterr().out
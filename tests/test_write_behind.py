@@ -0,0 +1,109 @@
+"""write_behind.WriteBehindBuffer: group commit on size / linger, per-document outcome."""
+import asyncio, time
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError, WriteError
+
+from conftest import run
+import write_behind
+from write_behind import WriteBehindBuffer
+
+
+class _Coll:
+    name = "measurements"
+
+    def __init__(self, fail_index=(), error=None):
+        self.calls = []
+        self.fail_index = set(fail_index)
+        self.error = error
+
+    async def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        self.calls.append((time.monotonic(), [d["n"] for d in docs]))
+        if self.error is not None:
+            raise self.error
+        if self.fail_index:
+            raise BulkWriteError({"writeErrors": [{"index": i, "code": 11000, "errmsg": f"E11000 dup {i}"}
+                                                  for i in sorted(self.fail_index)]})
+
+
+def test_full_batch_is_flushed_without_waiting_for_linger():
+    coll = _Coll()
+    buf = WriteBehindBuffer(coll, batch_size=3, linger_ms=10_000)
+
+    async def go():
+        t0 = time.monotonic()
+        await asyncio.gather(*(buf.submit({"n": n}) for n in range(3)))
+        return time.monotonic() - t0
+
+    assert run(go()) < 1
+    assert [docs for _, docs in coll.calls] == [[0, 1, 2]]
+
+
+def test_partial_batch_is_flushed_after_linger():
+    coll = _Coll()
+    buf = WriteBehindBuffer(coll, batch_size=100, linger_ms=30)
+
+    async def go():
+        t0 = time.monotonic()
+        await asyncio.gather(*(buf.submit({"n": n}) for n in range(5)))
+        return t0
+
+    t0 = run(go())
+    assert [docs for _, docs in coll.calls] == [[0, 1, 2, 3, 4]]
+    assert coll.calls[0][0] - t0 >= 0.025
+    assert (buf.flushes, buf.flushed_docs, buf.queued_bytes) == (1, 5, 0)
+
+
+def test_bulk_write_errors_map_to_their_documents():
+    coll = _Coll(fail_index=(1, 3))
+    buf = WriteBehindBuffer(coll, batch_size=4, linger_ms=10_000)
+
+    async def go():
+        return await asyncio.gather(*(buf.submit({"n": n}) for n in range(4)), return_exceptions=True)
+
+    res = run(go())
+    assert res[0] is None and res[2] is None
+    for r in (res[1], res[3]):
+        assert isinstance(r, WriteError) and r.code == 11000
+    assert buf.flushed_docs == 2
+
+
+def test_whole_batch_fails_on_a_connection_error():
+    coll = _Coll(error=AutoReconnect("primary gone"))
+    buf = WriteBehindBuffer(coll, batch_size=2, linger_ms=10_000)
+
+    async def go():
+        return await asyncio.gather(*(buf.submit({"n": n}) for n in range(2)), return_exceptions=True)
+
+    assert all(isinstance(r, AutoReconnect) for r in run(go()))
+
+
+def test_submit_waits_for_room_when_bytes_are_capped():
+    coll = _Coll()
+    buf = WriteBehindBuffer(coll, batch_size=100, linger_ms=20, max_queued_bytes=40)
+
+    async def go():
+        await asyncio.gather(*(buf.submit({"n": n}) for n in range(4)))
+
+    run(go())
+    # {"n": 0} is 12 bytes of BSON: at most three fit, the fourth goes in the next batch
+    assert [docs for _, docs in coll.calls] == [[0, 1, 2], [3]]
+
+
+@pytest.mark.parametrize("wb_on", [True, False])
+def test_module_submit_with_and_without_buffer(wb_on):
+    coll = _Coll()
+    inserted = []
+
+    async def insert_one(doc):
+        inserted.append(doc["n"])
+
+    coll.insert_one = insert_one
+
+    async def go():
+        buf = WriteBehindBuffer(coll, linger_ms=1) if wb_on else None
+        await write_behind.submit(buf, coll, {"n": 7})
+
+    run(go())
+    assert (inserted, [d for _, d in coll.calls]) == (([], [[7]]) if wb_on else ([7], []))
@@ -0,0 +1,113 @@
+import os, asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import bson
+from pymongo.errors import BulkWriteError, WriteError
+
+# --- tunables (per collection buffer) ---
+WB_ENABLED          = os.getenv("WB_ENABLED", "1") == "1"
+WB_BATCH_SIZE       = int(os.getenv("WB_BATCH_SIZE", "200"))
+WB_LINGER_MS        = float(os.getenv("WB_LINGER_MS", "5"))
+WB_MAX_QUEUED_BYTES = int(os.getenv("WB_MAX_QUEUED_BYTES", str(8 * 1024 * 1024)))
+
+
+class WriteBehindBuffer:
+    """
+    Group-commit stage in front of one Motor collection.
+
+    submit() queues a document and waits until the batch it landed in was
+    acknowledged by insert_many(ordered=False), so callers keep the same
+    durability as insert_one. A batch is flushed when it reaches batch_size
+    documents or when the first queued document is linger_ms old, whichever
+    comes first. When max_queued_bytes is reached, submit() waits for room.
+    """
+
+    def __init__(self, coll, name: str = "",
+                 batch_size: int = WB_BATCH_SIZE,
+                 linger_ms: float = WB_LINGER_MS,
+                 max_queued_bytes: int = WB_MAX_QUEUED_BYTES):
+        self.coll = coll
+        self.name = name or getattr(coll, "name", "")
+        self.batch_size = max(1, batch_size)
+        self.linger_s = max(0.0, linger_ms) / 1000.0
+        self.max_queued_bytes = max_queued_bytes
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future, int]] = []
+        self._queued_bytes = 0
+        self._room = asyncio.Condition()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: set = set()
+        self.flushes = 0
+        self.flushed_docs = 0
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    @property
+    def queued_docs(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, doc: Dict[str, Any]) -> None:
+        size = len(bson.encode(doc))
+        if self._queued_bytes + size > self.max_queued_bytes and self._queued_bytes > 0:
+            async with self._room:
+                await self._room.wait_for(
+                    lambda: self._queued_bytes == 0 or self._queued_bytes + size <= self.max_queued_bytes)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, fut, size))
+        self._queued_bytes += size
+        if len(self._pending) >= self.batch_size:
+            self._kick()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.linger_s, self._kick)
+        await fut
+
+    def _kick(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future, int]]) -> None:
+        failed: Dict[int, BaseException] = {}
+        try:
+            await self.coll.insert_many([d for d, _, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for we in e.details.get("writeErrors", []):
+                failed[we["index"]] = WriteError(we.get("errmsg", "write failed"), we.get("code"), we)
+        except Exception as e:
+            failed = {i: e for i in range(len(batch))}
+
+        for i, (_, fut, _) in enumerate(batch):
+            if fut.done():
+                continue
+            if i in failed:
+                fut.set_exception(failed[i])
+            else:
+                fut.set_result(None)
+
+        self.flushes += 1
+        self.flushed_docs += len(batch) - len(failed)
+        async with self._room:
+            self._queued_bytes -= sum(size for _, _, size in batch)
+            self._room.notify_all()
+
+    async def flush(self) -> None:
+        """Push out whatever is queued and wait for all in-flight batches."""
+        self._kick()
+        if self._inflight:
+            await asyncio.gather(*list(self._inflight), return_exceptions=True)
+
+
+async def submit(buf: Optional[WriteBehindBuffer], coll, doc: Dict[str, Any]) -> None:
+    """Write through the buffer when write-behind is on, else plain insert_one."""
+    if buf is not None:
+        await buf.submit(doc)
+    else:
+        await coll.insert_one(doc)
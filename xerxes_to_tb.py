@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
-import os, time, json, logging
-from typing import Optional, Dict, Any
+import os, time, json, logging, asyncio
+from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone
 
-import requests
 from fastapi import FastAPI, Request, Header, HTTPException
-from dotenv import dotenv_values
+from fastapi.responses import PlainTextResponse
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
 
 # --- Konfigurácia z .env ---
-cfg = {**dotenv_values("/opt/xerxes-bridge/.env"), **os.environ}
-TB_HOST       = (cfg.get("TB_HOST") or "https://eu.thingsboard.cloud").rstrip("/")
+# .env ide do os.environ (už nastavené premenné majú prednosť): tb_client ju číta cez settings,
+# preto pred jeho importom aj defaulty tejto služby
+load_dotenv("/opt/xerxes-bridge/.env")
+for _k, _v in (("TB_HOST", "https://eu.thingsboard.cloud"), ("TB_TIMEOUT_S", "15"),
+               ("TB_POOL_PER_HOST", "16"), ("PROJECT_API_KEY", "")):
+    os.environ.setdefault(_k, _v)
+cfg = os.environ
+
+import metrics
+import tb_client
+from tb_batch import TBBatcher
+from tb_outbox import Outbox, OutboxDispatcher
+
+TB_HOST       = cfg["TB_HOST"].rstrip("/")
 BRIDGE_KEY    = cfg.get("BRIDGE_KEY", "")
 DEFAULT_TOKEN = cfg.get("TB_TOKEN", "")
 TOKENS_JSON   = cfg.get("PROJECT_TOKENS_JSON", "")
@@ -33,16 +46,11 @@ MONGODB_URI = cfg.get("MONGODB_URI")
 DB_NAME     = cfg.get("DB_NAME", "xerxes")
 COLL_TS     = cfg.get("COLL_TS", "measurements")
 
-ts_coll = None
-if MONGODB_URI:
-    try:
-        from pymongo import MongoClient
-        mc = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=3000)
-        # warmup ping
-        mc.admin.command("ping")
-        ts_coll = mc[DB_NAME][COLL_TS]
-    except Exception:
-        ts_coll = None  # nechceme blokovať Bridge, keď Mongo nie je k dispozícii
+# --- TB forwarder: push beží na pozadí, odpoveď na TB nečaká ---
+# spojenia na TB: zdieľaná session tb_client (TB_POOL_PER_HOST, TB_TIMEOUT_S, TB_KEEPALIVE_S, ...)
+TB_FORWARD_QUEUE  = int(cfg.get("TB_FORWARD_QUEUE") or 20000) # nad toto čakajúcich bodov ide nový rovno do outboxu
+
+ts_coll = None          # Motor kolekcia, nastaví startup (bez MONGODB_URI ostane None)
 
 # --- Logging ---
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
@@ -60,11 +68,6 @@ def flatten(d: Dict[str, Any], parent: str = "", sep: str = "_") -> Dict[str, An
             out[key] = v
     return out
 
-def post_tb(token: str, telemetry: Dict[str, Any]):
-    url = f"{TB_HOST}/api/v1/{token}/telemetry"
-    r = requests.post(url, json=telemetry, timeout=15)
-    r.raise_for_status()
-
 def now_dt() -> datetime:
     return datetime.now(timezone.utc)
 
@@ -98,9 +101,82 @@ def ensure_struct(body: Dict[str, Any], project_id: str) -> Dict[str, Any]:
     }
     return doc
 
+# --- TB outbox: pushes TB did not take wait in Mongo (tb_outbox) and are retried ---
+outbox: Optional[Outbox] = None
+outbox_dispatcher: Optional[OutboxDispatcher] = None
+# live pushes: batched per token, at most TB_POOL_PER_HOST POSTs to TB at once
+tb_batcher: Optional[TBBatcher] = None
+
+@app.on_event("startup")
+async def _startup():
+    global ts_coll, tb_batcher, outbox, outbox_dispatcher
+    tb_batcher = TBBatcher(post=tb_client.post_telemetry_batch, on_failure=_tb_batch_failed)
+    if not MONGODB_URI:
+        log.warning("Mongo disabled (no MONGODB_URI) – no persist, failed TB pushes are lost")
+        return
+    from motor.motor_asyncio import AsyncIOMotorClient
+    # Motor sa pripája lazy – štart nečaká na Mongo
+    db = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=3000)[DB_NAME]
+    ts_coll = db[COLL_TS]
+    outbox = Outbox(db)
+    await outbox.ensure_indexes()
+    try:
+        await outbox.refresh_stats()
+    except PyMongoError as e:
+        log.warning("TB outbox stats unavailable: %s", e)
+    outbox_dispatcher = OutboxDispatcher(outbox, tb_client.post_telemetry_batch)
+    outbox_dispatcher.start()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if tb_batcher is not None:
+        await tb_batcher.flush()        # rozbehnuté body dopošli (zlyhané → outbox)
+    if outbox_dispatcher is not None:
+        await outbox_dispatcher.stop()
+
+# TB session (tb_client) sa otvorí po _startup a zavrie až po _shutdown (dávky sa stihnú dopchať)
+tb_client.bind_app(app)
+
+async def _tb_batch_failed(token: str, points: List[Dict[str, Any]], e: BaseException) -> None:
+    if outbox is None:
+        log.error("TB push failed, %d points lost: %s", len(points), e)
+        return
+    try:
+        await outbox.put_many(token, points, f"{type(e).__name__}: {e}")
+    except PyMongoError as e2:
+        log.error("TB outbox put failed, %d points lost: %s", len(points), e2)
+
+async def persist(doc: Dict[str, Any]) -> None:
+    if ts_coll is None:
+        return
+    try:
+        await ts_coll.insert_one(doc)
+    except PyMongoError as e:
+        log.warning("Mongo insert failed: %s", e)
+
+async def queue_tb(token: str, point: Dict[str, Any], reason: str) -> bool:
+    if outbox is None:
+        return False
+    try:
+        await outbox.put(token, point, reason)
+        return True
+    except PyMongoError as e:
+        log.error("TB outbox put failed: %s", e)
+        return False
+
 @app.get("/health")
 def health():
-    return {"status": "ok", "tb_host": TB_HOST, "mapped_projects": len(PROJECT_TOKENS)}
+    out = {"status": "ok", "tb_host": TB_HOST, "mapped_projects": len(PROJECT_TOKENS)}
+    if tb_batcher is not None:
+        out["tb_forward_queued"] = tb_batcher.queued
+    if outbox is not None:
+        out["tb_outbox"] = {"depth": outbox.depth,
+                            "oldest_at": outbox.oldest_at.isoformat() if outbox.oldest_at else None}
+    return out
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/api/measurements/{project_id}/insert_one")
 async def insert_one(project_id: str, request: Request, x_api_key: Optional[str] = Header(None)):
@@ -135,20 +211,15 @@ async def insert_one(project_id: str, request: Request, x_api_key: Optional[str]
     # log pre debuggovanie routingu
     log.info("project_id=%s, keys=%s", project_id, list(telemetry.keys())[:12])
 
-    # 2) persist do Mongo (best-effort)
-    if ts_coll is not None:
-        try:
-            ts_coll.insert_one(doc)
-        except Exception as e:
-            log.warning("Mongo insert failed: %s", e)
-
-    # 3) push do TB (best-effort, nepadáme 502 – vrátime queued)
-    forwarded = False
-    try:
-        post_tb(token, telemetry)
-        forwarded = True
-    except Exception as e:
-        log.error("TB push failed: %s", e)
-        forwarded = False
-
-    return {"status": "ok" if forwarded else "queued", "project_id": project_id}
+    # 2) push do TB na pozadí (batcher; čo TB nezoberie, ide do outboxu) + 3) persist do Mongo súbežne
+    # ts pri prijatí, aby neskoré doručenie z outboxu sedelo v čase
+    point = {"ts": int(time.time() * 1000), "values": telemetry}
+    busy = tb_batcher.queued >= TB_FORWARD_QUEUE
+    if busy or (outbox is not None and outbox.backlogged(token)):
+        # staršie body tohto tokenu ešte čakajú (poradie) alebo TB nestíha – nový ide do outboxu
+        queued, _ = await asyncio.gather(queue_tb(token, point, "busy" if busy else "backlog"), persist(doc))
+        return {"status": "queued" if queued else "failed", "project_id": project_id}
+
+    tb_batcher.submit(token, point)
+    await persist(doc)
+    return {"status": "ok", "project_id": project_id}